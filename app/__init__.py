@@ -6,6 +6,10 @@ def create_app():
     # Assuming run.py is in the root and templates is in the root
     app = Flask(__name__, template_folder='../templates')
     app.config.from_object(Config)
+    if Config.TRUSTED_PROXY_COUNT:
+        # Take the client address from X-Forwarded-For, as far as our own proxies vouch for it
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXY_COUNT)
 
     # Configure Logging
     import logging
@@ -20,38 +24,36 @@ def create_app():
     from .routes import main_bp
     app.register_blueprint(main_bp)
 
+    # Background threads start here rather than on import, so importing the app stays cheap.
+    # Recovery of interrupted jobs, the workers and maintenance only run with START_WORKERS
+    from .services.background import start_background
+    start_background(workers=Config.START_WORKERS)
+
     # Initialize Flasgger for API documentation
-    from flasgger import Swagger
-    swagger = Swagger(app, template={
-        'info': {
-            'title': 'Music Query API',
-            'description': 'API for downloading music from YouTube and other platforms',
-            'version': '1.0'
-        },
-        'swagger': '2.0'
-    })
-
-    from .translations import TRANSLATIONS
+    if Config.ENABLE_SWAGGER:
+        from flasgger import Swagger
+        swagger = Swagger(app, template={
+            'info': {
+                'title': 'Music Query API',
+                'description': 'API for downloading music from YouTube and other platforms',
+                'version': '1.0'
+            },
+            'swagger': '2.0'
+        })
+
+    from .translations import TRANSLATIONS, get_locale as resolve_locale
     from flask import request
 
     def get_locale():
-        # 1. Check cookie
-        lang = request.cookies.get('lang')
-        if lang in TRANSLATIONS:
-            return lang
-        
-        # 2. Check Accept-Language header
-        match = request.accept_languages.best_match(TRANSLATIONS.keys())
-        if match:
-            return match
-            
-        return 'en'
+        # Cookie first, then Accept-Language (memoized per header value)
+        return resolve_locale(request.cookies.get('lang'), request.headers.get('Accept-Language'))
 
     @app.context_processor
     def inject_translate():
+        strings = TRANSLATIONS.get(get_locale(), TRANSLATIONS['en'])
+
         def translate(key):
-            locale = get_locale()
-            return TRANSLATIONS.get(locale, TRANSLATIONS['en']).get(key, key)
+            return strings.get(key, key)
         return dict(_=translate, get_locale=get_locale, available_locales=list(TRANSLATIONS.keys()))
 
     return app
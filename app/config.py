@@ -11,10 +11,30 @@ class Config:
     FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-key-please-change-in-prod')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    # Swagger UI at /apidocs. Flasgger adds noticeably to startup, turn it off where nobody reads the docs
+    ENABLE_SWAGGER = os.getenv('ENABLE_SWAGGER', 'True').lower() == 'true'
+
+    # Job progress streaming (/job/<id>/events): connections are recycled after
+    # SSE_MAX_DURATION seconds and send a keep-alive comment every SSE_KEEPALIVE seconds
+    SSE_MAX_DURATION = int(os.getenv('SSE_MAX_DURATION', 300))
+    SSE_KEEPALIVE = int(os.getenv('SSE_KEEPALIVE', 15))
+    # Open streams per process, each holds a server thread: keep it below gunicorn's --threads.
+    # Further streams get 503 and the web UI polls instead
+    SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 2))
+    # Minimum seconds between download progress updates of one job
+    PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 0.25))
+    # /job/<id> and /status answer with weak ETags and reuse their serialized JSON while nothing
+    # changed: up to RESPONSE_CACHE_SIZE bodies are kept. /status also reports counters that are not
+    # versioned (caches, disk space), its body is rebuilt at least every STATUS_CACHE_SECONDS (0 = always)
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    STATUS_CACHE_SECONDS = float(os.getenv('STATUS_CACHE_SECONDS', 2))
 
     # App Settings
     DOWNLOAD_DIR = os.getenv('DOWNLOAD_DIR', 'downloads') # Final Destination
     STAGING_DIR = os.getenv('STAGING_DIR', 'staging')     # Temp folder
+    DATA_DIR = os.getenv('DATA_DIR', 'data')              # Caches and internal state
+    # Full rescan period of the /files index (inotify_simple, if installed, catches changes sooner)
+    FILE_INDEX_RESCAN_INTERVAL = int(os.getenv('FILE_INDEX_RESCAN_INTERVAL', 60))
     
     # Integrations
     USE_BEETS = os.getenv('USE_BEETS', 'False').lower() == 'true'
@@ -22,13 +42,105 @@ class Config:
     # Performance / Hardware
     # Limits for low-end hardware
     MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 1))
+    # Worker pools for the other pipeline stages and the hand-off queue size between them
+    RESOLVE_WORKERS = int(os.getenv('RESOLVE_WORKERS', 2))
+    # Playlist tracks are single-file jobs, so post-processing only runs in parallel across jobs:
+    # 0 runs one job per post-processing process (POSTPROCESS_PROCESSES, else one per CPU core)
+    POSTPROCESS_WORKERS = (int(os.getenv('POSTPROCESS_WORKERS', 0))
+                           or int(os.getenv('POSTPROCESS_PROCESSES', 0)) or os.cpu_count() or 1)
+    IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', 1))
+    STAGE_QUEUE_SIZE = int(os.getenv('STAGE_QUEUE_SIZE', 2))
+    # Admission control: downloads pause while STAGING_DIR or DOWNLOAD_DIR would have less than
+    # MIN_FREE_SPACE_MB free after the running jobs' estimated sizes (0 disables the check).
+    # DEFAULT_TRACK_SIZE_MB is reserved when yt-dlp reports no size, DOWNLOAD_RATE_LIMIT (KiB/s)
+    # is shared by all downloads of a process (0 = unlimited)
+    MIN_FREE_SPACE_MB = int(os.getenv('MIN_FREE_SPACE_MB', 1024))
+    DEFAULT_TRACK_SIZE_MB = int(os.getenv('DEFAULT_TRACK_SIZE_MB', 15))
+    DOWNLOAD_RATE_LIMIT = int(os.getenv('DOWNLOAD_RATE_LIMIT', 0))
+
+    # Playlists/albums run as one child job per track: at most PLAYLIST_CONCURRENCY
+    # tracks of a playlist in the pipeline at once, each retried TRACK_RETRIES times
+    PLAYLIST_FANOUT = os.getenv('PLAYLIST_FANOUT', 'True').lower() == 'true'
+    PLAYLIST_CONCURRENCY = int(os.getenv('PLAYLIST_CONCURRENCY', 2))
+    TRACK_RETRIES = int(os.getenv('TRACK_RETRIES', 2))
+    # Single tracks are scheduled ahead of playlist tracks, clients take turns within a class.
+    # A waiting job moves up one class every PRIORITY_AGING seconds (0 disables aging)
+    PRIORITY_AGING = int(os.getenv('PRIORITY_AGING', 600))
+    # Reverse proxies in front of the app. Clients are told apart by the address the nearest of
+    # them saw in X-Forwarded-For; 0 ignores the header, which any client can set
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+
+    # /download/batch: links per request and links of one batch in progress at once
+    BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 1000))
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+
+    # Job persistence: 'sqlite' survives restarts, 'memory' does not
+    JOB_STORE = os.getenv('JOB_STORE', 'sqlite').lower()
+    if JOB_STORE not in ('sqlite', 'memory'):
+        raise ValueError(f"Invalid JOB_STORE: {JOB_STORE}. Must be one of: sqlite, memory")
+    JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', os.path.join(DATA_DIR, 'jobs.sqlite3'))
+    JOB_STORE_FLUSH_INTERVAL = float(os.getenv('JOB_STORE_FLUSH_INTERVAL', 0.5))
+    JOB_RETENTION = int(os.getenv('JOB_RETENTION', 7 * 24 * 3600))  # Keep finished jobs for a week
+    # In-memory job statuses: lock shards, and how many/how long finished jobs stay in memory
+    # (older ones are answered from the job store)
+    STATUS_SHARDS = int(os.getenv('STATUS_SHARDS', 16))
+    STATUS_MAX_ENTRIES = int(os.getenv('STATUS_MAX_ENTRIES', 10000))
+    STATUS_MAX_AGE = int(os.getenv('STATUS_MAX_AGE', 3600))
+
+    # Queue backend: 'local' keeps stage queues in this process (gunicorn -w 1 only),
+    # 'sqlite' shares them through the job store so several gunicorn workers and
+    # standalone worker.py processes can enqueue, claim and report on the same jobs
+    QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'local').lower()
+    if QUEUE_BACKEND not in ('local', 'sqlite'):
+        raise ValueError(f"Invalid QUEUE_BACKEND: {QUEUE_BACKEND}. Must be one of: local, sqlite")
+    QUEUE_LEASE_SECONDS = int(os.getenv('QUEUE_LEASE_SECONDS', 60))
+    QUEUE_POLL_INTERVAL = float(os.getenv('QUEUE_POLL_INTERVAL', 0.5))
+    # Set to False in web processes when dedicated worker.py processes do the downloading
+    START_WORKERS = os.getenv('START_WORKERS', 'True').lower() == 'true'
+
+    # Post-processing: 'process' transcodes/tags in a process pool after the download,
+    # 'inline' lets yt-dlp run FFmpeg on the download thread
+    POSTPROCESS_MODE = os.getenv('POSTPROCESS_MODE', 'process').lower()
+    if POSTPROCESS_MODE not in ('process', 'inline'):
+        raise ValueError(f"Invalid POSTPROCESS_MODE: {POSTPROCESS_MODE}. Must be one of: process, inline")
+    POSTPROCESS_PROCESSES = int(os.getenv('POSTPROCESS_PROCESSES', 0))  # 0 = one per CPU core
+    PROCESS_NICE_VALUE = int(os.getenv('PROCESS_NICE_VALUE', 10))
+    # Staging -> library moves: files copied at once when the library is on another filesystem
+    TRANSFER_WORKERS = int(os.getenv('TRANSFER_WORKERS', 2))
+    TRANSFER_FSYNC = os.getenv('TRANSFER_FSYNC', 'True').lower() == 'true'
     REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', 10))
 
     # External APIs
     ODESLI_API_URL = os.getenv('ODESLI_API_URL', 'https://api.song.link/v1-alpha.1/links?url=')
+    ODESLI_API_KEY = os.getenv('ODESLI_API_KEY') or None
+    # Odesli allows 10 requests/minute without an API key
+    ODESLI_RATE_LIMIT = float(os.getenv('ODESLI_RATE_LIMIT', 10))  # requests per minute
+    ODESLI_RATE_BURST = int(os.getenv('ODESLI_RATE_BURST', 5))
+    ODESLI_MAX_RETRIES = int(os.getenv('ODESLI_MAX_RETRIES', 3))
+    # Links are resolved in the background from the moment they are submitted, this many at once
+    RESOLVE_CONCURRENCY = int(os.getenv('RESOLVE_CONCURRENCY', 4))
+
+    # Odesli resolution cache (set RESOLVE_CACHE_PATH empty to keep it in memory only)
+    RESOLVE_CACHE_PATH = os.getenv('RESOLVE_CACHE_PATH', os.path.join(DATA_DIR, 'resolve_cache.sqlite3'))
+    RESOLVE_CACHE_SIZE = int(os.getenv('RESOLVE_CACHE_SIZE', 1024))
+    RESOLVE_CACHE_TTL = int(os.getenv('RESOLVE_CACHE_TTL', 7 * 24 * 3600))
+    RESOLVE_CACHE_NEGATIVE_TTL = int(os.getenv('RESOLVE_CACHE_NEGATIVE_TTL', 3600))
+
+    # IDs of tracks already in the library, in yt-dlp download_archive format (empty to disable)
+    DOWNLOAD_ARCHIVE = os.getenv('DOWNLOAD_ARCHIVE', os.path.join(DATA_DIR, 'download_archive.txt'))
+
+    # Tag index of DOWNLOAD_DIR behind /search: rescanned every LIBRARY_RESCAN_INTERVAL seconds,
+    # changed files are read on LIBRARY_INDEX_WORKERS threads
+    LIBRARY_INDEX_PATH = os.getenv('LIBRARY_INDEX_PATH', os.path.join(DATA_DIR, 'library.sqlite3'))
+    LIBRARY_INDEX_WORKERS = int(os.getenv('LIBRARY_INDEX_WORKERS', 4))
+    LIBRARY_RESCAN_INTERVAL = int(os.getenv('LIBRARY_RESCAN_INTERVAL', 3600))
 
     # Tool Arguments
     BEETS_ARGS = shlex.split(os.getenv('BEETS_ARGS', 'import -q'))
+    # Jobs' directories are imported together: a batch runs BEETS_BATCH_WINDOW seconds after its
+    # first directory or once BEETS_BATCH_SIZE directories are waiting
+    BEETS_BATCH_WINDOW = float(os.getenv('BEETS_BATCH_WINDOW', 2))
+    BEETS_BATCH_SIZE = int(os.getenv('BEETS_BATCH_SIZE', 10))
 
     # Audio Download Settings
     AUDIO_CODEC = os.getenv('AUDIO_CODEC', 'm4a')
@@ -39,11 +151,14 @@ class Config:
     # yt-dlp Logging
     YTDL_QUIET = os.getenv('YTDL_QUIET', 'True').lower() == 'true'
     YTDL_NO_WARNINGS = os.getenv('YTDL_NO_WARNINGS', 'True').lower() == 'true'
+    # Jobs served by one warm YoutubeDL instance before it is rebuilt, 0 = a new one per job
+    YTDL_MAX_REUSE = int(os.getenv('YTDL_MAX_REUSE', 50))
 
 
 # Download job stages
 class JobStage:
     RESOLVING_URL = 'resolving_url'
+    PLAYLIST = 'playlist'
     DOWNLOADING = 'downloading'
     POSTPROCESSING = 'postprocessing'
     BEETS_IMPORT = 'beets_import'
@@ -1,18 +1,58 @@
-from flask import Blueprint, render_template, request, jsonify, send_from_directory, redirect, make_response, current_app
+from flask import Blueprint, render_template, request, jsonify, send_from_directory, redirect, make_response, current_app, Response, stream_with_context
 from urllib.parse import urlparse
+import hashlib
+import json
 import os
+import threading
+import time
 from .config import Config
 from .services.queue import job_queue
-from .services.downloader import download_task
+from .services.cache import resolution_cache
+from .services.odesli import odesli_client
+from .services.resolver import resolver
+from .services.transfer import transfer_engine
+from .services.integrations import import_batcher
+from .services.ytdl import ytdl_pool
+from .services.admission import admission
+from .services.metrics import REGISTRY
+from .services.files import staging_index
+from .services.library import library_index
+from .services.responses import response_cache
+from .services.downloader import download_pipeline, batch_pipeline, request_key
 
 main_bp = Blueprint('main', __name__)
 
 
 def get_translation(key: str) -> str:
     """Get translation for a key, respecting user's locale."""
-    from .translations import TRANSLATIONS
-    lang = request.cookies.get('lang') or request.accept_languages.best_match(TRANSLATIONS.keys()) or 'en'
-    return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
+    from .translations import TRANSLATIONS, get_locale
+    lang = get_locale(request.cookies.get('lang'), request.headers.get('Accept-Language'))
+    return TRANSLATIONS[lang].get(key, key)
+
+
+def versioned_json(key: str, version, build):
+    """
+    A JSON response with a weak ETag for `key` at `version`: 304 if the client already has it,
+    else the body cached for that version, or build() serialized and cached.
+    """
+    etag = f'{key}-{version}'
+    if request.if_none_match.contains_weak(etag):
+        response_cache.count_not_modified()
+        response = make_response('', 304)
+    else:
+        body = response_cache.get(key, version)
+        if body is None:
+            body = current_app.json.dumps(build()) + '\n'
+            response_cache.put(key, version, body)
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def client_id() -> str:
+    """Identifies the submitter for fair scheduling. Behind TRUSTED_PROXY_COUNT proxies, ProxyFix has set remote_addr."""
+    return request.remote_addr
 
 
 def is_valid_url(url: str) -> bool:
@@ -85,7 +125,7 @@ def download():
         description: Music URL to download
     responses:
       200:
-        description: Download queued successfully
+        description: Download queued successfully (or the id of an identical in-flight download)
         schema:
           id: DownloadQueued
           properties:
@@ -106,14 +146,107 @@ def download():
     if not is_valid_url(url):
         return jsonify({'error': get_translation('error_invalid_url')}), 400
 
-    # Add to queue
-    job_id = job_queue.add_job(download_task, url, include_job_id=True)
+    # Add to queue, or hand back the job already working on the same track/playlist
+    job_id = job_queue.add_job(download_pipeline, url=url, dedupe_key=request_key(url), client=client_id())
+    # Start the Odesli lookup now, the job's resolve step picks up the result
+    resolver.prefetch(url)
 
     return jsonify({
         'message': get_translation('download_queued'),
         'job_id': job_id
     })
 
+def _batch_urls():
+    """URLs of a batch request: a JSON array (or {"urls": [...]}), an uploaded file or a text body, one per line."""
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('urls')
+        return [str(url) for url in data] if isinstance(data, list) else []
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8', errors='replace')
+    else:
+        text = request.form.get('urls') or request.get_data(as_text=True)
+    return text.splitlines()
+
+@main_bp.route('/download/batch', methods=['POST'])
+def download_batch():
+    """
+    Queue many downloads at once, as one batch job
+    ---
+    tags:
+      - Downloads
+    consumes:
+      - application/json
+      - text/plain
+      - multipart/form-data
+    parameters:
+      - in: body
+        name: urls
+        description: JSON array of URLs (or {"urls": [...]}), or newline-delimited text; a 'file' upload also works
+        schema:
+          type: array
+          items:
+            type: string
+    responses:
+      200:
+        description: Batch queued. Poll /job/<batch_id> or stream /job/<batch_id>/events, per-link state is in 'tracks'
+        schema:
+          id: BatchQueued
+          properties:
+            batch_id:
+              type: string
+              format: uuid
+            accepted:
+              type: integer
+            duplicates:
+              type: array
+              items:
+                type: string
+            invalid:
+              type: array
+              items:
+                type: string
+      400:
+        description: No valid URL provided
+      413:
+        description: More than BATCH_MAX_URLS URLs
+    """
+    urls, invalid, duplicates, keys = [], [], [], set()
+    for line in _batch_urls():
+        url = line.strip()
+        if not url or url.startswith('#'):
+            continue
+        if not is_valid_url(url):
+            invalid.append(url)
+            continue
+        key = request_key(url)
+        if key in keys:
+            duplicates.append(url)
+            continue
+        keys.add(key)
+        urls.append(url)
+
+    if not urls:
+        return jsonify({'error': get_translation('error_no_url'), 'invalid': invalid}), 400
+    if len(urls) > Config.BATCH_MAX_URLS:
+        return jsonify({'error': get_translation('error_too_many_urls'), 'max': Config.BATCH_MAX_URLS}), 413
+
+    # Submitting the same set of links again returns the batch already working on them
+    batch_key = 'batch ' + hashlib.sha1('\n'.join(sorted(keys)).encode()).hexdigest()
+    batch_id = job_queue.add_job(batch_pipeline, urls=urls, dedupe_key=batch_key, client=client_id())
+    for url in urls:
+        resolver.prefetch(url)
+
+    return jsonify({
+        'message': get_translation('download_queued'),
+        'batch_id': batch_id,
+        'job_id': batch_id,
+        'accepted': len(urls),
+        'duplicates': duplicates,
+        'invalid': invalid,
+    })
+
 @main_bp.route('/job/<job_id>')
 def job_status(job_id):
     """
@@ -128,6 +261,16 @@ def job_status(job_id):
         format: uuid
         required: true
         description: Job ID returned from /download
+      - in: query
+        name: since
+        type: integer
+        required: false
+        description: Long-poll, answer once the job's version is newer than this
+      - in: query
+        name: wait
+        type: integer
+        required: false
+        description: Maximum seconds to wait when long-polling (default 25, max 60)
     responses:
       200:
         description: Job status
@@ -143,13 +286,172 @@ def job_status(job_id):
             message:
               type: string
               example: "Downloading"
+            version:
+              type: integer
+              example: 7
+            progress:
+              type: object
+            duplicate_of:
+              type: string
+              description: Set when this request was coalesced into another job, whose status is shown
+      304:
+        description: Unchanged since the version in If-None-Match (the ETag of an earlier response)
+      404:
+        description: Job not found
+    """
+    since = request.args.get('since', type=int)
+    if since is not None:
+        wait = min(max(request.args.get('wait', 25, type=int), 0), 60)
+        status = job_queue.wait_for_status(job_id, since, timeout=wait)
+        if status is None:
+            return jsonify({'error': get_translation('error_not_found')}), 404
+        return versioned_json(f'job-{job_id}', status.get('version', 0), lambda: status)
+    # Plain polls compare versions first and only copy the status when it changed
+    version = job_queue.get_job_version(job_id)
+    if version is None:
+        return jsonify({'error': get_translation('error_not_found')}), 404
+    return versioned_json(f'job-{job_id}', version, lambda: job_queue.get_job_status(job_id) or {})
+
+# Open event streams of this process. Each holds a server thread, the cap keeps threads for other requests
+event_streams = threading.BoundedSemaphore(max(1, Config.SSE_MAX_STREAMS))
+# Jobs one /jobs/events stream may watch
+MAX_STREAM_JOBS = 50
+
+
+def _status_events(job_ids, versions, event_id):
+    """
+    Server-Sent Events for the status changes of several jobs, until all of them completed or
+    failed or SSE_MAX_DURATION passes. A single job is waited for on its status, several are
+    checked every PROGRESS_INTERVAL by comparing versions, which takes no lock.
+    :param versions: job_id -> version the client already has, updated as events are sent
+    :param event_id: builds the SSE id from versions, sent back as Last-Event-ID on reconnect
+    """
+    # A reconnecting client may already have the final status of some jobs
+    watching = [job_id for job_id in job_ids if not (
+        versions.get(job_id) and versions[job_id] >= (job_queue.get_job_version(job_id) or 0)
+        and (job_queue.get_job_status(job_id) or {}).get('state') in ('completed', 'failed'))]
+    deadline = time.monotonic() + Config.SSE_MAX_DURATION
+    quiet_since = time.monotonic()
+    while watching and time.monotonic() < deadline:
+        sent = False
+        for job_id in list(watching):
+            version = job_queue.get_job_version(job_id)
+            if version is None:
+                watching.remove(job_id)
+                yield f"event: missing\ndata: {json.dumps({'job_id': job_id})}\n\n"
+                continue
+            if version <= versions.get(job_id, 0):
+                continue
+            status = job_queue.get_job_status(job_id) or {}
+            versions[job_id] = status.get('version', version)
+            sent = True
+            yield f"id: {event_id(versions)}\nevent: status\ndata: {json.dumps({**status, 'job_id': job_id})}\n\n"
+            if status.get('state') in ('completed', 'failed'):
+                watching.remove(job_id)
+        if sent or not watching:
+            quiet_since = time.monotonic()
+            continue
+        if time.monotonic() - quiet_since >= Config.SSE_KEEPALIVE:
+            quiet_since = time.monotonic()
+            yield ': keepalive\n\n'
+        if len(watching) == 1:
+            remaining = quiet_since + Config.SSE_KEEPALIVE - time.monotonic()
+            job_queue.wait_for_status(watching[0], versions.get(watching[0], 0), timeout=max(remaining, 0))
+        else:
+            time.sleep(Config.PROGRESS_INTERVAL)
+
+
+def _event_stream(events):
+    """A text/event-stream response holding one of the SSE_MAX_STREAMS stream slots, or 503 if none is free."""
+    if not event_streams.acquire(blocking=False):
+        # EventSource gives up on a 503, the page falls back to polling /job/<id>
+        response = jsonify({'error': get_translation('error_too_many_streams')})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(Config.SSE_KEEPALIVE)
+        return response
+    response = Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Released when the server closes the response, even if the stream never started
+    response.call_on_close(event_streams.release)
+    return response
+
+
+@main_bp.route('/job/<job_id>/events')
+def job_events(job_id):
+    """
+    Stream a job's status changes as Server-Sent Events.
+    ---
+    tags:
+      - Downloads
+    produces:
+      - text/event-stream
+    parameters:
+      - in: path
+        name: job_id
+        type: string
+        format: uuid
+        required: true
+        description: Job ID returned from /download
+    responses:
+      200:
+        description: "'status' events carrying the JobStatus JSON, until the job completes or fails"
       404:
         description: Job not found
+      503:
+        description: SSE_MAX_STREAMS streams are open already, poll /job/<id> instead
     """
-    status = job_queue.get_job_status(job_id)
-    if status is None:
+    if job_queue.get_job_version(job_id) is None:
         return jsonify({'error': get_translation('error_not_found')}), 404
-    return jsonify(status)
+
+    # EventSource resends the last id on reconnect, skip what the client already has
+    try:
+        version = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        version = 0
+    return _event_stream(_status_events([job_id], {job_id: version}, lambda versions: versions[job_id]))
+
+@main_bp.route('/jobs/events')
+def jobs_events():
+    """
+    Stream the status changes of several jobs over one Server-Sent Events connection.
+    ---
+    tags:
+      - Downloads
+    produces:
+      - text/event-stream
+    parameters:
+      - in: query
+        name: id
+        type: array
+        items:
+          type: string
+        collectionFormat: multi
+        required: true
+        description: Job IDs returned from /download (up to 50)
+    responses:
+      200:
+        description: >
+          'status' events carrying a JobStatus JSON with its job_id, until every job completes
+          or fails; a 'missing' event for unknown jobs
+      400:
+        description: No job IDs, or too many
+      503:
+        description: SSE_MAX_STREAMS streams are open already, poll /job/<id> instead
+    """
+    job_ids = list(dict.fromkeys(request.args.getlist('id')))
+    if not job_ids or len(job_ids) > MAX_STREAM_JOBS:
+        return jsonify({'error': get_translation('error_invalid_job_ids'), 'max': MAX_STREAM_JOBS}), 400
+
+    # The event id lists 'job_id:version' pairs, EventSource resends the last one on reconnect
+    versions = {}
+    for pair in request.headers.get('Last-Event-ID', '').split(','):
+        job_id, _, version = pair.rpartition(':')
+        if job_id in job_ids and version.isdigit():
+            versions[job_id] = int(version)
+
+    def event_id(versions):
+        return ','.join(f'{job_id}:{version}' for job_id, version in versions.items())
+    return _event_stream(_status_events(job_ids, versions, event_id))
 
 @main_bp.route('/status')
 def status():
@@ -169,43 +471,186 @@ def status():
               example: 2
             current_job:
               type: object
+            stages:
+              type: object
+              description: Per-stage worker count, busy workers, queue depth, average step time and utilization
+            queued_jobs:
+              type: array
+              description: Waiting jobs with their stage, queue position, priority and estimated wait in seconds
+            statuses:
+              type: object
+              description: Job statuses held in memory, their cap and how many were evicted
+            resolve_cache:
+              type: object
+              description: Odesli resolution cache hit/miss counters
+            odesli:
+              type: object
+              description: Odesli request latency, 429 and retry counters
+            resolver:
+              type: object
+              description: Background lookups in flight, started, and joined by resolve steps
+            transfer:
+              type: object
+              description: Files and bytes moved into the library and copy throughput
+            beets:
+              type: object
+              description: Batched beets imports, batch sizes and import latency
+            ytdl:
+              type: object
+              description: YoutubeDL instances created, reused and recycled by the download workers
+            library:
+              type: object
+              description: Tracks in the search index, rescans and files read
+            admission:
+              type: object
+              description: >
+                Whether downloads are being admitted, free and reserved disk space, time paused
+                for low disk space, jobs that waited for or could not get space, and the download
+                rate limit with the time downloads were throttled
+            responses:
+              type: object
+              description: Cached /job and /status bodies, cache hits and misses, and 304 answers
+      304:
+        description: Unchanged since the version in If-None-Match (the ETag of an earlier response)
+    """
+    def build():
+        status = job_queue.get_status()
+        status['resolve_cache'] = resolution_cache.stats()
+        status['odesli'] = odesli_client.stats()
+        status['resolver'] = resolver.stats()
+        status['transfer'] = transfer_engine.stats()
+        status['beets'] = import_batcher.stats()
+        status['ytdl'] = ytdl_pool.stats()
+        status['library'] = library_index.stats()
+        status['admission'] = admission.stats()
+        status['responses'] = response_cache.stats()
+        return status
+
+    if not Config.STATUS_CACHE_SECONDS:
+        return jsonify(build())
+    # The queue's version covers jobs and workers, the other counters refresh once per period.
+    # It counts from 0 in every process, hence the epoch
+    period = int(time.time() // Config.STATUS_CACHE_SECONDS)
+    return versioned_json('status', f'{response_cache.epoch}.{job_queue.version}.{period}', build)
+
+@main_bp.route('/metrics')
+def metrics():
     """
-    return jsonify(job_queue.get_status())
+    Prometheus metrics.
+    ---
+    tags:
+      - System
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          Histograms of stage durations, step durations, queue wait, Odesli latency, downloaded
+          file sizes and JobQueue lock wait/hold times, plus per-stage worker gauges, in the
+          Prometheus text format
+    """
+    return Response(REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @main_bp.route('/files')
 def list_files():
-    files = []
-    # Ensure dir exists
-    os.makedirs(Config.STAGING_DIR, exist_ok=True)
-
-    for root, dirs, filenames in os.walk(Config.STAGING_DIR):
-        for filename in filenames:
-            rel_dir = os.path.relpath(root, Config.STAGING_DIR)
-            if rel_dir == '.':
-                rel_path = filename
-            else:
-                rel_path = os.path.join(rel_dir, filename)
-            
-            # Create display name: show album/filename, skip the timestamp folder
-            parts = rel_path.split(os.sep)
-            if len(parts) > 2:
-                # Format: album/filename (skip timestamp)
-                display_name = os.path.join(parts[1], parts[2])
-            elif len(parts) == 2:
-                # Format: album/filename (if already in this format)
-                display_name = os.path.join(parts[0], parts[1])
-            else:
-                # Just filename
-                display_name = filename
-            
-            files.append({
-                'display': display_name,
-                'path': rel_path
-            })
-    
-    # Sort by display name
-    files.sort(key=lambda x: x['display'])
-    return jsonify(files)
+    """
+    List files in the staging directory.
+    ---
+    tags:
+      - Downloads
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Page size; the next page's cursor is returned in the X-Next-Cursor header
+      - in: query
+        name: cursor
+        type: string
+        required: false
+      - in: query
+        name: q
+        type: string
+        required: false
+        description: Case-insensitive search in the display name
+      - in: query
+        name: prefix
+        type: string
+        required: false
+        description: Display name prefix, e.g. an album folder
+    responses:
+      200:
+        description: Files sorted by display name
+      304:
+        description: Listing unchanged since the ETag sent in If-None-Match
+    """
+    # Answer unchanged listings from the version alone, without touching the disk
+    etag = f'files-{staging_index.get_version()}'
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        limit = request.args.get('limit', type=int)
+        files, next_cursor = staging_index.list(
+            cursor=request.args.get('cursor'),
+            limit=max(1, min(limit, 1000)) if limit else None,
+            query=request.args.get('q'),
+            prefix=request.args.get('prefix'),
+        )
+        response = jsonify(files)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@main_bp.route('/search')
+def search_library():
+    """
+    Search the library (DOWNLOAD_DIR) by artist, album and title.
+    ---
+    tags:
+      - Library
+    parameters:
+      - in: query
+        name: q
+        type: string
+        required: true
+        description: Words that must each start a word of the artist, album or title
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Maximum results (default 50, at most 500)
+    responses:
+      200:
+        description: Matching tracks, best matches first
+        schema:
+          type: array
+          items:
+            properties:
+              path:
+                type: string
+                description: Path relative to DOWNLOAD_DIR
+              artist:
+                type: string
+              album:
+                type: string
+              title:
+                type: string
+              duration:
+                type: number
+                description: Seconds
+              format:
+                type: string
+                example: "m4a"
+      400:
+        description: No search query provided
+    """
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': get_translation('error_no_query')}), 400
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(library_index.search(query, limit=max(1, min(limit, 500))))
 
 @main_bp.route('/download_file/<path:filename>')
 def download_file(filename):
@@ -0,0 +1,198 @@
+import os
+import shutil
+import threading
+import time
+import logging
+from ..config import Config
+from .odesli import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Until post-processing ends a track is on disk twice: the downloaded stream and the transcoded file
+POSTPROCESS_COPIES = 2
+
+
+class InsufficientSpace(Exception):
+    """Raised when a job's estimated size cannot fit even with no other job holding space."""
+
+
+def estimate_size(info):
+    """
+    Bytes yt-dlp will download for an info dict from extract_info(download=False):
+    the selected formats' filesize, else filesize_approx, else bitrate x duration.
+    Playlists add up their entries. Returns None when nothing gives a size.
+    """
+    if not info:
+        return None
+    if info.get('entries') is not None:
+        sizes = [estimate_size(entry) for entry in info['entries'] if entry]
+        known = [size for size in sizes if size]
+        if not known:
+            return None
+        # Entries without a size count as the average of the others
+        return sum(known) + (len(sizes) - len(known)) * sum(known) // len(known)
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        bitrate = fmt.get('tbr') or fmt.get('abr')
+        if not size and bitrate and info.get('duration'):
+            size = bitrate * 125 * info['duration']  # kbit/s to bytes
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+class AdmissionController:
+    """
+    Keeps downloads within the disk space and bandwidth available.
+    Each download reserves its estimated size before it starts and holds it until its files
+    are post-processed (or the job ends). While the free space of STAGING_DIR or DOWNLOAD_DIR,
+    less the reservations, is below `min_free` bytes, `accepting()` is False and the download
+    workers stop taking jobs. A download whose reservation does not fit waits for others to
+    release theirs. `rate_limit` bytes per second are shared by all downloads of this process.
+    """
+
+    def __init__(self, directories, min_free=0, rate_limit=0, default_size=0):
+        self.directories = directories
+        self.min_free = min_free
+        self.default_size = default_size
+        self.rate_limit = rate_limit
+        self._bucket = TokenBucket(rate_limit, rate_limit) if rate_limit > 0 else None
+        self._reservations = {}  # job_id -> bytes
+        self._cond = threading.Condition()
+        self._paused_since = None
+        self.paused_seconds = 0.0
+        self.space_waits = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+        self._throttle_lock = threading.Lock()
+
+    def _free(self):
+        """Free bytes per directory, the directory itself may not exist yet."""
+        free = {}
+        for name, path in self.directories.items():
+            path = os.path.abspath(path)
+            while not os.path.exists(path) and os.path.dirname(path) != path:
+                path = os.path.dirname(path)
+            try:
+                free[name] = shutil.disk_usage(path).free
+            except OSError:
+                continue
+        return free
+
+    def _headroom(self, free):
+        """Bytes that can still be reserved before some directory drops below min_free. Hold _cond."""
+        if not free:
+            return float('inf')
+        return min(free.values()) - sum(self._reservations.values()) - self.min_free
+
+    def accepting(self):
+        """False while disk space is low: the download stage stops dequeuing until it is not."""
+        if not self.min_free:
+            return True
+        free = self._free()
+        with self._cond:
+            ok = self._headroom(free) >= 0
+            now = time.monotonic()
+            if not ok and self._paused_since is None:
+                self._paused_since = now
+                logger.warning(f"Low disk space, pausing downloads (free: {free}, "
+                               f"reserved: {sum(self._reservations.values())} bytes)")
+            elif ok and self._paused_since is not None:
+                self.paused_seconds += now - self._paused_since
+                self._paused_since = None
+                logger.info("Disk space available again, resuming downloads")
+        return ok
+
+    def reserve(self, job_id, size, on_wait=None):
+        """
+        Reserves `size` bytes (the default size if unknown) for a job, replacing its previous
+        reservation. Blocks while it does not fit but other jobs hold space that will be released.
+        :param on_wait: called once if the job has to wait
+        :raises InsufficientSpace: if it cannot fit even without other reservations
+        """
+        size = int(size or self.default_size) * POSTPROCESS_COPIES
+        with self._cond:
+            self._reservations.pop(job_id, None)
+            waited = False
+            while True:
+                if not self.min_free or self._headroom(self._free()) >= size:
+                    self._reservations[job_id] = size
+                    self._cond.notify_all()
+                    return size
+                if not self._reservations:
+                    self.rejected += 1
+                    raise InsufficientSpace(f"Not enough disk space: about {size // 2 ** 20} MiB needed")
+                if not waited:
+                    waited = True
+                    self.space_waits += 1
+                    if on_wait:
+                        on_wait()
+                # Space also comes back when files are deleted outside the app, look again now and then
+                self._cond.wait(5)
+
+    def shrink(self, job_id, size):
+        """Lowers a job's reservation to `size` bytes, e.g. once its download is on disk."""
+        with self._cond:
+            if job_id in self._reservations:
+                self._reservations[job_id] = min(self._reservations[job_id], int(size or 0))
+                self._cond.notify_all()
+
+    def release(self, job_id):
+        with self._cond:
+            if self._reservations.pop(job_id, None) is not None:
+                self._cond.notify_all()
+
+    def throttled(self, hook):
+        """
+        Wraps a yt-dlp progress hook so the download sleeps whenever all downloads together
+        are above the rate limit. Returns hook itself without a limit.
+        """
+        if not self._bucket:
+            return hook
+        received = {}  # filename -> bytes seen so far
+
+        def progress_hook(d):
+            if d.get('status') == 'downloading':
+                downloaded = d.get('downloaded_bytes') or 0
+                previous = received.get(d.get('filename'), 0)
+                received[d.get('filename')] = downloaded
+                chunk = downloaded - previous if downloaded >= previous else downloaded
+                waited = 0.0
+                while chunk > 0:
+                    take = min(chunk, self._bucket.capacity)
+                    waited += self._bucket.acquire(take)
+                    chunk -= take
+                if waited:
+                    with self._throttle_lock:
+                        self.throttled_seconds += waited
+            if hook:
+                hook(d)
+        return progress_hook
+
+    def stats(self):
+        free = self._free()
+        with self._cond:
+            paused = self._paused_since is not None
+            return {
+                'accepting': not paused,
+                'free_bytes': free,
+                'min_free_bytes': self.min_free,
+                'reserved_bytes': sum(self._reservations.values()),
+                'reservations': len(self._reservations),
+                'paused_seconds': round(self.paused_seconds + (time.monotonic() - self._paused_since if paused else 0), 1),
+                'space_waits': self.space_waits,
+                'rejected': self.rejected,
+                'rate_limit': self.rate_limit or None,
+                'throttled_seconds': round(self.throttled_seconds, 1),
+            }
+
+
+# Global instance
+admission = AdmissionController(
+    {'staging': Config.STAGING_DIR, 'library': Config.DOWNLOAD_DIR},
+    min_free=Config.MIN_FREE_SPACE_MB * 2 ** 20,
+    rate_limit=Config.DOWNLOAD_RATE_LIMIT * 1024,
+    default_size=Config.DEFAULT_TRACK_SIZE_MB * 2 ** 20,
+)
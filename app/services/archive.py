@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+from urllib.parse import urlsplit, parse_qs
+from ..config import Config
+
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def youtube_key(url):
+    """
+    Canonical key of a YouTube/YouTube Music URL, computed without network I/O.
+    Videos map to yt-dlp's archive id ('youtube <id>'), playlists to 'youtube:playlist <id>'.
+    :return: the key, or None if the URL is not a recognizable YouTube link
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except (ValueError, AttributeError):
+        return None
+    host = parts.netloc.lower().split(':')[0]
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    query = parse_qs(parts.query)
+    segments = [s for s in parts.path.split('/') if s]
+
+    video_id = None
+    if host == 'youtu.be' and segments:
+        video_id = segments[0]
+    elif host in ('youtube.com', 'music.youtube.com'):
+        if segments[:1] == ['watch']:
+            video_id = (query.get('v') or [None])[0]
+        elif len(segments) > 1 and segments[0] in ('shorts', 'embed', 'live', 'v'):
+            video_id = segments[1]
+        elif segments[:1] == ['playlist'] and query.get('list'):
+            return f"youtube:playlist {query['list'][0]}"
+    if video_id and YOUTUBE_ID_RE.match(video_id):
+        return f"youtube {video_id}"
+    return None
+
+
+class ArchiveSnapshot(set):
+    """Copy of the archive handed to yt-dlp, remembering which ids it asked about and found."""
+
+    def __init__(self, ids):
+        super().__init__(ids)
+        self.hits = set()
+
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        if found:
+            self.hits.add(key)
+        return found
+
+
+class DownloadArchive:
+    """
+    IDs of every track already moved into the library, in yt-dlp's download_archive
+    format ('<extractor> <id>' per line), so repeat requests are answered from memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._ids is None:
+            ids = set()
+            if self.path and os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as archive_file:
+                    ids.update(line.strip() for line in archive_file if line.strip())
+            self._ids = ids
+        return self._ids
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._load()
+
+    def add(self, keys):
+        """Records archive ids (e.g. 'youtube dQw4w9WgXcQ')."""
+        with self._lock:
+            ids = self._load()
+            new = [key for key in keys if key and key not in ids]
+            if not new:
+                return
+            ids.update(new)
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as archive_file:
+                    archive_file.write(''.join(f"{key}\n" for key in new))
+
+    def snapshot(self):
+        """A copy for yt-dlp's download_archive option, which skips (playlist) entries found in it."""
+        with self._lock:
+            return ArchiveSnapshot(self._load())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+
+# Global instance
+download_archive = DownloadArchive(Config.DOWNLOAD_ARCHIVE)
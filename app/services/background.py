@@ -0,0 +1,59 @@
+import os
+import logging
+import multiprocessing
+from ..config import Config
+from .library import library_index
+from .queue import job_queue
+from .staging import sweep_staging
+
+logger = logging.getLogger(__name__)
+
+# Open while this process holds the maintenance lock, see _claim_maintenance
+_maintenance_lock = None
+
+
+def _claim_maintenance():
+    """
+    True for the one process per DATA_DIR that sweeps STAGING_DIR and rescans the library.
+    gunicorn starts every web worker the same way, a file lock picks one of them. The lock
+    is held until the process exits.
+    """
+    global _maintenance_lock
+    if _maintenance_lock is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True  # No flock (Windows): one process per DATA_DIR is up to the deployment
+    os.makedirs(Config.DATA_DIR, exist_ok=True)
+    lock_file = open(os.path.join(Config.DATA_DIR, 'maintenance.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _maintenance_lock = lock_file
+    return True
+
+
+def start_background(workers=True):
+    """
+    Starts this process' background threads, which importing the app never does.
+    Every process flushes the job store and expires statuses. With `workers` (START_WORKERS,
+    worker.py) it also recovers interrupted jobs and runs the stage workers, and one such
+    process per DATA_DIR deletes abandoned staging directories and keeps the /search index
+    up to date.
+    """
+    if multiprocessing.parent_process() is not None:
+        # A post-processing pool process re-importing the entry script (spawn): it only runs
+        # the postprocessors it is handed, workers or recovery there would run jobs twice
+        return
+    job_queue.start(workers=workers)
+    if not workers:
+        return
+    if _claim_maintenance():
+        # Recovery ran first, directories of the jobs it re-queued are kept
+        sweep_staging(job_queue.store)
+        library_index.start()
+    else:
+        logger.info("Another process sweeps staging and rescans the library")
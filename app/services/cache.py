@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only carry tracking/sharing info and never change the target track
+TRACKING_PARAMS = {'si', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+                   'feature', 'ref', 'referral', 'context', 'nd', 'dlsi', 'ls', 'app'}
+
+
+def canonicalize_url(url):
+    """
+    Normalizes a music URL so equivalent links share a cache key.
+    Lowercases scheme/host, drops 'www.', fragments, tracking params,
+    Spotify locale segments ('/intl-pt/') and trailing slashes.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except (ValueError, AttributeError):
+        return url
+
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    path = parts.path.rstrip('/') or '/'
+    segments = path.split('/')
+    if host.endswith('spotify.com') and len(segments) > 1 and segments[1].startswith('intl-'):
+        del segments[1]
+        path = '/'.join(segments) or '/'
+
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in TRACKING_PARAMS)
+
+    return urlunsplit((parts.scheme.lower(), host, path, urlencode(query), ''))
+
+
+class ResolutionCache:
+    """
+    Two-level cache of Odesli resolutions: an in-memory LRU in front of a SQLite table.
+    Successful resolutions live for `ttl` seconds, misses (no YouTube link) for `negative_ttl`.
+    """
+
+    def __init__(self, path, max_entries=1024, ttl=7 * 24 * 3600, negative_ttl=3600):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lru = OrderedDict()  # key -> (resolved_url or None, expires_at)
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def _db(self):
+        """Lazily opens the SQLite store. Returns None if disk caching is disabled."""
+        if not self.path:
+            return None
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS resolutions ('
+                'key TEXT PRIMARY KEY, resolved TEXT, expires_at REAL NOT NULL)'
+            )
+            self._conn.execute('DELETE FROM resolutions WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, resolved, expires_at):
+        self._lru[key] = (resolved, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key, now):
+        """Returns (found, resolved_url, from_disk). Call with the lock held."""
+        entry = self._lru.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._lru.move_to_end(key)
+                return True, entry[0], False
+            del self._lru[key]
+
+        try:
+            db = self._db()
+            row = db.execute(
+                'SELECT resolved, expires_at FROM resolutions WHERE key = ?', (key,)
+            ).fetchone() if db else None
+        except sqlite3.Error as e:
+            logger.error(f"Resolution cache read failed: {e}")
+            row = None
+
+        if row and row[1] > now:
+            self._remember(key, row[0], row[1])
+            return True, row[0], True
+        return False, None, False
+
+    def get(self, url):
+        """
+        Looks up a cached resolution.
+        :return: (found, resolved_url). resolved_url is None for a cached miss.
+        """
+        with self._lock:
+            found, resolved, from_disk = self._lookup(canonicalize_url(url), time.time())
+            if found:
+                self.hits += 1
+                self.disk_hits += from_disk
+            else:
+                self.misses += 1
+            return found, resolved
+
+    def peek(self, url):
+        """Like get(), without counting a hit or miss: for lookups that do not resolve anything."""
+        with self._lock:
+            found, resolved, _ = self._lookup(canonicalize_url(url), time.time())
+            return found, resolved
+
+    def set(self, url, resolved):
+        """Stores a resolution. Pass resolved=None to cache a negative result."""
+        key = canonicalize_url(url)
+        expires_at = time.time() + (self.ttl if resolved else self.negative_ttl)
+        with self._lock:
+            self._remember(key, resolved, expires_at)
+            try:
+                db = self._db()
+                if db:
+                    db.execute(
+                        'INSERT OR REPLACE INTO resolutions (key, resolved, expires_at) VALUES (?, ?, ?)',
+                        (key, resolved, expires_at)
+                    )
+                    db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Resolution cache write failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self._lru),
+            }
+
+
+# Global instance
+resolution_cache = ResolutionCache(
+    Config.RESOLVE_CACHE_PATH,
+    max_entries=Config.RESOLVE_CACHE_SIZE,
+    ttl=Config.RESOLVE_CACHE_TTL,
+    negative_ttl=Config.RESOLVE_CACHE_NEGATIVE_TTL,
+)
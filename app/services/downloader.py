@@ -1,161 +1,549 @@
 import os
-import requests
 import shutil
-import yt_dlp
-from urllib.parse import quote_plus
 from ..config import Config, JobStage
-from .integrations import run_beets_import
-from .queue import job_queue
+from .admission import admission, estimate_size
+from .archive import download_archive, youtube_key
+from .cache import resolution_cache, canonicalize_url
+from .integrations import import_batcher
+from .metrics import stage_seconds
+from .odesli import OdesliRateLimited
+from .postprocess import audio_postprocessors, postprocess_pool, final_ext, postprocessed_path
+from .progress import ProgressReporter
+from .files import staging_index
+from .jobstore import FINISHED_STATES
+from .library import library_index
+from .resolver import resolver, resolve_url
+from .transfer import transfer_engine
+from .ytdl import ytdl_pool
+from .queue import job_queue, Pipeline, JobFinished, JobDetached, JobParked, PRIORITY_BULK
 import logging
+import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-def resolve_url(url):
+def request_key(url):
     """
-    Resolves a music URL to a YouTube/YouTube Music URL using Odesli.
+    Dedupe key of a download request, without network I/O: the YouTube video/playlist
+    id when the URL (or its cached resolution) gives one, else the canonical URL.
     """
-    # If it's already a youtube/youtu.be link, return it
-    if 'youtube.com' in url or 'youtu.be' in url or 'music.youtube.com' in url:
-        return url
-    
-    logger.info(f"Resolving URL: {url}")
-    # Use Odesli to resolve
-    try:
-        api_url = f"{Config.ODESLI_API_URL}{quote_plus(url)}"
-        response = requests.get(api_url, timeout=Config.REQUEST_TIMEOUT)
-        if response.status_code == 200:
-            data = response.json()
-            links = data.get('linksByPlatform', {})
-            # Prefer YouTube Music, then YouTube
-            if 'youtubeMusic' in links:
-                return links['youtubeMusic']['url']
-            if 'youtube' in links:
-                return links['youtube']['url']
-    except Exception as e:
-        logger.error(f"Error resolving URL: {e}")
-    
-    return url # Fallback to original URL
+    key = youtube_key(url)
+    if key:
+        return key
+    found, resolved = resolution_cache.peek(url)
+    if found and resolved:
+        key = youtube_key(resolved)
+    return key or f"url {canonicalize_url(url)}"
 
-def download_task(url, job_id=None):
-    """
-    Main task function to be executed by the worker.
-    Resolves URL -> Downloads -> Imports -> Rescans.
-    """
-    def set_status(stage, state=None, message=None, error=None):
-        if job_id:
-            job_queue.update_job_status(job_id, stage=stage, state=state, message=message, error=error)
 
-    set_status(stage=JobStage.RESOLVING_URL, state='processing', message='Resolving URL')
+def archive_id(info):
+    """yt-dlp's download_archive id of a downloaded track ('<extractor> <id>')."""
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if extractor and info.get('id'):
+        return f"{extractor.lower()} {info['id']}"
+    return None
 
-    resolved_url = resolve_url(url)
-    logger.info(f"Starting download for: {resolved_url}")
-    
-    # Extract title from URL for display
-    title = None
-    try:
-        # Try to extract from Odesli response or YouTube metadata
-        if 'youtu' in resolved_url:
-            # Will be updated with actual title from yt-dlp
-            title = resolved_url.split('v=')[-1][:11]  # Video ID fallback
-    except (ValueError, IndexError):
-        title = None
 
-    staging_root = Config.STAGING_DIR
-    staging_dir = os.path.join(staging_root, job_id) if job_id else staging_root
-    if job_id is None:
-        # Use human-readable timestamp instead of UUID
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        staging_dir = os.path.join(staging_root, timestamp)
+# Keys of yt-dlp info dicts that postprocessors never need; dropped to keep job context small
+HEAVY_INFO_KEYS = ('formats', 'requested_formats', 'requested_downloads', 'entries', 'subtitles',
+                   'automatic_captions', 'requested_subtitles', 'heatmap', 'http_headers', 'fragments')
+
+
+def set_status(ctx, stage, state=None, message=None, error=None):
+    job_id = ctx.get('job_id')
+    if job_id:
+        job_queue.update_job_status(job_id, stage=stage, state=state, message=message, error=error)
 
-    os.makedirs(staging_dir, exist_ok=True)
 
-    # yt-dlp options
-    audio_quality = Config.AUDIO_QUALITY
-    if audio_quality.lower() == 'best':
-        audio_quality = '0' # Best VBR quality
+def _finish(ctx, message, **fields):
+    """Marks the job done and stops its pipeline."""
+    job_id = ctx.get('job_id')
+    if job_id:
+        job_queue.update_job_status(job_id, stage=JobStage.DONE, state='completed', message=message, **fields)
+    raise JobFinished(message)
 
-    ydl_opts = {
+
+def _ydl_opts(staging_dir=None, postprocessors=None, track_number=None):
+    opts = {
         'format': 'bestaudio[ext=m4a]/bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': Config.AUDIO_CODEC,
-            'preferredquality': audio_quality,
-        }, {
-            'key': 'FFmpegMetadata',
-        }, {
-            'key': 'EmbedThumbnail',
-        }],
-        'outtmpl': f'{staging_dir}/%(album|Unknown Album)s/%(playlist_index|00)s - %(title)s - %(artist|Unknown Artist)s.%(ext)s',
+        'postprocessors': postprocessors or [],
         'noplaylist': False,
         'ignoreerrors': True,
         'quiet': Config.YTDL_QUIET,
         'no_warnings': Config.YTDL_NO_WARNINGS,
         'keepvideo': False,
         'socket_timeout': 30,  # 30 second timeout
+        # An interrupted job resumes in its staging directory: .part files and fragments
+        # continue where they stopped, tracks already post-processed are not fetched again
+        'continuedl': True,
+        'nopart': False,
+        'final_ext': final_ext(),
     }
-    
-    # Execute download
-    try:
-        set_status(stage=JobStage.DOWNLOADING, message='Downloading')
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(resolved_url, download=True)
+    if staging_dir:
+        # Tracks of a fanned-out playlist are downloaded alone, keep their playlist position
+        index = f'{track_number:02d}' if track_number else '00'
+        opts['outtmpl'] = f'{staging_dir}/%(album|Unknown Album)s/%(playlist_index|{index})s - %(title)s - %(artist|Unknown Artist)s.%(ext)s'
+    return opts
 
-            if not info:
-                logger.error("Download failed: No info extracted.")
-                set_status(stage=JobStage.FAILED, state='failed', error='No info extracted')
-                return
 
-            # Extract title from info and update status
-            title = info.get('title', 'Unknown')
-            artist = info.get('artist', info.get('uploader', 'Unknown Artist'))
-            set_status(stage=JobStage.DOWNLOADING, message=f'Downloaded: {artist} - {title}')
-        set_status(stage=JobStage.POSTPROCESSING, message='Post-processing')
-
-        # Integrations
-        import_success = False
-        if Config.USE_BEETS:
-            set_status(stage=JobStage.BEETS_IMPORT, message='Running beets import')
-            # Import from staging to library
-            import_success = run_beets_import(staging_dir)
-
-        # Fallback to manual move if Beets disabled or failed
-        if not Config.USE_BEETS or not import_success:
-            if Config.USE_BEETS and not import_success:
-                logger.warning("Beets import failed, falling back to manual move.")
-
-            # Manual move from staging to download dir
-            logger.info(f"Moving files from {staging_dir} to {Config.DOWNLOAD_DIR}")
-            set_status(stage=JobStage.MOVING_FILES, message='Moving files to library')
-            # Simplified move: merge directories
-            if not os.path.exists(Config.DOWNLOAD_DIR):
-                os.makedirs(Config.DOWNLOAD_DIR)
-
-            try:
-                # Iterate and move
-                for root, dirs, files in os.walk(staging_dir):
-                    for file in files:
-                        src_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(src_path, staging_dir)
-                        dest_path = os.path.join(Config.DOWNLOAD_DIR, rel_path)
-
-                        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                        shutil.move(src_path, dest_path)
-
-                # Cleanup staging for this job
-                if os.path.exists(staging_dir):
-                    shutil.rmtree(staging_dir)
-            except Exception as e:
-                logger.error(f"Error moving files: {e}")
-                set_status(stage=JobStage.FAILED, state='failed', error=str(e))
+def _downloaded_files(info):
+    """Yields (filepath, info) for every file yt-dlp downloaded, flattening playlists."""
+    import yt_dlp  # Already loaded by the download that produced info
+    for entry in info.get('entries') or [info]:
+        if not entry:
+            continue  # Failed playlist entry (ignoreerrors)
+        if entry.get('entries'):
+            yield from _downloaded_files(entry)
+            continue
+        for download in entry.get('requested_downloads') or []:
+            if download.get('filepath'):
+                # Drop yt-dlp's private '__' keys too, they hold live objects
+                merged = {k: v for k, v in {**entry, **download}.items()
+                          if k not in HEAVY_INFO_KEYS and not k.startswith('__')}
+                yield download['filepath'], yt_dlp.YoutubeDL.sanitize_info(merged)
+
+
+def resolve_step(ctx):
+    set_status(ctx, stage=JobStage.RESOLVING_URL, state='processing', message='Resolving URL')
+    with stage_seconds.time(stage=JobStage.RESOLVING_URL):
+        ctx['resolved_url'] = resolve_url(ctx['url'])
+
+    key = youtube_key(ctx['resolved_url'])
+    if key and key in download_archive:
+        _finish(ctx, 'Already in library')
+    # Requests for different URLs (e.g. Spotify and YouTube links) may resolve to the same video
+    job_id = ctx.get('job_id')
+    keys = ctx.setdefault('dedupe_keys', [])
+    if key and job_id and key not in keys:
+        owner = job_queue.claim_key(key, job_id)
+        if owner != job_id:
+            logger.info(f"Job {job_id} is a duplicate of in-flight job {owner}")
+            ctx['duplicate_of'] = owner
+            _finish(ctx, f'Duplicate of job {owner}', duplicate_of=owner)
+        keys.append(key)
+
+
+def _playlist_progress(tracks):
+    done = sum(1 for track in tracks if track['state'] == 'completed')
+    failed = sum(1 for track in tracks if track['state'] == 'failed')
+    return {
+        'tracks': len(tracks),
+        'tracks_done': done,
+        'tracks_failed': failed,
+        'overall_percent': round(100.0 * (done + failed) / max(len(tracks), 1), 1),
+    }
+
+
+def _new_track(number, url, known=False, **fields):
+    return {
+        'number': number,
+        'url': url,
+        'job_id': None,
+        'state': 'completed' if known else 'pending',
+        'attempts': 0,
+        'error': None,
+        **fields,
+    }
+
+
+def schedule_tracks(parent_id, client=None, finished=None):
+    """
+    Records a finished track of a playlist (or batch) job and starts its pending tracks while
+    fewer than the job's concurrency are in progress. Completes the job after its last track.
+    :param client: who asked for the playlist, its tracks are queued as that client's bulk work
+    :param finished: (track number, state, error) of the child job that just ended
+    """
+    to_start = []
+
+    def apply(status):
+        tracks = [dict(track) for track in status.get('tracks') or []]
+        if finished:
+            number, state, error = finished
+            track = tracks[number - 1]
+            if state == 'failed' and track['attempts'] <= Config.TRACK_RETRIES:
+                # Retried on its own, continuing the failed attempt's partial download
+                if track['job_id'] and not track.get('staging_dir'):
+                    track['staging_dir'] = os.path.join(Config.STAGING_DIR, track['job_id'])
+                track.update(state='pending', error=error)
+            else:
+                track.update(state=state, error=error)
+
+        concurrency = max(1, status.get('concurrency') or Config.PLAYLIST_CONCURRENCY)
+        in_progress = sum(1 for track in tracks if track['state'] == 'queued')
+        for track in tracks:
+            if in_progress >= concurrency:
+                break
+            if track['state'] == 'pending':
+                track.update(state='queued', attempts=track['attempts'] + 1)
+                to_start.append(track)
+                in_progress += 1
+
+        progress = _playlist_progress(tracks)
+        changes = {'tracks': tracks, 'progress': progress}
+        if in_progress == 0:
+            total, done, failed = progress['tracks'], progress['tracks_done'], progress['tracks_failed']
+            changes.update(stage=JobStage.DONE if done else JobStage.FAILED,
+                           state='completed' if done else 'failed',
+                           message=f'Downloaded {done} of {total} tracks',
+                           error=f'{failed} tracks failed' if failed else None)
+        else:
+            changes['message'] = f"Downloading tracks ({progress['tracks_done']}/{progress['tracks']})"
+        return changes
+
+    status = job_queue.modify_job_status(parent_id, apply)
+    if status.get('state') in ('completed', 'failed'):
+        job_queue.release_keys(parent_id)
+        logger.info(f"Playlist job {parent_id}: {status['message']}")
+        _report_followers(parent_id, status['state'], status.get('error'))
+        if status.get('parent_id'):
+            # A playlist inside a batch reports to the batch like any other track
+            schedule_tracks(status['parent_id'], client,
+                            finished=(status['track_number'], status['state'], status.get('error')))
+        return
+
+    playlist = status.get('kind') == 'playlist'
+    child_ids = {}
+    for track in to_start:
+        child_ids[track['number']] = job_queue.add_job(
+            download_pipeline, priority=PRIORITY_BULK, client=client, url=track['url'], parent_id=parent_id,
+            track_number=track['number'], playlist_index=track['number'] if playlist else None,
+            staging_dir=track.get('staging_dir'),
+        )
+    if child_ids:
+        job_queue.modify_job_status(parent_id, lambda status: {'tracks': [
+            dict(track, job_id=child_ids.get(track['number'], track['job_id'])) for track in status['tracks']
+        ]})
+
+
+def _detach_tracks(ctx, kind, tracks, concurrency, **fields):
+    """Saves the tracks of a playlist/batch job (once) and hands them to child jobs."""
+    job_id = ctx['job_id']
+    if tracks is not None:
+        if ctx.get('parent_id'):
+            # Reported to the parent (e.g. a batch) once the last track is done
+            fields.update(parent_id=ctx['parent_id'], track_number=ctx['track_number'])
+        job_queue.modify_job_status(job_id, lambda status: {
+            'stage': JobStage.PLAYLIST, 'kind': kind, 'tracks': tracks, 'concurrency': concurrency, **fields,
+        })
+    schedule_tracks(job_id, ctx.get('client'))
+    raise JobDetached
+
+
+def expand_step(ctx):
+    """
+    Splits a playlist/album into one child job per track, read with a flat metadata
+    extraction. The tracks go through the pipeline in parallel and are retried
+    individually, this job only aggregates their progress.
+    """
+    job_id = ctx.get('job_id')
+    key = youtube_key(ctx['resolved_url'])
+    if not (Config.PLAYLIST_FANOUT and job_id and key and key.startswith('youtube:playlist ')):
+        return  # A single track, or an inline run where download_step fetches the whole playlist
+
+    status = job_queue.get_job_status(job_id) or {}
+    if status.get('tracks'):
+        _detach_tracks(ctx, 'playlist', None, None)  # Expanded before a restart, resume scheduling
+
+    set_status(ctx, stage=JobStage.PLAYLIST, message='Reading playlist')
+    with ytdl_pool.lease({**_ydl_opts(), 'extract_flat': 'in_playlist'}) as ydl:
+        info = ydl.extract_info(ctx['resolved_url'], download=False)
+    entries = [entry for entry in (info or {}).get('entries') or [] if entry and entry.get('url')]
+    if not entries:
+        raise RuntimeError('Playlist is empty')
+
+    tracks = [_new_track(number, entry['url'], known=archive_id(entry) in download_archive, title=entry.get('title'))
+              for number, entry in enumerate(entries, 1)]
+    logger.info(f"Playlist job {job_id}: {len(tracks)} tracks")
+    _detach_tracks(ctx, 'playlist', tracks, Config.PLAYLIST_CONCURRENCY, playlist_title=info.get('title'))
+
+
+def batch_step(ctx):
+    """
+    Resolves every non-YouTube link of a batch concurrently on the shared resolver pool
+    (Odesli's rate limit still applies) and runs each link as a child job.
+    """
+    job_id = ctx['job_id']
+    status = job_queue.get_job_status(job_id) or {}
+    if status.get('tracks'):
+        _detach_tracks(ctx, 'batch', None, None)  # Resolved before a restart, resume scheduling
+
+    urls = ctx['urls']
+    pending = [url for url in urls if not youtube_key(url)]
+    set_status(ctx, stage=JobStage.RESOLVING_URL, state='processing',
+               message=f'Resolving {len(pending)} of {len(urls)} links')
+    resolved = resolver.resolve_all(pending)
+
+    tracks = []
+    for number, url in enumerate(urls, 1):
+        target = resolved.get(url, url)
+        if isinstance(target, OdesliRateLimited):
+            target = url  # The link's own job resolves it again later
+        elif isinstance(target, Exception):
+            raise target
+        key = youtube_key(target)
+        tracks.append(_new_track(number, target, known=bool(key) and key in download_archive, source_url=url))
+    logger.info(f"Batch job {job_id}: {len(tracks)} links")
+    _detach_tracks(ctx, 'batch', tracks, Config.BATCH_CONCURRENCY)
+
+
+def _follow(owner, ctx):
+    """
+    Makes a playlist track that duplicated the in-flight job `owner` share its outcome.
+    :return: the owner's (state, error) if it already ended, else None and the owner reports the track when it ends
+    """
+    follower = {'parent_id': ctx['parent_id'], 'track_number': ctx['track_number'], 'client': ctx.get('client')}
+    outcome = []
+
+    def apply(status):
+        if status.get('state') in FINISHED_STATES:
+            outcome.append((status['state'], status.get('error')))
+            return {}
+        return {'followers': (status.get('followers') or []) + [follower]}
+
+    job_queue.modify_job_status(owner, apply)
+    return outcome[0] if outcome else None
+
+
+def _report_followers(job_id, state, error):
+    """Reports a finished job's outcome for the playlist tracks that duplicated it."""
+    # Followers are only added while the job is unfinished, none can appear after this check
+    if not (job_queue.get_job_status(job_id) or {}).get('followers'):
+        return
+    followers = []
+
+    def take(status):
+        followers.extend(status.get('followers') or [])
+        return {'followers': []}
+
+    job_queue.modify_job_status(job_id, take)
+    for follower in followers:
+        schedule_tracks(follower['parent_id'], follower['client'],
+                        finished=(follower['track_number'], state, error))
+
+
+def track_finished(ctx, state, error):
+    """download_pipeline on_finish: frees the job's disk reservation, reports playlist tracks to their playlist job."""
+    if not ctx:
+        return
+    if ctx.get('staging_dir'):
+        admission.release(_reservation_key(ctx))
+    if ctx.get('job_id'):
+        _report_followers(ctx['job_id'], state, error)
+    if ctx.get('parent_id'):
+        owner = ctx.get('duplicate_of')
+        if owner and state == 'completed':
+            # Done only once the job it duplicated is, and failed if that one fails
+            outcome = _follow(owner, ctx)
+            if outcome is None:
                 return
+            state, error = outcome
+        schedule_tracks(ctx['parent_id'], ctx.get('client'), finished=(ctx['track_number'], state, error))
+
+
+def _reservation_key(ctx):
+    return ctx.get('job_id') or ctx['staging_dir']
+
+
+def _reserve_space(ctx, info):
+    """Reserves the download's estimated size, waiting while other jobs hold the space it needs."""
+    size = estimate_size(info)
+    ctx['estimated_size'] = size
+    admission.reserve(_reservation_key(ctx), size,
+                      on_wait=lambda: set_status(ctx, stage=JobStage.DOWNLOADING, message='Waiting for disk space'))
+
+
+def download_step(ctx):
+    """
+    Fetches the audio. In 'process' post-processing mode this is the raw stream only,
+    transcoding and tagging happen in postprocess_step.
+    """
+    resolved_url = ctx['resolved_url']
+    job_id = ctx.get('job_id')
+    logger.info(f"Starting download for: {resolved_url}")
+
+    staging_root = Config.STAGING_DIR
+    # Retries of a playlist track reuse the directory of the attempt that failed
+    staging_dir = ctx.get('staging_dir') or (os.path.join(staging_root, job_id) if job_id else staging_root)
+    if job_id is None and not ctx.get('staging_dir'):
+        # Use human-readable timestamp instead of UUID
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        staging_dir = os.path.join(staging_root, timestamp)
+
+    os.makedirs(staging_dir, exist_ok=True)
+    ctx['staging_dir'] = staging_dir
+
+    set_status(ctx, stage=JobStage.DOWNLOADING, message='Downloading')
+    inline_pps = audio_postprocessors() if Config.POSTPROCESS_MODE == 'inline' else None
+    reporter = ProgressReporter(job_id)
+    ydl_opts = _ydl_opts(staging_dir, postprocessors=inline_pps, track_number=ctx.get('playlist_index'))
+    # Playlist entries already in the library are skipped before any download
+    archive = ydl_opts['download_archive'] = download_archive.snapshot()
+    try:
+        with stage_seconds.time(stage=JobStage.DOWNLOADING), ytdl_pool.lease(
+                ydl_opts, progress_hook=admission.throttled(reporter.progress_hook),
+                postprocessor_hook=reporter.postprocessor_hook if inline_pps else None) as ydl:
+            # Metadata first, so the job reserves its estimated size before writing anything
+            info = ydl.extract_info(resolved_url, download=False)
+            if info:
+                _reserve_space(ctx, info)
+                info = ydl.process_ie_result(info, download=True)
+    except BaseException:
+        admission.release(_reservation_key(ctx))
+        raise
+    reporter.flush()
+    if inline_pps or job_queue.broker:
+        # Done with the disk it reserved, or post-processed by another process that cannot release it
+        admission.release(_reservation_key(ctx))
+    else:
+        # The stream is on disk now, only the transcoded copy is still to come
+        admission.shrink(_reservation_key(ctx), ctx.get('estimated_size') or admission.default_size)
+
+    if not info:
+        logger.error("Download failed: No info extracted.")
+        raise RuntimeError('No info extracted')
+
+    ctx['files'] = [{'filepath': path, 'info': file_info} for path, file_info in _downloaded_files(info)]
+    staging_index.refresh(staging_dir)
+    if not ctx['files']:
+        if archive.hits:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            staging_index.refresh(staging_dir)
+            _finish(ctx, 'Already in library')
+        raise RuntimeError('Nothing was downloaded')
+    if archive.hits:
+        logger.info(f"Skipped {len(archive.hits)} tracks already in the library")
+
+    # Extract title from info and update status
+    title = info.get('title', 'Unknown')
+    artist = info.get('artist', info.get('uploader', 'Unknown Artist'))
+    set_status(ctx, stage=JobStage.DOWNLOADING, message=f'Downloaded: {artist} - {title}')
+
+
+def postprocess_step(ctx):
+    """Hands every file to the process pool for audio extraction, metadata and thumbnail embedding."""
+    if Config.POSTPROCESS_MODE == 'inline':
+        return  # yt-dlp already ran the postprocessors during the download
+
+    set_status(ctx, stage=JobStage.POSTPROCESSING, message='Post-processing')
+    reporter = ProgressReporter(ctx.get('job_id'))
+    total = len(ctx['files'])
+
+    # After a restart, files finished before it are skipped
+    pending = []
+    for item in ctx['files']:
+        done = postprocessed_path(item['filepath'])
+        if done:
+            item['filepath'] = done
+        else:
+            pending.append(item)
+    skipped = total - len(pending)
+    if skipped:
+        logger.info(f"Skipping {skipped} files post-processed before the job was interrupted")
+
+    def on_done(count):
+        reporter.update(force=count == len(pending), postprocessed=skipped + count, postprocess_total=total)
+
+    ydl_opts = _ydl_opts(postprocessors=audio_postprocessors())
+    with stage_seconds.time(stage=JobStage.POSTPROCESSING):
+        paths = postprocess_pool.map([(item['filepath'], item['info']) for item in pending], ydl_opts,
+                                     on_done=on_done)
+    for item, path in zip(pending, paths):
+        item['filepath'] = path
+    admission.release(_reservation_key(ctx))
+    staging_index.refresh(ctx['staging_dir'])
+
+
+def import_step(ctx):
+    if Config.USE_BEETS:
+        # Import from staging to library together with other jobs' directories. The worker
+        # does not wait for the batch, the job finishes from its result in finish_import
+        set_status(ctx, stage=JobStage.BEETS_IMPORT, message='Waiting for beets import')
+        ctx['import_submitted'] = time.time()
+        raise JobParked(import_batcher.submit(ctx['staging_dir']), finish_import)
+    finish_import(ctx)
+
+
+def finish_import(ctx, beets=None):
+    """Completes the import: after beets (a Future of whether it imported the job's directory), or by moving the files."""
+    staging_dir = ctx['staging_dir']
+
+    import_success = False
+    if beets is not None:
+        stage_seconds.observe(time.time() - ctx.pop('import_submitted', time.time()), stage=JobStage.BEETS_IMPORT)
+        import_success = beets.result()
+        if import_success:
+            logger.info("Beets import completed.")
         else:
-            # Beets already handled cleanup
+            logger.error(f"Beets did not import {staging_dir}")
+
+    # Fallback to manual move if Beets disabled or failed
+    if not Config.USE_BEETS or not import_success:
+        if Config.USE_BEETS and not import_success:
+            logger.warning("Beets import failed, falling back to manual move.")
+
+        # Manual move from staging to download dir
+        logger.info(f"Moving files from {staging_dir} to {Config.DOWNLOAD_DIR}")
+        set_status(ctx, stage=JobStage.MOVING_FILES, message='Moving files to library')
+        # Simplified move: merge directories
+        if not os.path.exists(Config.DOWNLOAD_DIR):
+            os.makedirs(Config.DOWNLOAD_DIR)
+
+        try:
+            # Rename, or copy in parallel when the library is on another filesystem
+            with stage_seconds.time(stage=JobStage.MOVING_FILES):
+                result = transfer_engine.move_tree(staging_dir, Config.DOWNLOAD_DIR)
+            ctx['library_files'] = result['paths']
+            library_index.update(result['paths'])
+            if result['copied']:
+                logger.info(f"Copied {result['bytes']} bytes in {result['seconds']}s "
+                            f"({result['bytes_per_second']} B/s)")
+
+            # Cleanup staging for this job
             if os.path.exists(staging_dir):
                 shutil.rmtree(staging_dir)
+        except Exception as e:
+            logger.error(f"Error moving files: {e}")
+            raise
+    else:
+        # Beets already handled cleanup
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+
+    staging_index.refresh(staging_dir)
+    download_archive.add(archive_id(item['info']) for item in ctx['files'])
+    set_status(ctx, stage=JobStage.DONE, state='completed', message='Download completed')
+
+
+# Resolve -> (Fan out playlists) -> Download -> Post-process -> Import, each on its own worker pool
+download_pipeline = Pipeline(
+    'download',
+    ('resolve', resolve_step),
+    ('resolve', expand_step),
+    ('download', download_step),
+    ('postprocess', postprocess_step),
+    ('import', import_step),
+    on_finish=track_finished,
+)
+
+# Many links submitted at once: resolved together, then one download_pipeline job per link
+batch_pipeline = Pipeline(
+    'batch',
+    ('resolve', batch_step),
+)
 
-        set_status(stage=JobStage.DONE, state='completed', message='Download completed')
+# Download workers take no new jobs while disk space is low
+job_queue.set_gate('download', admission.accepting)
+
+
+def download_task(url, job_id=None):
+    """
+    Runs the whole download pipeline inline on the calling thread.
+    Resolves URL -> Downloads -> Post-processes -> Imports.
+    """
+    ctx = {'url': url, 'job_id': job_id}
+    try:
+        download_pipeline.run(ctx)
     except Exception as e:
         logger.error(f"Download task failed: {e}")
-        set_status(stage=JobStage.FAILED, state='failed', error=str(e))
+        set_status(ctx, stage=JobStage.FAILED, state='failed', error=str(e))
         raise e
@@ -0,0 +1,199 @@
+import os
+import json
+import base64
+import bisect
+import threading
+import time
+import uuid
+import logging
+from ..config import Config
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # Optional: without it the index relies on periodic rescans
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+
+def _display_name(rel_path):
+    # Create display name: show album/filename, skip the job/timestamp folder
+    parts = rel_path.split(os.sep)
+    if len(parts) > 2:
+        # Format: album/filename (skip timestamp)
+        return os.path.join(parts[1], parts[2])
+    elif len(parts) == 2:
+        # Format: album/filename (if already in this format)
+        return os.path.join(parts[0], parts[1])
+    # Just filename
+    return parts[-1]
+
+
+def encode_cursor(entry):
+    raw = json.dumps([entry['display'], entry['path']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        display, path = json.loads(raw)
+        return str(display), str(path)
+    except (ValueError, TypeError):
+        return None
+
+
+class FileIndex:
+    """
+    In-memory index of the files under a directory, sorted by display name.
+    Kept current by explicit refreshes after downloads, inotify when available,
+    and a periodic rescan as a fallback. `version` changes whenever the listing does,
+    `epoch` tells this index apart from those of other processes or earlier runs.
+    """
+
+    def __init__(self, root, rescan_interval=60):
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.version = 0
+        # Versions count from 0 in every process, the same version elsewhere is another listing
+        self.epoch = uuid.uuid4().hex[:12]
+        self._entries = {}  # rel_path -> entry
+        self._keys = None   # sorted (display, path), rebuilt lazily after changes
+        self._lock = threading.Lock()
+        self._started = False
+        self._inotify = None
+        self._watches = {}  # inotify wd -> directory
+
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.refresh()
+        if INotify is not None:
+            threading.Thread(target=self._inotify_loop, daemon=True, name='file-index-inotify').start()
+        threading.Thread(target=self._rescan_loop, daemon=True, name='file-index-rescan').start()
+
+    def _scan(self, top):
+        found = {}
+        for root, dirs, filenames in os.walk(top):
+            for filename in filenames:
+                rel_path = os.path.relpath(os.path.join(root, filename), self.root)
+                found[rel_path] = {'display': _display_name(rel_path), 'path': rel_path}
+        return found
+
+    def refresh(self, path=None):
+        """
+        Rescans `path` (a directory under the root, which may no longer exist) or the whole root.
+        :return: True if the listing changed
+        """
+        os.makedirs(self.root, exist_ok=True)
+        top = os.path.abspath(path or self.root)
+        root_abs = os.path.abspath(self.root)
+        if top != root_abs and not top.startswith(root_abs + os.sep):
+            return False
+        found = self._scan(top)
+        prefix = '' if top == root_abs else os.path.relpath(top, root_abs) + os.sep
+
+        with self._lock:
+            stale = [p for p in self._entries if p.startswith(prefix) and p not in found]
+            added = [p for p in found if p not in self._entries]
+            for p in stale:
+                del self._entries[p]
+            for p in added:
+                self._entries[p] = found[p]
+            changed = bool(stale or added)
+            if changed:
+                self._keys = None
+                self.version += 1
+        if self._inotify is not None:
+            self._watch_tree(top)
+        return changed
+
+    def get_version(self):
+        """The listing's version, unique across processes and restarts (e.g. for ETags)."""
+        self._ensure_started()
+        return f'{self.epoch}.{self.version}'
+
+    def list(self, cursor=None, limit=None, query=None, prefix=None):
+        """
+        Returns (entries, next_cursor) in display order.
+        :param cursor: value of a previous next_cursor, to continue after it
+        :param query: case-insensitive substring of the display name
+        :param prefix: display name prefix (e.g. an album folder)
+        """
+        self._ensure_started()
+        with self._lock:
+            if self._keys is None:
+                self._keys = sorted((e['display'], e['path']) for e in self._entries.values())
+            keys = self._keys
+            entries = self._entries
+
+            start = 0
+            if prefix:
+                start = bisect.bisect_left(keys, (prefix, ''))
+            decoded = decode_cursor(cursor) if cursor else None
+            if decoded:
+                start = max(start, bisect.bisect_right(keys, decoded))
+
+            needle = query.lower() if query else None
+            result = []
+            next_cursor = None
+            for key in keys[start:]:
+                if prefix and not key[0].startswith(prefix):
+                    break
+                if needle and needle not in key[0].lower():
+                    continue
+                if limit is not None and len(result) >= limit:
+                    next_cursor = encode_cursor(result[-1])
+                    break
+                result.append(dict(entries[key[1]]))
+        return result, next_cursor
+
+    def _rescan_loop(self):
+        while True:
+            time.sleep(self.rescan_interval)
+            try:
+                self.refresh()
+            except OSError as e:
+                logger.error(f"File index rescan failed: {e}")
+
+    def _watch_tree(self, top):
+        mask = (inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.MOVED_FROM |
+                inotify_flags.MOVED_TO | inotify_flags.CLOSE_WRITE)
+        watched = set(self._watches.values())
+        for root, dirs, _ in os.walk(top):
+            if root not in watched:
+                try:
+                    self._watches[self._inotify.add_watch(root, mask)] = root
+                except OSError:
+                    pass  # Directory vanished or watch limit reached, the rescan covers it
+
+    def _inotify_loop(self):
+        try:
+            inotify = INotify()
+            self._inotify = inotify
+            self._watch_tree(os.path.abspath(self.root))
+        except OSError as e:
+            logger.warning(f"inotify unavailable, relying on rescans: {e}")
+            return
+        while True:
+            dirty = set()
+            for event in self._inotify.read(timeout=1000, read_delay=200):
+                if event.mask & inotify_flags.IGNORED:
+                    self._watches.pop(event.wd, None)
+                    continue
+                directory = self._watches.get(event.wd)
+                if directory:
+                    dirty.add(directory)
+            for directory in dirty:
+                try:
+                    self.refresh(directory)
+                except OSError as e:
+                    logger.error(f"File index refresh failed: {e}")
+
+
+# Global instance
+staging_index = FileIndex(Config.STAGING_DIR, rescan_interval=Config.FILE_INDEX_RESCAN_INTERVAL)
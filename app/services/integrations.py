@@ -1,32 +1,154 @@
 import subprocess
 import os
 import logging
-import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 from ..config import Config
 
 logger = logging.getLogger(__name__)
 
-def run_beets_import(path):
+# beets import log statuses of paths that did not end up in the library
+NOT_IMPORTED = ('skip', 'duplicate-skip')
+
+
+def _skipped_paths(log_path):
+    """Paths beets logged as skipped, from a `beet import -l` log."""
+    skipped = []
+    try:
+        with open(log_path, encoding='utf-8', errors='replace') as log_file:
+            for line in log_file:
+                status, _, paths = line.rstrip('\n').partition(' ')
+                if status in NOT_IMPORTED:
+                    skipped.extend(p.strip() for p in paths.split('; ') if p.strip())
+    except OSError:
+        pass
+    return skipped
+
+
+class BeetsImportBatcher:
     """
-    Runs 'beet import -q' on the given path.
-    Imports source 'path' (STAGING_DIR) into the library configured in beets.
+    Runs one `beet import` over the staging directories of several jobs instead of one
+    process per job, paying beets' startup and library lock once per batch. A batch starts
+    `window` seconds after its first directory or once `max_batch` directories are waiting.
+    Callers do not wait for it: jobs park on the Future and finish from its result.
     """
-    if not Config.USE_BEETS:
-        return True
 
-    logger.info(f"Running Beets import from: {path}")
-    try:
-        cmd = ['beet'] + Config.BEETS_ARGS + [path]
-        env = os.environ.copy()
-        
-        subprocess.run(cmd, check=True, env=env)
-        
-        # Clean up staging directory after import
-        if os.path.exists(path):
-            shutil.rmtree(path)
-             
-        logger.info("Beets import completed.")
-        return True
-    except Exception as e:
-        logger.error(f"Beets import failed: {e}")
-        return False
+    def __init__(self, window=2.0, max_batch=10):
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._pending = []  # (path, Future, submitted_at)
+        self._first_at = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.directories = 0
+        self.failed = 0
+        self.max_batch_seen = 0
+        self.run_seconds_total = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def submit(self, path):
+        """Queues a staging directory. The Future resolves to True if beets imported it."""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name='beets-batcher')
+                self._thread.start()
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.append((path, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def _ready(self):
+        count = len(self._pending)
+        return count >= self.max_batch or time.monotonic() - self._first_at >= self.window
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending or not self._ready():
+                    timeout = None if not self._pending else self._first_at + self.window - time.monotonic()
+                    self._cond.wait(timeout)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                self._first_at = time.monotonic() if self._pending else None
+            self._run(batch)
+
+    def _run(self, batch):
+        paths = [path for path, _, _ in batch]
+        started = time.monotonic()
+        try:
+            results = self._import(paths)
+        except Exception as e:
+            logger.error(f"Beets import failed: {e}")
+            results = {path: False for path in paths}
+        finished = time.monotonic()
+
+        # Stats before resolving the Futures, whose done callbacks requeue the parked jobs
+        with self._stats_lock:
+            self.batches += 1
+            self.directories += len(batch)
+            self.failed += sum(1 for ok in results.values() if not ok)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.run_seconds_total += finished - started
+            for _, _, submitted in batch:
+                self.latency_total += finished - submitted
+                self.latency_max = max(self.latency_max, finished - submitted)
+        for path, future, _ in batch:
+            future.set_result(results.get(path, False))
+
+    def _import(self, paths):
+        """Imports paths in one beets run. If the run fails as a whole, each path is retried alone."""
+        ok, skipped = self._beet(paths)
+        if not ok:
+            if len(paths) == 1:
+                return {paths[0]: False}
+            logger.warning(f"Batched beets import of {len(paths)} directories failed, importing them one by one.")
+            results = {}
+            for path in paths:
+                results.update(self._import([path]))
+            return results
+        # beets logs absolute paths, the staging directories may be relative (STAGING_DIR)
+        skipped = [os.path.realpath(s) for s in skipped]
+        results = {}
+        for path in paths:
+            root = os.path.realpath(path)
+            results[path] = not any(s == root or s.startswith(root.rstrip(os.sep) + os.sep) for s in skipped)
+        return results
+
+    def _beet(self, paths):
+        """Runs beet once. Returns (exit status ok, paths beets skipped)."""
+        logger.info(f"Running Beets import of {len(paths)} directories: {', '.join(paths)}")
+        fd, log_path = tempfile.mkstemp(prefix='beets-import-', suffix='.log')
+        os.close(fd)
+        try:
+            cmd = ['beet'] + Config.BEETS_ARGS + ['-l', log_path] + paths
+            env = os.environ.copy()
+            subprocess.run(cmd, check=True, env=env)
+            return True, _skipped_paths(log_path)
+        except Exception as e:
+            logger.error(f"Beets import failed: {e}")
+            return False, []
+        finally:
+            os.unlink(log_path)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'directories': self.directories,
+                'failed': self.failed,
+                'avg_batch_size': round(self.directories / self.batches, 2) if self.batches else 0.0,
+                'max_batch_size': self.max_batch_seen,
+                'avg_run_s': round(self.run_seconds_total / self.batches, 2) if self.batches else 0.0,
+                'avg_latency_s': round(self.latency_total / self.directories, 2) if self.directories else 0.0,
+                'max_latency_s': round(self.latency_max, 2),
+            }
+
+
+# Global instance
+import_batcher = BeetsImportBatcher(Config.BEETS_BATCH_WINDOW, Config.BEETS_BATCH_SIZE)
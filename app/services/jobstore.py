@@ -0,0 +1,402 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import logging
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = ('completed', 'failed')
+
+RECORD_COLUMNS = 'id, target, args, kwargs, include_job_id, step, ctx, status, priority, client, updated'
+
+# Columns added to the jobs table after its first release, with their definitions
+ADDED_COLUMNS = (
+    ('queue_stage', 'TEXT'),
+    ('lease_owner', 'TEXT'),
+    ('lease_expires', 'REAL'),
+    ('priority', 'INTEGER NOT NULL DEFAULT 0'),
+    ('client', 'TEXT'),
+)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+class MemoryJobStore:
+    """Keeps nothing: jobs only live in the JobQueue's memory and are lost on restart."""
+
+    def save_job(self, job_id, target, args, kwargs, include_job_id, ctx, status):
+        pass
+
+    def save_progress(self, job_id, step, ctx):
+        pass
+
+    def update_status(self, job_id, status):
+        pass
+
+    def get_status(self, job_id):
+        return None
+
+    def data_version(self):
+        return 0
+
+    def start(self):
+        pass
+
+    def load_unfinished(self):
+        return []
+
+    def purge(self, max_age_seconds):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteJobStore:
+    """
+    Persists jobs in SQLite (WAL mode). Writes are buffered and flushed in one
+    transaction every `flush_interval` seconds, so status updates from busy workers
+    coalesce instead of each paying for a commit.
+    """
+
+    def __init__(self, path, flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Several processes may share the file, wait for their write locks instead of failing
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, target TEXT, args TEXT, kwargs TEXT, include_job_id INTEGER, '
+            'step INTEGER NOT NULL DEFAULT 0, ctx TEXT, state TEXT, status TEXT, '
+            'created REAL NOT NULL, updated REAL NOT NULL, '
+            'queue_stage TEXT, lease_owner TEXT, lease_expires REAL, '
+            'priority INTEGER NOT NULL DEFAULT 0, client TEXT)'
+        )
+        # Stores created before the shared queue (queue_stage, lease_*) or scheduling classes
+        # (priority, client) existed get the columns here, before any index uses them
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        for column, definition in ADDED_COLUMNS:
+            if column not in columns:
+                try:
+                    self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+                except sqlite3.OperationalError:
+                    pass  # Added by another process in the meantime
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, lease_expires)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (queue_stage, created)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS inflight (key TEXT PRIMARY KEY, job_id TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS inflight_job ON inflight (job_id)')
+        self._db_lock = threading.Lock()
+
+        # job_id -> pending column values, merged until the next flush
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def start(self):
+        """Starts the background flushes. Until then writes wait for an explicit flush()."""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True, name='job-store-flusher')
+            self._flusher.start()
+
+    def _queue_write(self, job_id, **columns):
+        with self._pending_lock:
+            self._pending.setdefault(job_id, {}).update(columns)
+
+    def save_job(self, job_id, target, args, kwargs, include_job_id, ctx, status):
+        now = time.time()
+        self._queue_write(job_id, insert=True, target=target, args=_dumps(args), kwargs=_dumps(kwargs),
+                          include_job_id=int(include_job_id), step=0, ctx=_dumps(ctx),
+                          state=status.get('state'), status=_dumps(status), created=now, updated=now)
+
+    def save_progress(self, job_id, step, ctx):
+        self._queue_write(job_id, step=step, ctx=_dumps(ctx), updated=time.time())
+
+    def update_status(self, job_id, status):
+        self._queue_write(job_id, state=status.get('state'), status=_dumps(status), updated=time.time())
+
+    def get_status(self, job_id):
+        with self._pending_lock:
+            pending = self._pending.get(job_id)
+            if pending and 'status' in pending:
+                return json.loads(pending['status'])
+        with self._db_lock:
+            row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def data_version(self):
+        """Changes whenever another process commits to the database (SQLite's PRAGMA data_version)."""
+        with self._db_lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def modify_status(self, job_id, fn):
+        """Replaces a job's status with fn(status) in one transaction, safe across processes."""
+        self.flush()
+        with self._db_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                status = fn(json.loads(row[0]) if row and row[0] else {})
+                self._conn.execute('UPDATE jobs SET state = ?, status = ?, updated = ? WHERE id = ?',
+                                   (status.get('state'), _dumps(status), time.time(), job_id))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return status
+
+    def load_unfinished(self):
+        """Returns jobs that were queued or running when the process stopped."""
+        self.flush()
+        placeholders = ','.join('?' * len(FINISHED_STATES))
+        with self._db_lock:
+            rows = self._conn.execute(
+                f'SELECT {RECORD_COLUMNS} FROM jobs '
+                f'WHERE state IS NULL OR state NOT IN ({placeholders}) ORDER BY created',
+                FINISHED_STATES
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def purge(self, max_age_seconds):
+        """Deletes finished jobs not updated for max_age_seconds."""
+        placeholders = ','.join('?' * len(FINISHED_STATES))
+        with self._db_lock:
+            cursor = self._conn.execute(
+                f'DELETE FROM jobs WHERE state IN ({placeholders}) AND updated < ?',
+                FINISHED_STATES + (time.time() - max_age_seconds,)
+            )
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} finished jobs from the job store")
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        inserts = []
+        updates = {}
+        for job_id, columns in pending.items():
+            if columns.get('insert'):
+                inserts.append((job_id, columns.get('target'), columns.get('args'), columns.get('kwargs'),
+                                columns.get('include_job_id'), columns.get('step', 0), columns.get('ctx'),
+                                columns.get('state'), columns.get('status'), columns['created'], columns['updated']))
+            else:
+                # Group updates touching the same columns so each group is one executemany
+                keys = tuple(sorted(columns))
+                updates.setdefault(keys, []).append(tuple(columns[k] for k in keys) + (job_id,))
+
+        try:
+            with self._db_lock:
+                self._conn.execute('BEGIN')
+                if inserts:
+                    self._conn.executemany(
+                        'INSERT OR REPLACE INTO jobs (id, target, args, kwargs, include_job_id, step, ctx, '
+                        'state, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', inserts
+                    )
+                for keys, rows in updates.items():
+                    assignments = ', '.join(f'{k} = ?' for k in keys)
+                    self._conn.executemany(f'UPDATE jobs SET {assignments} WHERE id = ?', rows)
+                self._conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            logger.error(f"Job store flush failed: {e}")
+            with self._db_lock:
+                if self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+            # Put the writes back (newer pending values win) so the next flush retries them
+            with self._pending_lock:
+                for job_id, columns in pending.items():
+                    self._pending[job_id] = {**columns, **self._pending.get(job_id, {})}
+
+    # Broker operations, used when QUEUE_BACKEND=sqlite. Unlike status updates these are
+    # written immediately, since other processes must see them to claim the job.
+
+    def _record(self, row):
+        return {
+            'id': row[0],
+            'target': row[1],
+            'args': json.loads(row[2]) if row[2] else [],
+            'kwargs': json.loads(row[3]) if row[3] else {},
+            'include_job_id': bool(row[4]),
+            'step': row[5],
+            'ctx': json.loads(row[6]) if row[6] else None,
+            'status': json.loads(row[7]) if row[7] else {},
+            'priority': row[8],
+            'client': row[9],
+            # Set when the job was queued or handed off, later status writes move it a little
+            'queued_at': row[10],
+        }
+
+    def enqueue_job(self, job_id, target, args, kwargs, include_job_id, ctx, status, stage,
+                    priority=0, client=None):
+        """Inserts a new job, immediately claimable from `stage`."""
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO jobs (id, target, args, kwargs, include_job_id, step, ctx, '
+                'state, status, created, updated, queue_stage, priority, client) '
+                'VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, target, _dumps(args), _dumps(kwargs), int(include_job_id), _dumps(ctx),
+                 status.get('state'), _dumps(status), now, now, stage, priority, client)
+            )
+
+    def handoff(self, job_id, stage, step, ctx):
+        """Releases the lease on a job and queues it for its next stage."""
+        with self._db_lock:
+            self._conn.execute(
+                'UPDATE jobs SET queue_stage = ?, step = ?, ctx = ?, lease_owner = NULL, '
+                'lease_expires = NULL, updated = ? WHERE id = ?',
+                (stage, step, _dumps(ctx), time.time(), job_id)
+            )
+
+    def finish(self, job_id):
+        """Takes a completed or failed job off the broker."""
+        with self._db_lock:
+            self._conn.execute(
+                'UPDATE jobs SET queue_stage = NULL, lease_owner = NULL, lease_expires = NULL WHERE id = ?',
+                (job_id,)
+            )
+
+    @staticmethod
+    def _schedule_order(aging, now):
+        """
+        ORDER BY clause and its parameters, matching the local FairQueue: best class first (a job
+        moves up one class every `aging` seconds since it was submitted), then the clients with
+        the fewest jobs being worked on, then the oldest job.
+        """
+        priority, params = 'priority', ()
+        if aging:
+            priority, params = 'priority - CAST((? - created) / ? AS INTEGER)', (now, float(aging))
+        clause = (f'ORDER BY {priority}, (SELECT COUNT(*) FROM jobs AS running WHERE '
+                  f'running.client IS jobs.client AND running.lease_expires >= ?), created')
+        return clause, params + (now,)
+
+    def claim(self, stage, owner, lease_seconds, aging=0):
+        """
+        Atomically leases the next job waiting in `stage` (see _schedule_order), including
+        jobs whose previous lease expired because their worker died.
+        :return: the job record, or None if the stage is empty
+        """
+        now = time.time()
+        order, order_params = self._schedule_order(aging, now)
+        with self._db_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    f'SELECT {RECORD_COLUMNS} FROM jobs '
+                    f'WHERE queue_stage = ? AND (lease_expires IS NULL OR lease_expires < ?) '
+                    f'{order} LIMIT 1', (stage, now) + order_params
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        'UPDATE jobs SET lease_owner = ?, lease_expires = ? WHERE id = ?',
+                        (owner, now + lease_seconds, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self._record(row) if row else None
+
+    def claim_key(self, key, job_id, grace_seconds=60):
+        """
+        Atomically makes job_id the in-flight job for a dedupe key. A key held by a job that
+        finished, or that never made it into the table within grace_seconds, is taken over.
+        :return: the job holding the key
+        """
+        now = time.time()
+        placeholders = ','.join('?' * len(FINISHED_STATES))
+        with self._db_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    f'SELECT inflight.job_id, inflight.created, jobs.id, jobs.state IN ({placeholders}) '
+                    f'FROM inflight LEFT JOIN jobs ON jobs.id = inflight.job_id WHERE inflight.key = ?',
+                    FINISHED_STATES + (key,)
+                ).fetchone()
+                stale = row is None or row[3] or (row[2] is None and row[1] < now - grace_seconds)
+                if stale:
+                    self._conn.execute('INSERT OR REPLACE INTO inflight (key, job_id, created) VALUES (?, ?, ?)',
+                                       (key, job_id, now))
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+        return job_id if stale else row[0]
+
+    def release_keys(self, job_id):
+        with self._db_lock:
+            self._conn.execute('DELETE FROM inflight WHERE job_id = ?', (job_id,))
+
+    def renew_leases(self, owner, job_ids, lease_seconds):
+        if not job_ids:
+            return
+        with self._db_lock:
+            self._conn.executemany(
+                'UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ?',
+                [(time.time() + lease_seconds, job_id, owner) for job_id in job_ids]
+            )
+
+    def depths(self):
+        """Jobs waiting (not leased) per stage, across all processes."""
+        with self._db_lock:
+            rows = self._conn.execute(
+                'SELECT queue_stage, COUNT(*) FROM jobs WHERE queue_stage IS NOT NULL '
+                'AND (lease_expires IS NULL OR lease_expires < ?) GROUP BY queue_stage', (time.time(),)
+            ).fetchall()
+        return dict(rows)
+
+    def queued_jobs(self, aging=0, limit=100):
+        """(job_id, stage, priority) of waiting jobs, in the order each stage would claim them."""
+        now = time.time()
+        order, order_params = self._schedule_order(aging, now)
+        with self._db_lock:
+            rows = self._conn.execute(
+                f'SELECT id, queue_stage, priority FROM jobs WHERE queue_stage IS NOT NULL '
+                f'AND (lease_expires IS NULL OR lease_expires < ?) {order} LIMIT ?',
+                (now,) + order_params + (limit,)
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def leased_jobs(self):
+        """(job_id, status) of every job currently leased by any process."""
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                'SELECT id, status FROM jobs WHERE lease_expires >= ? ORDER BY created', (time.time(),)
+            ).fetchall()
+        return [(row[0], json.loads(row[1]) if row[1] else {}) for row in rows]
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_job_store():
+    """Builds the job store selected by Config.JOB_STORE. The SQLite broker needs the SQLite store."""
+    if Config.JOB_STORE == 'sqlite' or Config.QUEUE_BACKEND == 'sqlite':
+        return SQLiteJobStore(Config.JOB_STORE_PATH, flush_interval=Config.JOB_STORE_FLUSH_INTERVAL)
+    return MemoryJobStore()
@@ -0,0 +1,265 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.mp4', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wav', '.wma', '.aiff', '.ape', '.wv'}
+TAG_FIELDS = ('artist', 'album', 'title')
+# Rows written per transaction while rescanning
+WRITE_BATCH = 500
+
+
+def _read_tags(root, rel_path):
+    """Reads one file's tags with mutagen. Unreadable files keep their filename as the title."""
+    import mutagen
+    row = {'path': rel_path, 'artist': None, 'album': None, 'title': None, 'duration': None,
+           'format': os.path.splitext(rel_path)[1][1:].lower()}
+    try:
+        audio = mutagen.File(os.path.join(root, rel_path), easy=True)
+    except (mutagen.MutagenError, OSError, ValueError) as e:
+        logger.debug(f"Cannot read tags of {rel_path}: {e}")
+        audio = None
+    if audio is not None:
+        tags = audio.tags or {}
+        for field in TAG_FIELDS:
+            try:
+                values = tags.get(field)
+            except (KeyError, ValueError):
+                values = None
+            if values:
+                row[field] = str(values[0] if isinstance(values, list) else values)
+        length = getattr(audio.info, 'length', None)
+        row['duration'] = round(length, 2) if length else None
+    if not row['title']:
+        row['title'] = os.path.splitext(os.path.basename(rel_path))[0]
+    return row
+
+
+def _match_expression(query):
+    """Turns free text into an FTS5 query: every word must match a prefix of some tag."""
+    words = [word.replace('"', '""') for word in query.split()]
+    return ' '.join(f'"{word}"*' for word in words if word)
+
+
+class LibraryIndex:
+    """
+    Searchable index of the tags (artist, album, title, duration, format) of the audio files
+    under `root`, kept in SQLite with an FTS5 table over the tags. Rows are keyed on the
+    relative path and remember mtime and size, so a rescan only re-reads changed files,
+    on a pool of `workers` threads. Rescans run in the background every `rescan_interval`
+    seconds, files moved into the library are indexed right away with `update()`.
+    """
+
+    def __init__(self, root, path, workers=4, rescan_interval=3600):
+        self.root = root
+        self.path = path
+        self.workers = max(1, workers)
+        self.rescan_interval = rescan_interval
+        self._conn = None
+        self._lock = threading.Lock()       # Guards the connection
+        self._scan_lock = threading.Lock()  # One rescan at a time
+        self._started = False
+        self.tracks = 0
+        self.scans = 0
+        self.files_read = 0
+        self.last_scan_seconds = None
+        self.last_scan_at = None
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tracks ('
+                'id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL, '
+                'artist TEXT, album TEXT, title TEXT, duration REAL, format TEXT)'
+            )
+            # External content table: the FTS index holds only the tokens, triggers keep it in sync
+            conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5("
+                "artist, album, title, content='tracks', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+            )
+            conn.executescript(
+                'CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN '
+                'INSERT INTO tracks_fts (rowid, artist, album, title) VALUES (new.id, new.artist, new.album, new.title); END;'
+                'CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN '
+                "INSERT INTO tracks_fts (tracks_fts, rowid, artist, album, title) "
+                "VALUES ('delete', old.id, old.artist, old.album, old.title); END;"
+                'CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN '
+                "INSERT INTO tracks_fts (tracks_fts, rowid, artist, album, title) "
+                "VALUES ('delete', old.id, old.artist, old.album, old.title); "
+                'INSERT INTO tracks_fts (rowid, artist, album, title) VALUES (new.id, new.artist, new.album, new.title); END;'
+            )
+            # Artist and title matches count for more than album ones
+            conn.execute("INSERT INTO tracks_fts (tracks_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 2.0)')")
+            conn.commit()
+            self.tracks = conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def start(self):
+        """Starts the background rescans, the first one right away."""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._rescan_loop, daemon=True, name='library-rescan').start()
+
+    def _rescan_loop(self):
+        while True:
+            try:
+                self.rescan()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Library rescan failed: {e}")
+            time.sleep(self.rescan_interval)
+
+    def _walk(self):
+        """Returns {relative path: (mtime, size)} of the audio files under the root."""
+        found = {}
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in AUDIO_EXTENSIONS:
+                    continue
+                full = os.path.join(root, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue  # Removed while walking
+                found[os.path.relpath(full, self.root)] = (st.st_mtime, st.st_size)
+        return found
+
+    def _store(self, rows):
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                'INSERT INTO tracks (path, mtime, size, artist, album, title, duration, format) '
+                'VALUES (:path, :mtime, :size, :artist, :album, :title, :duration, :format) '
+                'ON CONFLICT (path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size, '
+                'artist = excluded.artist, album = excluded.album, title = excluded.title, '
+                'duration = excluded.duration, format = excluded.format',
+                rows
+            )
+            db.commit()
+            self.tracks = db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def _remove(self, paths):
+        with self._lock:
+            db = self._db()
+            db.executemany('DELETE FROM tracks WHERE path = ?', ((p,) for p in paths))
+            db.commit()
+            self.tracks = db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def rescan(self):
+        """
+        Brings the index in line with the disk: reads new and changed files, drops removed ones.
+        :return: (files read, files removed)
+        """
+        with self._scan_lock:
+            started = time.monotonic()
+            os.makedirs(self.root, exist_ok=True)
+            on_disk = self._walk()
+            with self._lock:
+                known = {path: (mtime, size) for path, mtime, size in
+                         self._db().execute('SELECT path, mtime, size FROM tracks')}
+            changed = [path for path, stat in on_disk.items() if known.get(path) != stat]
+            removed = [path for path in known if path not in on_disk]
+
+            if removed:
+                self._remove(removed)
+            if changed:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='library-read') as executor:
+                    batch = []
+                    for row in executor.map(lambda path: _read_tags(self.root, path), changed):
+                        row['mtime'], row['size'] = on_disk[row['path']]
+                        batch.append(row)
+                        if len(batch) >= WRITE_BATCH:
+                            self._store(batch)
+                            batch = []
+                    if batch:
+                        self._store(batch)
+
+            seconds = time.monotonic() - started
+            with self._lock:
+                self.scans += 1
+                self.files_read += len(changed)
+                self.last_scan_seconds = round(seconds, 3)
+                self.last_scan_at = time.time()
+            if changed or removed:
+                logger.info(f"Library index: read {len(changed)} files, removed {len(removed)} in {seconds:.1f}s")
+            return len(changed), len(removed)
+
+    def update(self, paths):
+        """Indexes the given files (absolute paths under the root) now, e.g. right after a move."""
+        root_abs = os.path.abspath(self.root)
+        rows = []
+        for path in paths:
+            full = os.path.abspath(path)
+            if not full.startswith(root_abs + os.sep) or os.path.splitext(full)[1].lower() not in AUDIO_EXTENSIONS:
+                continue
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            row = _read_tags(root_abs, os.path.relpath(full, root_abs))
+            row['mtime'], row['size'] = st.st_mtime, st.st_size
+            rows.append(row)
+        if rows:
+            try:
+                self._store(rows)
+            except sqlite3.Error as e:
+                logger.error(f"Library index update failed: {e}")
+        return len(rows)
+
+    def search(self, query, limit=50):
+        """
+        Full-text search over artist, album and title. Every word of `query` must match
+        the start of a word in one of them, best matches first.
+        :return: list of dicts with path, artist, album, title, duration and format
+        """
+        expression = _match_expression(query)
+        if not expression:
+            return []
+        with self._lock:
+            try:
+                # Rank and limit inside FTS5 first, so only the returned rows are looked up
+                rows = self._db().execute(
+                    'SELECT t.path, t.artist, t.album, t.title, t.duration, t.format FROM '
+                    '(SELECT rowid, rank FROM tracks_fts WHERE tracks_fts MATCH ? ORDER BY rank LIMIT ?) AS m '
+                    'JOIN tracks AS t ON t.id = m.rowid ORDER BY m.rank',
+                    (expression, limit)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Library search failed: {e}")
+                return []
+        return [dict(zip(('path', 'artist', 'album', 'title', 'duration', 'format'), row)) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracks': self.tracks,
+                'scans': self.scans,
+                'files_read': self.files_read,
+                'last_scan_seconds': self.last_scan_seconds,
+                'last_scan_at': self.last_scan_at,
+                'scanning': self._scan_lock.locked(),
+            }
+
+
+# Global instance
+library_index = LibraryIndex(
+    Config.DOWNLOAD_DIR,
+    Config.LIBRARY_INDEX_PATH,
+    workers=Config.LIBRARY_INDEX_WORKERS,
+    rescan_interval=Config.LIBRARY_RESCAN_INTERVAL,
+)
@@ -0,0 +1,198 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+LOCK_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1)
+BYTES_BUCKETS = (1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, registry=None):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    """Monotonic total per label set."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, registry=None):
+        super().__init__(name, documentation, registry)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in values.items()]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram per label set, like Prometheus client histograms."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=SECONDS_BUCKETS, registry=None):
+        super().__init__(name, documentation, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = self.header()
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key, [("le", _format_value(float(bound)))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(values[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {values[-1]}')
+        return lines
+
+
+class Registry:
+    """Metrics plus collector callbacks that report current values (gauges) at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, collector):
+        """collector() returns [(name, 'gauge'|'counter', help, [(labels dict, value), ...]), ...]"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def expose(self):
+        """The Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        for collector in collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f'{name}{_format_labels(_label_key(labels))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """
+    threading.Lock that records how long callers wait for it and hold it.
+    Works as the lock of a threading.Condition.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            lock_wait_seconds.observe(self._acquired_at - start, lock=self.name)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        lock_hold_seconds.observe(held, lock=self.name)
+
+    def locked(self):
+        return self._lock.locked()
+
+    def _is_owned(self):
+        # Used by threading.Condition; like its fallback for plain Locks, minus a timed acquire
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+REGISTRY = Registry()
+
+# Job pipeline
+stage_seconds = Histogram('music_query_stage_seconds', 'Time spent in each job stage', SECONDS_BUCKETS)
+step_seconds = Histogram('music_query_step_seconds', 'Time a worker pool spent on one pipeline step', SECONDS_BUCKETS)
+queue_wait_seconds = Histogram('music_query_queue_wait_seconds', 'Time a job waited in a stage queue', SECONDS_BUCKETS)
+jobs_finished = Counter('music_query_jobs_finished_total', 'Jobs finished, by final state')
+
+# Downloads
+download_bytes = Histogram('music_query_download_bytes', 'Size of downloaded files', BYTES_BUCKETS)
+downloaded_bytes = Counter('music_query_downloaded_bytes_total', 'Bytes downloaded by yt-dlp')
+
+# Odesli
+odesli_seconds = Histogram('music_query_odesli_request_seconds', 'Odesli API request latency, by HTTP status',
+                           SECONDS_BUCKETS)
+
+# Locks
+lock_wait_seconds = Histogram('music_query_lock_wait_seconds', 'Time spent waiting to acquire a lock', LOCK_BUCKETS)
+lock_hold_seconds = Histogram('music_query_lock_hold_seconds', 'Time a lock was held', LOCK_BUCKETS)
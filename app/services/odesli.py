@@ -0,0 +1,207 @@
+import random
+import threading
+import time
+import logging
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote_plus
+from ..config import Config
+from .metrics import odesli_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class OdesliRateLimited(Exception):
+    """Raised when Odesli keeps answering 429 after all retries."""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` tokens are added per second up to `capacity`.
+    A rate of 0 or less is unlimited, only penalize() holds requests back then.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0  # Unlimited buckets only
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available. Returns the time spent waiting."""
+        if self.rate <= 0:
+            with self._lock:
+                delay = max(0.0, self._paused_until - time.monotonic())
+            if delay:
+                time.sleep(delay)
+            return delay
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self, seconds):
+        """Empties the bucket so no request is sent for roughly `seconds`."""
+        with self._lock:
+            if self.rate <= 0:
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                return
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header (delta-seconds or HTTP-date)."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class OdesliClient:
+    """
+    Pooled, rate-limited client for the Odesli (song.link) API.
+    All lookups share one keep-alive session and one token bucket, 429s and 5xx
+    are retried with jittered exponential backoff honoring Retry-After.
+    """
+
+    def __init__(self, api_url, timeout=10, requests_per_minute=10, burst=5,
+                 max_retries=3, api_key=None, pool_size=8):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.api_key = api_key
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+
+        self.pool_size = pool_size
+        self._session = None  # Created by the first lookup, importing requests costs startup time
+        self._session_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.requests_total = 0
+        self.rate_limited_total = 0
+        self.retries_total = 0
+        self.errors_total = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.throttle_wait_total = 0.0
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _record(self, latency, status_code=None, waited=0.0):
+        odesli_seconds.observe(latency, status=str(status_code) if status_code else 'error')
+        with self._stats_lock:
+            self.requests_total += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.throttle_wait_total += waited
+            if status_code == 429:
+                self.rate_limited_total += 1
+            elif status_code is None or status_code >= 500:
+                self.errors_total += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        base = retry_after if retry_after is not None else min(60.0, 2 ** attempt)
+        return base + random.uniform(0, base * 0.25 + 0.5)
+
+    def lookup(self, url):
+        """
+        Queries Odesli for a source URL.
+        :return: (status_code, json_data or None)
+        :raises OdesliRateLimited: if every attempt was answered with 429
+        :raises requests.RequestException: on network errors after all retries
+        """
+        import requests
+        api_url = f"{self.api_url}{quote_plus(url)}"
+        if self.api_key:
+            api_url += f"&key={quote_plus(self.api_key)}"
+
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(api_url, timeout=self.timeout)
+            except requests.RequestException:
+                self._record(time.monotonic() - start, waited=waited)
+                if attempt >= self.max_retries:
+                    raise
+                with self._stats_lock:
+                    self.retries_total += 1
+                time.sleep(self._backoff(attempt))
+                continue
+
+            self._record(time.monotonic() - start, response.status_code, waited)
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt >= self.max_retries:
+                    if response.status_code == 429:
+                        raise OdesliRateLimited(f"Odesli rate limit exceeded for {url}")
+                    return response.status_code, None
+                delay = self._backoff(attempt, _retry_after_seconds(response))
+                if response.status_code == 429:
+                    # Hold back every other lookup too, not just this one
+                    self.bucket.penalize(delay)
+                logger.warning(f"Odesli returned {response.status_code}, retrying in {delay:.1f}s")
+                with self._stats_lock:
+                    self.retries_total += 1
+                time.sleep(delay)
+                continue
+
+            if response.status_code == 200:
+                return 200, response.json()
+            return response.status_code, None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'requests': self.requests_total,
+                'rate_limited': self.rate_limited_total,
+                'retries': self.retries_total,
+                'errors': self.errors_total,
+                'avg_latency_ms': round(1000 * self.latency_total / self.requests_total, 1) if self.requests_total else 0.0,
+                'max_latency_ms': round(1000 * self.latency_max, 1),
+                'throttle_wait_s': round(self.throttle_wait_total, 2),
+            }
+
+
+# Global instance
+odesli_client = OdesliClient(
+    Config.ODESLI_API_URL,
+    timeout=Config.REQUEST_TIMEOUT,
+    requests_per_minute=Config.ODESLI_RATE_LIMIT,
+    burst=Config.ODESLI_RATE_BURST,
+    max_retries=Config.ODESLI_MAX_RETRIES,
+    api_key=Config.ODESLI_API_KEY,
+)
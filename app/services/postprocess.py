@@ -0,0 +1,127 @@
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from ..config import Config
+from .ytdl import ytdl_pool
+
+logger = logging.getLogger(__name__)
+
+# This module is imported by the pool's worker processes, keep it free of
+# imports that start threads (e.g. the job queue).
+
+
+def audio_postprocessors():
+    """yt-dlp postprocessors that turn a raw download into a tagged audio file."""
+    audio_quality = Config.AUDIO_QUALITY
+    if audio_quality.lower() == 'best':
+        audio_quality = '0' # Best VBR quality
+
+    return [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': Config.AUDIO_CODEC,
+        'preferredquality': audio_quality,
+    }, {
+        'key': 'FFmpegMetadata',
+    }, {
+        'key': 'EmbedThumbnail',
+    }]
+
+
+def final_ext():
+    """Extension of post-processed files, so yt-dlp and resumed jobs can tell a track is done."""
+    from yt_dlp.postprocessor.ffmpeg import ACODECS
+    return ACODECS[Config.AUDIO_CODEC][0]
+
+
+def postprocessed_path(filepath):
+    """
+    The post-processed file of a download whose post-processing already finished (e.g. before
+    a restart): the raw file was replaced by one with final_ext(). None if it still needs work.
+    """
+    if os.path.exists(filepath):
+        return None
+    done = f"{os.path.splitext(filepath)[0]}.{final_ext()}"
+    return done if os.path.exists(done) else None
+
+
+def _lower_priority(nice_value):
+    """Process pool initializer: FFmpeg children inherit the niceness."""
+    if nice_value:
+        try:
+            os.nice(nice_value)
+        except OSError as e:
+            logger.warning(f"Could not set nice value {nice_value}: {e}")
+
+
+def run_postprocessors(filepath, info, ydl_opts):
+    """
+    Runs the configured postprocessors on one downloaded file.
+    Executed inside a pool process. Returns the final file path.
+    """
+    with ytdl_pool.lease(ydl_opts) as ydl:
+        info = ydl.post_process(filepath, dict(info))
+    return info.get('filepath', filepath)
+
+
+class PostprocessPool:
+    """
+    Bounded process pool for transcoding/tagging, so the files of a playlist are
+    processed in parallel on every core without blocking the download workers.
+    """
+
+    def __init__(self, processes=0, nice_value=0):
+        self.processes = processes or os.cpu_count() or 1
+        self.nice_value = nice_value
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process full of threads can deadlock on inherited locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_lower_priority,
+                    initargs=(self.nice_value,),
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def map(self, files, ydl_opts, on_done=None):
+        """
+        Post-processes (filepath, info) pairs in parallel.
+        :param on_done: optional callback, called with the number of finished files after each one
+        :return: the final file paths, in input order
+        """
+        executor = self._get_executor()
+        try:
+            futures = [executor.submit(run_postprocessors, path, info, ydl_opts) for path, info in files]
+            for count, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if on_done:
+                    on_done(count)
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A worker died (OOM, killed FFmpeg...), start a fresh pool for the next job
+            logger.error("Post-processing pool broke, recreating it.")
+            self._reset(executor)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+# Global instance
+postprocess_pool = PostprocessPool(Config.POSTPROCESS_PROCESSES, Config.PROCESS_NICE_VALUE)
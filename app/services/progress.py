@@ -0,0 +1,86 @@
+import threading
+import time
+from ..config import Config
+from .metrics import download_bytes, downloaded_bytes
+from .queue import job_queue
+
+
+class ProgressReporter:
+    """
+    Collects yt-dlp progress/postprocessor hook data for one job and publishes it
+    to the job status at most every `interval` seconds. Hooks fire for every
+    downloaded chunk; coalescing them keeps JobQueue lock traffic flat.
+    """
+
+    def __init__(self, job_id, interval=None):
+        self.job_id = job_id
+        self.interval = Config.PROGRESS_INTERVAL if interval is None else interval
+        self.progress = {}
+        self._tracks_done = set()
+        self._last_publish = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def update(self, force=False, **fields):
+        """Merges fields into the progress and publishes it if the interval has passed (or force)."""
+        with self._lock:
+            self.progress.update(fields)
+            now = time.monotonic()
+            if not force and now - self._last_publish < self.interval:
+                self._dirty = True
+                return
+            self._last_publish = now
+            self._dirty = False
+            snapshot = dict(self.progress)
+        if self.job_id:
+            job_queue.update_job_status(self.job_id, progress=snapshot)
+
+    def flush(self):
+        """Publishes anything held back by the throttle."""
+        with self._lock:
+            dirty = self._dirty
+        if dirty:
+            self.update(force=True)
+
+    def progress_hook(self, d):
+        """yt-dlp progress_hooks entry: bytes, speed, ETA and track N of M."""
+        info = d.get('info_dict') or {}
+        track = info.get('playlist_index') or 1
+        tracks = info.get('n_entries') or info.get('playlist_count') or 1
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        downloaded = d.get('downloaded_bytes') or 0
+        finished = d.get('status') == 'finished'
+        if finished:
+            self._tracks_done.add(track)
+            size = downloaded or total
+            if size:
+                download_bytes.observe(size)
+                downloaded_bytes.inc(size)
+
+        # Whole-job percentage: finished tracks plus the fraction of the current one
+        fraction = 1.0 if finished else (downloaded / total if total else 0.0)
+        done = len(self._tracks_done) - (1 if finished else 0)
+        overall = min(100.0, 100.0 * (done + fraction) / tracks)
+
+        self.update(
+            force=finished or d.get('status') == 'error',
+            track=track,
+            tracks=tracks,
+            track_title=info.get('title'),
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            percent=round(100.0 * downloaded / total, 1) if total else None,
+            overall_percent=round(overall, 1),
+            speed=d.get('speed'),
+            eta=d.get('eta'),
+        )
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor_hooks entry (inline post-processing mode)."""
+        info = d.get('info_dict') or {}
+        self.update(
+            force=d.get('status') != 'processing',
+            postprocessor=d.get('postprocessor'),
+            postprocessor_status=d.get('status'),
+            track=info.get('playlist_index') or self.progress.get('track'),
+        )
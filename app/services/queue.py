@@ -1,15 +1,235 @@
+import atexit
+import collections
+import importlib
+import os
 import queue
+import socket
 import threading
 import time
 import uuid
 import logging
 from ..config import Config
+from .jobstore import create_job_store, FINISHED_STATES
+from .metrics import REGISTRY, TimedLock, jobs_finished, queue_wait_seconds, step_seconds
+from .statuses import StatusStore
 
 logger = logging.getLogger(__name__)
 
+# Worker pools in pipeline order: (stage name, Config attribute holding the pool size)
+STAGE_POOLS = (
+    ('resolve', 'RESOLVE_WORKERS'),           # I/O bound: Odesli lookups
+    ('download', 'MAX_CONCURRENT_DOWNLOADS'), # Network bound: yt-dlp
+    ('postprocess', 'POSTPROCESS_WORKERS'),   # CPU bound: FFmpeg transcode/tag
+    ('import', 'IMPORT_WORKERS'),             # Disk bound: beets import / file moves
+)
+
+# Plain callables passed to add_job run as a single step on this pool
+DEFAULT_STAGE = 'download'
+
+# Pipelines by name, so persisted jobs can find theirs again after a restart
+PIPELINES = {}
+
+# Scheduling classes, lower runs first
+PRIORITY_INTERACTIVE = 0  # Single tracks someone is waiting for
+PRIORITY_BULK = 1         # Playlist tracks
+
+# Jobs listed with their queue position in get_status()
+QUEUED_JOBS_LIMIT = 100
+
+
+class JobFinished(Exception):
+    """Raised by a step to end its job early as completed, e.g. when there is nothing left to do."""
+
+
+class JobDetached(Exception):
+    """
+    Raised by a step that handed the rest of its job to other jobs (e.g. playlist tracks).
+    The job leaves the queue but stays open, whoever finishes the work completes its status.
+    """
+
+
+class JobParked(Exception):
+    """
+    Raised by a job's last step when the rest of its work waits on a Future (e.g. a batched
+    beets import). The worker moves on to other jobs; once the Future is done, the job goes
+    back to its stage and resume(ctx, future) finishes it on one of its workers, like a last step.
+    """
+
+    def __init__(self, future, resume):
+        super().__init__('parked')
+        self.future = future
+        self.resume = resume
+
+
+class Pipeline:
+    """
+    An ordered list of (stage, step) pairs.
+    Each step is called with the job's context dict and runs on its stage's worker pool,
+    so a job moves from pool to pool and every pool can be sized for its bottleneck.
+    Consecutive steps on the same stage run back to back on one worker.
+    """
+
+    def __init__(self, name, *steps, on_finish=None):
+        self.name = name
+        self.steps = steps
+        # Called as on_finish(ctx, state, error) by the worker once a queued job completes or fails
+        self.on_finish = on_finish
+        PIPELINES[name] = self
+
+    def run(self, ctx):
+        """Runs every step inline on the calling thread. A parked job is waited for here."""
+        try:
+            for _, step in self.steps:
+                try:
+                    step(ctx)
+                except JobParked as parked:
+                    parked.future.exception()  # Blocks until it is done
+                    parked.resume(ctx, parked.future)
+                    break
+        except (JobFinished, JobDetached):
+            pass
+        return ctx
+
+
+def _rank(lane, job, served, now, aging):
+    priority, client = lane
+    if aging:
+        priority -= int((now - job['queued_at']) / aging)
+    # Best class first, then the client served longest ago, then the oldest job
+    return priority, served.get(client, 0), job['queued_at']
+
+
+class FairQueue(queue.Queue):
+    """
+    Stage queue that serves the best priority class first and, within a class, takes
+    turns between clients, so one client's backlog cannot starve everyone else.
+    With `aging`, a job moves up one class for every `aging` seconds it waits.
+    Items are job dicts with 'priority' and 'client'.
+    """
+
+    def __init__(self, maxsize=0, aging=0):
+        self.aging = aging
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self._lanes = {}   # (priority, client) -> deque of jobs, FIFO
+        self._served = {}  # client -> sequence number of its last job taken
+        self._seq = 0
+        self._count = 0
+
+    def _qsize(self):
+        return self._count
+
+    def _put(self, job):
+        job['queued_at'] = time.time()
+        lane = (job.get('priority', PRIORITY_INTERACTIVE), job.get('client'))
+        self._lanes.setdefault(lane, collections.deque()).append(job)
+        self._count += 1
+
+    def _get(self):
+        now = time.time()
+        lane = min(self._lanes, key=lambda l: _rank(l, self._lanes[l][0], self._served, now, self.aging))
+        jobs = self._lanes[lane]
+        job = jobs.popleft()
+        if not jobs:
+            del self._lanes[lane]
+        self._count -= 1
+        self._seq += 1
+        client = lane[1]
+        if any(l[1] == client for l in self._lanes):
+            self._served[client] = self._seq
+        else:
+            self._served.pop(client, None)  # Nothing left queued, forget the client
+        return job
+
+    def ordered(self, limit=None):
+        """The queued jobs in the order they would be taken right now."""
+        with self.mutex:
+            lanes = {lane: collections.deque(jobs) for lane, jobs in self._lanes.items()}
+            served = dict(self._served)
+            seq = self._seq
+        now = time.time()
+        result = []
+        while lanes and (limit is None or len(result) < limit):
+            lane = min(lanes, key=lambda l: _rank(l, lanes[l][0], served, now, self.aging))
+            result.append(lanes[lane].popleft())
+            if not lanes[lane]:
+                del lanes[lane]
+            seq += 1
+            served[lane[1]] = seq
+        return result
+
+
+class Stage:
+    """A worker pool with its own queue. Hand-offs from the previous stage are bounded."""
+
+    def __init__(self, name, workers, maxsize, aging=0):
+        self.name = name
+        self.workers = workers
+        self.queue = FairQueue(aging=aging)
+        # Jobs coming from an upstream stage must take a slot, so a slow stage
+        # stalls the one before it instead of piling up finished work in memory
+        self.slots = threading.BoundedSemaphore(maxsize)
+        # Optional callable, while it returns False the stage's workers take no new jobs
+        self.gate = None
+        # Parked jobs whose Future is done, taken before new jobs in broker mode
+        self.resumed = queue.Queue()
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self.processed = 0
+        self.avg_seconds = None  # Moving average of one step's duration
+        self.started_at = time.time()
+        self.threads = []
+
+    def record(self, seconds):
+        """Accounts for one finished step."""
+        self.busy_seconds += seconds
+        self.processed += 1
+        self.avg_seconds = seconds if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * seconds
+
+    def estimated_wait(self, position):
+        """Seconds until the job at `position` (0 = next) in this stage's queue starts, if known."""
+        if self.avg_seconds is None:
+            return None
+        rounds = position // self.workers + (1 if self.busy >= self.workers else 0)
+        return round(rounds * self.avg_seconds, 1)
+
+    def status(self):
+        uptime = max(time.time() - self.started_at, 1e-6)
+        return {
+            'workers': self.workers,
+            'busy': self.busy,
+            'depth': self.queue.qsize(),
+            'processed': self.processed,
+            'avg_seconds': round(self.avg_seconds, 2) if self.avg_seconds is not None else None,
+            'utilization': round(min(1.0, self.busy_seconds / (uptime * self.workers)), 3),
+        }
+
+
+def _target_ref(job_func):
+    """A string that finds job_func again after a restart, or None if it cannot be found."""
+    if isinstance(job_func, Pipeline):
+        return f"pipeline:{job_func.name}"
+    module = getattr(job_func, '__module__', None)
+    qualname = getattr(job_func, '__qualname__', '')
+    if not module or '<' in qualname:
+        return None  # lambdas and closures cannot be re-imported
+    return f"{module}:{qualname}"
+
+
+def _resolve_target(ref):
+    kind, _, name = ref.partition(':')
+    if kind == 'pipeline':
+        return PIPELINES[name]
+    target = importlib.import_module(kind)
+    for attr in name.split('.'):
+        target = getattr(target, attr)
+    return target
+
+
 class JobQueue:
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(JobQueue, cls).__new__(cls)
@@ -19,142 +239,629 @@ class JobQueue:
     def __init__(self):
         if self._initialized:
             return
-            
-        self.queue = queue.Queue()
+
         self.current_job = None
-        self.running = True
-        self._lock = threading.Lock()
-        self._statuses = {}
+        self.running = False
+        # Guards scheduling state (current jobs, dedupe keys, leases), hold times show up in /metrics
+        self._lock = TimedLock('job_queue')
+        # Job statuses have their own sharded locks, status updates and long-polls never take _lock
+        self._statuses = StatusStore(Config.STATUS_SHARDS, Config.STATUS_MAX_ENTRIES, Config.STATUS_MAX_AGE)
+        self._purged_at = 0.0
+        # Jobs taken and finished by this process' workers, part of `version`
+        self._events = 0
         self.current_jobs = set()
+        self.store = create_job_store()
+        # In-flight dedupe keys: key -> job_id and job_id -> keys (local queue only)
+        self._inflight = {}
+        self._job_keys = {}
+
+        # With the SQLite broker the stage queues live in the job store, shared by every
+        # process (gunicorn workers, worker.py), and jobs are claimed with renewable leases
+        self.broker = Config.QUEUE_BACKEND == 'sqlite'
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._leased = set()
 
-        self._max_workers = max(1, int(getattr(Config, 'MAX_CONCURRENT_DOWNLOADS', 1)))
+        self.stages = {}
         self.worker_threads = []
-        for i in range(self._max_workers):
-            t = threading.Thread(target=self._worker, daemon=True, name=f"job-worker-{i+1}")
-            t.start()
-            self.worker_threads.append(t)
+        maxsize = max(1, int(getattr(Config, 'STAGE_QUEUE_SIZE', 2)))
+        for name, setting in STAGE_POOLS:
+            workers = max(1, int(getattr(Config, setting, 1)))
+            self.stages[name] = Stage(name, workers, maxsize, aging=Config.PRIORITY_AGING)
+        REGISTRY.add_collector(self._collect_metrics)
 
         self._initialized = True
 
-        # Start cleanup thread
+    def start(self, workers=True):
+        """
+        Starts the job store's flushes and the status cleanup. With `workers`, also re-queues
+        interrupted jobs and starts the stage worker (and lease heartbeat) threads.
+        Importing the module starts nothing: see background.start_background.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.store.start()
         cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
         cleanup_thread.start()
+        if not workers:
+            return  # Web-only process, nobody here would run recovered jobs
+
+        self.recover_jobs()
+        for stage in self.stages.values():
+            for i in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(stage,), daemon=True,
+                                     name=f"{stage.name}-worker-{i+1}")
+                t.start()
+                stage.threads.append(t)
+                self.worker_threads.append(t)
+
+        if self.broker:
+            heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        """Renews the leases of jobs this process is working on."""
+        while self.running:
+            time.sleep(Config.QUEUE_LEASE_SECONDS / 3)
+            with self._lock:
+                job_ids = list(self._leased)
+            try:
+                self.store.renew_leases(self.worker_id, job_ids, Config.QUEUE_LEASE_SECONDS)
+            except Exception as e:
+                logger.error(f"Lease renewal failed: {e}")
+
+    @property
+    def queue(self):
+        """Intake queue of the first stage, kept for callers of the old single-queue API."""
+        return self.stages[STAGE_POOLS[0][0]].queue
 
     def _cleanup_loop(self):
         """Periodically clean up old job statuses."""
         while self.running:
-            time.sleep(600)  # Run every 10 minutes
+            time.sleep(60)  # Expiry only visits expired entries, so it can run often
             self._cleanup_old_statuses()
 
-    def _cleanup_old_statuses(self, max_age_seconds=3600):
-        """Remove statuses older than max_age_seconds."""
-        now = time.time()
-        expired = []
-        with self._lock:
-            for jid, entry in self._statuses.items():
-                timestamp = entry.get('timestamp', 0)
-                if now - timestamp > max_age_seconds:
-                    expired.append(jid)
-            for jid in expired:
-                del self._statuses[jid]
+    def _cleanup_old_statuses(self, max_age_seconds=None):
+        """
+        Remove statuses of jobs finished more than max_age_seconds (STATUS_MAX_AGE) ago from memory.
+        The job store keeps them (for JOB_RETENTION) so /job/<id> still answers.
+        """
+        expired = self._statuses.expire(max_age_seconds)
         if expired:
-            logger.info(f"Cleaned up {len(expired)} expired job statuses")
+            logger.info(f"Cleaned up {expired} expired job statuses")
+        if time.monotonic() - self._purged_at >= 600:
+            self._purged_at = time.monotonic()
+            self.store.purge(Config.JOB_RETENTION)
 
-    def add_job(self, job_func, *args, include_job_id=False, **kwargs):
+    def add_job(self, job_func, *args, include_job_id=False, dedupe_key=None,
+                priority=PRIORITY_INTERACTIVE, client=None, **kwargs):
         """
         Adds a job to the queue.
-        :param job_func: The function to execute
+        :param job_func: The function to execute, or a Pipeline
         :param args: Positional arguments for the function
-        :param kwargs: Keyword arguments for the function
+        :param kwargs: Keyword arguments for the function (the initial context for a Pipeline)
         :param include_job_id: If True, passes job_id to job_func as kwarg
+        :param dedupe_key: If another unfinished job holds this key, no job is added and its id is returned
+        :param priority: Scheduling class, PRIORITY_INTERACTIVE or PRIORITY_BULK
+        :param client: Who asked for the job (e.g. an IP address); clients take turns in each class
         :return: job_id
         """
         job_id = str(uuid.uuid4())
+        if isinstance(job_func, Pipeline):
+            if args:
+                raise TypeError("Pipeline jobs take keyword arguments only")
+            steps = job_func.steps
+            ctx = dict(kwargs, job_id=job_id, priority=priority, client=client)
+            if dedupe_key:
+                ctx['dedupe_keys'] = [dedupe_key]
+        else:
+            steps = ((DEFAULT_STAGE, None),)
+            ctx = None
         job = {
             'id': job_id,
             'func': job_func,
             'args': args,
             'kwargs': kwargs,
+            'steps': steps,
+            'step': 0,
+            'ctx': ctx,
             'status': 'pending',
-            'timestamp': time.time()
+            'timestamp': time.time(),
+            'priority': priority,
+            'client': client,
         }
         job['include_job_id'] = include_job_id
-        self.queue.put(job)
-        self._update_status(job_id, state='queued', stage='queued')
+        status = {'state': 'queued', 'stage': 'queued', 'timestamp': job['timestamp'], 'version': 1}
+        target = _target_ref(job_func)
+        if self.broker and not target:
+            raise ValueError("Jobs on the shared queue must be importable functions or Pipelines")
+        if dedupe_key:
+            owner = self.claim_key(dedupe_key, job_id)
+            if owner != job_id:
+                logger.info(f"Coalesced request into in-flight job {owner} ({dedupe_key})")
+                return owner
+
+        if self.broker:
+            self.store.enqueue_job(job_id, target, args, kwargs, include_job_id, ctx, status, steps[0][0],
+                                   priority=priority, client=client)
+            self._statuses.set(job_id, status)
+            return job_id
+
+        self._statuses.set(job_id, status)
+        if target:
+            self.store.save_job(job_id, target, args, kwargs, include_job_id, ctx, status)
+        self.stages[steps[0][0]].queue.put(job)
         return job_id
 
-    def _worker(self):
-        logger.info("Background worker started.")
+    def claim_key(self, key, job_id):
+        """
+        Makes job_id the in-flight job for a dedupe key (e.g. 'youtube <video id>'),
+        unless another unfinished job already holds it. Keys are released when the job ends.
+        :return: the job holding the key, job_id if it is now this one
+        """
+        if self.broker:
+            return self.store.claim_key(key, job_id)
+        with self._lock:
+            owner = self._inflight.get(key)
+            # The owner's last step may have reported it finished before its keys were released
+            if owner and owner != job_id and self._statuses.state(owner) not in FINISHED_STATES:
+                return owner
+            self._inflight[key] = job_id
+            self._job_keys.setdefault(job_id, set()).add(key)
+            return job_id
+
+    def release_keys(self, job_id):
+        """Releases a job's dedupe keys. Done by the worker when the job ends, unless it detached."""
+        if self.broker:
+            self.store.release_keys(job_id)
+            return
+        with self._lock:
+            for key in self._job_keys.pop(job_id, ()):
+                if self._inflight.get(key) == job_id:
+                    del self._inflight[key]
+
+    def _job_from_record(self, record):
+        """Rebuilds a job dict from a job store record."""
+        job_func = _resolve_target(record['target'])
+        if isinstance(job_func, Pipeline):
+            steps = job_func.steps
+            ctx = record['ctx'] or dict(record['kwargs'], job_id=record['id'])
+        else:
+            steps = ((DEFAULT_STAGE, None),)
+            ctx = None
+        return {
+            'priority': (ctx or {}).get('priority', record.get('priority', PRIORITY_INTERACTIVE)),
+            'client': (ctx or {}).get('client', record.get('client')),
+            'id': record['id'],
+            'func': job_func,
+            'args': tuple(record['args']),
+            'kwargs': record['kwargs'],
+            'steps': steps,
+            'step': min(record['step'], len(steps) - 1),
+            'ctx': ctx,
+            'status': 'pending',
+            'timestamp': record['status'].get('timestamp', time.time()),
+            'queued_at': record.get('queued_at') or time.time(),
+            'include_job_id': record['include_job_id'],
+        }
+
+    def recover_jobs(self):
+        """
+        Re-queues jobs that were queued or running when the process last stopped.
+        Each job restarts at the step it had not finished yet. Call after every
+        Pipeline has been defined (i.e. once the app is set up).
+        """
+        if self.broker:
+            return 0  # Jobs of dead processes are reclaimed once their lease expires
+
+        recovered = 0
+        for record in self.store.load_unfinished():
+            job_id = record['id']
+            if job_id in self._statuses:
+                continue  # Already known to this process
+            try:
+                job = self._job_from_record(record)
+            except (KeyError, ImportError, AttributeError) as e:
+                logger.error(f"Cannot recover job {job_id} ({record['target']}): {e}")
+                self._update_status(job_id, **{**record['status'], 'state': 'failed', 'stage': 'failed',
+                                               'error': 'Interrupted by restart'})
+                continue
+
+            self._update_status(job_id, **{**record['status'], 'state': 'queued', 'message': 'Recovered after restart'})
+            for key in (job['ctx'] or {}).get('dedupe_keys', ()):
+                self.claim_key(key, job_id)
+            self.stages[job['steps'][job['step']][0]].queue.put(job)
+            recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted jobs")
+        return recovered
+
+    def _run_step(self, job):
+        _, step = job['steps'][job['step']]
+        resume = job.pop('resume', None)
+        if resume is not None:
+            resume_step, future = resume
+            resume_step(job['ctx'], future)
+        elif step is not None:
+            step(job['ctx'])
+        elif job.get('include_job_id'):
+            job['func'](*job['args'], job_id=job['id'], **job['kwargs'])
+        else:
+            job['func'](*job['args'], **job['kwargs'])
+
+    def set_gate(self, stage_name, gate):
+        """Holds back a stage's queued jobs while gate() returns False (e.g. low disk space)."""
+        self.stages[stage_name].gate = gate
+
+    def _next_job(self, stage):
+        """Takes the next job for a stage. Raises queue.Empty after about a second without one."""
+        if stage.gate is not None and not stage.gate():
+            time.sleep(1)
+            raise queue.Empty
+        if not self.broker:
+            job = stage.queue.get(timeout=1)
+            if job.pop('slot', False):
+                stage.slots.release()
+            return job
+
+        deadline = time.time() + 1
+        while True:
+            try:
+                return stage.resumed.get_nowait()  # Still leased by this process
+            except queue.Empty:
+                pass
+            record = self.store.claim(stage.name, self.worker_id, Config.QUEUE_LEASE_SECONDS,
+                                      aging=Config.PRIORITY_AGING)
+            if record:
+                break
+            if time.time() >= deadline:
+                raise queue.Empty
+            time.sleep(Config.QUEUE_POLL_INTERVAL)
+        try:
+            job = self._job_from_record(record)
+        except (KeyError, ImportError, AttributeError) as e:
+            logger.error(f"Cannot run job {record['id']} ({record['target']}): {e}")
+            self._update_status(record['id'], state='failed', stage='failed', error=f'Unknown job target: {e}')
+            self.store.finish(record['id'])
+            raise queue.Empty
+        with self._lock:
+            self._leased.add(job['id'])
+        return job
+
+    def _job_done(self, job, stage, keep_lease=False):
+        if not self.broker:
+            stage.queue.task_done()
+            return
+        if not keep_lease:
+            with self._lock:
+                self._leased.discard(job['id'])
+
+    def _end_job(self, job, detached=False):
+        """Bookkeeping once a job completed, failed or detached."""
+        jobs_finished.inc(state='detached' if detached else job['status'])
+        if not detached:
+            self.release_keys(job['id'])
+        if self.broker:
+            self.store.finish(job['id'])
+            with self._lock:
+                self._leased.discard(job['id'])
+        if not detached:
+            self._on_finish(job)
+
+    def _park(self, job, parked, stage):
+        """
+        Requeues a parked job on its stage when its Future is done, a worker there then runs
+        parked.resume in place of the parked step. Until then it holds no worker, but keeps
+        its broker lease (renewed by the heartbeat) or, locally, its saved step, so a restart
+        runs the parked step again.
+        """
+        def resume(future):
+            # Not run here: this is the thread that completed the Future (e.g. the beets batcher)
+            job['resume'] = (parked.resume, future)
+            if self.broker:
+                stage.resumed.put(job)
+            else:
+                stage.queue.put(job)
+
+        parked.future.add_done_callback(resume)
+
+    def _handoff(self, job, stage):
+        """Passes a job to the next stage, blocking while that stage's hand-off slots are full."""
+        if self.broker:
+            # The broker queue lives on disk, so hand-offs do not need to block
+            self.store.handoff(job['id'], stage.name, job['step'], job['ctx'])
+            return
+        while not stage.slots.acquire(timeout=1):
+            if not self.running:
+                return
+        job['slot'] = True
+        stage.queue.put(job)
+
+    def _worker(self, stage):
+        logger.info(f"Background worker for stage '{stage.name}' started.")
         while self.running:
             try:
                 # Wait for a job
-                job = self.queue.get(timeout=1)
-                
+                job = self._next_job(stage)
+                if 'resume' not in job:
+                    queue_wait_seconds.observe(max(0.0, time.time() - job['queued_at']), stage=stage.name)
+
                 # Update status
                 with self._lock:
+                    stage.busy += 1
+                    self._events += 1
                     self.current_job = job
                     self.current_jobs.add(job['id'])
+                    first_step = job['step'] == 0
                     job['status'] = 'processing'
-                logger.info(f"Processing job {job['id']}...")
-                self._update_status(job['id'], state='processing', stage='starting')
-                
+                if first_step:
+                    logger.info(f"Processing job {job['id']}...")
+                    self._update_status(job['id'], state='processing', stage='starting')
+
+                started = time.time()
+                finished = True
+                detached = False
+                parked = None
                 try:
-                    # Execute the job
-                    if job.get('include_job_id'):
-                        job['func'](*job['args'], job_id=job['id'], **job['kwargs'])
+                    # Execute this stage's steps of the job. Consecutive steps on the same stage
+                    # run here: handing off to our own stage would take one of its slots and wait
+                    # behind its queue, and with every worker doing that the stage deadlocks
+                    while True:
+                        self._run_step(job)
+                        job['step'] += 1
+                        if job['step'] >= len(job['steps']) or job['steps'][job['step']][0] != stage.name:
+                            break
+                        if not self.broker:
+                            self.store.save_progress(job['id'], job['step'], job['ctx'])
+                    if job['step'] < len(job['steps']):
+                        finished = False
+                        if not self.broker:
+                            self.store.save_progress(job['id'], job['step'], job['ctx'])
                     else:
-                        job['func'](*job['args'], **job['kwargs'])
+                        job['status'] = 'completed'
+                        self._update_status(job['id'], state='completed', stage='done')
+                        logger.info(f"Job {job['id']} completed.")
+                except JobFinished:
                     job['status'] = 'completed'
                     self._update_status(job['id'], state='completed', stage='done')
-                    logger.info(f"Job {job['id']} completed.")
+                    logger.info(f"Job {job['id']} completed early.")
+                except JobDetached:
+                    detached = True
+                    logger.info(f"Job {job['id']} detached, its work continues in other jobs.")
+                except JobParked as e:
+                    parked = e
                 except Exception as e:
                     job['status'] = 'failed'
                     job['error'] = str(e)
                     self._update_status(job['id'], state='failed', stage='failed', error=str(e))
                     logger.error(f"Job {job['id']} failed: {e}")
-                
-                # Clear current job (keep last status briefly? For now just None)
+
+                elapsed = time.time() - started
+                step_seconds.observe(elapsed, stage=stage.name)
                 with self._lock:
-                    self.current_jobs.discard(job['id'])
-                    self.current_job = None
-                self.queue.task_done()
-                
+                    stage.busy -= 1
+                    self._events += 1
+                    stage.record(elapsed)
+                    if finished:
+                        self.current_jobs.discard(job['id'])
+                        if self.current_job is job:
+                            self.current_job = None
+
+                if not finished:
+                    self._handoff(job, self.stages[job['steps'][job['step']][0]])
+                elif parked is not None:
+                    self._park(job, parked, stage)
+                else:
+                    self._end_job(job, detached)
+                self._job_done(job, stage, keep_lease=parked is not None)
+
             except queue.Empty:
                 continue
             except Exception as e:
                 logger.error(f"Worker error: {e}")
 
+    def _collect_metrics(self):
+        """Current worker pool gauges for /metrics (this process' workers only)."""
+        depths = self.store.depths() if self.broker else None
+        with self._lock:
+            stages = [(name, stage.workers, stage.busy, stage.busy_seconds,
+                       depths.get(name, 0) if depths is not None else stage.queue.qsize())
+                      for name, stage in self.stages.items()]
+        return [
+            ('music_query_stage_workers', 'gauge', 'Worker threads per stage',
+             [({'stage': name}, workers) for name, workers, _, _, _ in stages]),
+            ('music_query_stage_busy_workers', 'gauge', 'Workers running a step right now',
+             [({'stage': name}, busy) for name, _, busy, _, _ in stages]),
+            ('music_query_stage_busy_seconds_total', 'counter',
+             'Seconds workers spent running steps; rate() over workers is the utilization',
+             [({'stage': name}, round(busy_seconds, 3)) for name, _, _, busy_seconds, _ in stages]),
+            ('music_query_stage_queue_depth', 'gauge', 'Jobs waiting for a stage',
+             [({'stage': name}, depth) for name, _, _, _, depth in stages]),
+        ]
+
+    def _on_finish(self, job):
+        on_finish = getattr(job['func'], 'on_finish', None)
+        if not isinstance(job['func'], Pipeline) or on_finish is None:
+            return
+        try:
+            on_finish(job['ctx'], job['status'], job.get('error'))
+        except Exception as e:
+            logger.error(f"Finish callback of job {job['id']} failed: {e}")
+
     def get_status(self):
+        if self.broker:
+            return self._get_broker_status()
+
         status = {
-            'queue_size': self.queue.qsize(),
+            'queue_size': sum(stage.queue.qsize() for stage in self.stages.values()),
             'current_job': None
         }
-        
+
         with self._lock:
             current_ids = list(self.current_jobs)
-            current_statuses = []
-            for jid in current_ids:
-                entry = self._statuses.get(jid)
-                if entry:
-                    current_statuses.append({**entry, 'id': jid})
-            if current_statuses:
-                status['current_job'] = current_statuses[0]
-                status['current_jobs'] = current_statuses
-            
+            status['stages'] = {name: stage.status() for name, stage in self.stages.items()}
+        current_statuses = []
+        for jid in current_ids:
+            entry = self._statuses.get(jid)
+            if entry:
+                current_statuses.append({**entry, 'id': jid})
+        if current_statuses:
+            status['current_job'] = current_statuses[0]
+            status['current_jobs'] = current_statuses
+        status['statuses'] = self._statuses.stats()
+
+        queued = []
+        for stage in self.stages.values():
+            for position, job in enumerate(stage.queue.ordered(QUEUED_JOBS_LIMIT)):
+                queued.append(self._queued_entry(job['id'], stage, position, job.get('priority')))
+        status['queued_jobs'] = queued[:QUEUED_JOBS_LIMIT]
         return status
 
-    def _update_status(self, job_id, **kwargs):
+    def _queued_entry(self, job_id, stage, position, priority):
+        return {
+            'id': job_id,
+            'stage': stage.name,
+            'position': position + 1,
+            'priority': priority,
+            'estimated_wait': stage.estimated_wait(position),
+        }
+
+    def _get_broker_status(self):
+        """Queue status across every process sharing the broker."""
+        depths = self.store.depths()
+        status = {
+            'queue_size': sum(depths.values()),
+            'current_job': None,
+            'backend': 'sqlite',
+            'worker_id': self.worker_id,
+        }
+        current_statuses = [{**entry, 'id': jid} for jid, entry in self.store.leased_jobs()]
+        if current_statuses:
+            status['current_job'] = current_statuses[0]
+            status['current_jobs'] = current_statuses
         with self._lock:
-            entry = self._statuses.get(job_id, {})
-            entry.update(kwargs)
-            self._statuses[job_id] = entry
+            # busy/utilization/durations are for this process' workers only
+            status['stages'] = {name: {**stage.status(), 'depth': depths.get(name, 0)}
+                                for name, stage in self.stages.items()}
+        status['statuses'] = self._statuses.stats()
+        positions = {}
+        queued = []
+        for job_id, stage_name, priority in self.store.queued_jobs(Config.PRIORITY_AGING, QUEUED_JOBS_LIMIT):
+            position = positions.get(stage_name, 0)
+            positions[stage_name] = position + 1
+            queued.append(self._queued_entry(job_id, self.stages[stage_name], position, priority))
+        status['queued_jobs'] = queued
+        return status
+
+    def _update_status(self, job_id, **kwargs):
+        seed = None
+        if self.broker:
+            # Other processes may have moved the job on since we last saw it
+            seed = self.store.get_status(job_id)
+        snapshot = self._statuses.update(job_id, kwargs, seed=seed)
+        self.store.update_status(job_id, snapshot)
 
     def update_job_status(self, job_id, **kwargs):
         self._update_status(job_id, **kwargs)
 
+    def modify_job_status(self, job_id, fn):
+        """
+        Atomically merges fn(status) -> dict of changes into a job's status, for statuses
+        that several jobs write to (e.g. a playlist aggregating its tracks).
+        fn gets a shallow copy and must not mutate nested values in place.
+        :return: the new status
+        """
+        def apply(entry):
+            entry.update(fn(dict(entry)))
+            entry['version'] = entry.get('version', 0) + 1
+            return entry
+
+        if self.broker:
+            # Read-modify-write in one transaction, other processes may be changing it too
+            snapshot = self.store.modify_status(job_id, apply)
+            self._statuses.set(job_id, snapshot)
+            return snapshot
+
+        snapshot = self._statuses.modify(job_id, apply, load=lambda: self.store.get_status(job_id))
+        self.store.update_status(job_id, snapshot)
+        return snapshot
+
+    def _get_own_status(self, job_id):
+        if self.broker:
+            # Any process may be running the job, the store has everyone's updates
+            return self.store.get_status(job_id)
+        entry = self._statuses.get(job_id)
+        if entry is not None:
+            return entry
+        # Evicted from memory or finished before a restart
+        return self.store.get_status(job_id)
+
+    def _follow_duplicate(self, status):
+        """
+        A job coalesced into another one reports that job's status. Its version is the sum
+        of both, so it keeps increasing for clients polling with ?since=.
+        """
+        primary_id = status.get('duplicate_of') if status else None
+        primary = self._get_own_status(primary_id) if primary_id else None
+        if primary is None:
+            return status
+        return {**primary, 'duplicate_of': primary_id,
+                'version': status.get('version', 0) + primary.get('version', 0)}
+
     def get_job_status(self, job_id):
-        with self._lock:
-            return self._statuses.get(job_id)
+        return self._follow_duplicate(self._get_own_status(job_id))
+
+    def get_job_version(self, job_id):
+        """
+        The version get_job_status(job_id) would report, without copying the status when it
+        is in memory. None for unknown jobs.
+        """
+        own = None if self.broker else self._statuses.version_of(job_id)
+        if own is None:
+            status = self.get_job_status(job_id)
+            return status.get('version', 0) if status else None
+        version, primary_id = own
+        if primary_id:
+            primary = self._statuses.version_of(primary_id)
+            if primary is None:
+                return (self.get_job_status(job_id) or {}).get('version', version)
+            version += primary[0]
+        return version
+
+    @property
+    def version(self):
+        """
+        Grows whenever get_status() may change: a job status changed, or a worker took or
+        finished a step. With the broker, commits of other processes count too.
+        """
+        version = self._statuses.version + self._events
+        if self.broker:
+            version += self.store.data_version()
+        return version
+
+    def wait_for_status(self, job_id, version=0, timeout=15):
+        """
+        Blocks until the job's status version is newer than `version` or `timeout` passes.
+        :return: the latest status (unchanged after a timeout), or None for unknown jobs
+        """
+        own = self._get_own_status(job_id)
+        if own and own.get('duplicate_of'):
+            self._wait_for_own_status(own['duplicate_of'], version - own.get('version', 0), timeout)
+            return self.get_job_status(job_id)
+        return self._wait_for_own_status(job_id, version, timeout)
+
+    def _wait_for_own_status(self, job_id, version, timeout):
+        deadline = time.monotonic() + timeout
+        if self.broker:
+            # Updates may come from other processes, which cannot notify us
+            while True:
+                status = self._get_own_status(job_id)
+                if status is None or status.get('version', 0) > version or time.monotonic() >= deadline:
+                    return status
+                time.sleep(Config.QUEUE_POLL_INTERVAL)
+
+        status = self._statuses.wait(job_id, version, deadline - time.monotonic())
+        return status if status is not None else self.store.get_status(job_id)
 
     def shutdown(self, timeout=5):
         """Gracefully shut down all worker threads."""
@@ -162,7 +869,10 @@ class JobQueue:
         self.running = False
         for t in self.worker_threads:
             t.join(timeout)
+        self.store.close()
         logger.info("Job queue shut down complete.")
 
 # Global instance
 job_queue = JobQueue()
+# Flush buffered job store writes when the process exits
+atexit.register(job_queue.store.flush)
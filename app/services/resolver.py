@@ -0,0 +1,135 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ..config import Config
+from .cache import resolution_cache, canonicalize_url
+from .odesli import odesli_client, OdesliRateLimited
+
+logger = logging.getLogger(__name__)
+
+
+def _is_youtube(url):
+    return 'youtube.com' in url or 'youtu.be' in url or 'music.youtube.com' in url
+
+
+def lookup_url(url):
+    """
+    Resolves a music URL to a YouTube/YouTube Music URL using Odesli.
+    """
+    # If it's already a youtube/youtu.be link, return it
+    if _is_youtube(url):
+        return url
+    
+    found, cached = resolution_cache.get(url)
+    if found:
+        logger.info(f"Resolved URL from cache: {url}")
+        return cached or url
+
+    logger.info(f"Resolving URL: {url}")
+    # Use Odesli to resolve
+    try:
+        status_code, data = odesli_client.lookup(url)
+        if status_code == 200 and data:
+            links = data.get('linksByPlatform', {})
+            # Prefer YouTube Music, then YouTube
+            resolved = None
+            if 'youtubeMusic' in links:
+                resolved = links['youtubeMusic']['url']
+            elif 'youtube' in links:
+                resolved = links['youtube']['url']
+            resolution_cache.set(url, resolved)
+            if resolved:
+                return resolved
+        elif status_code == 404:
+            # Odesli does not know this link, remember the miss for a short while
+            resolution_cache.set(url, None)
+    except OdesliRateLimited:
+        # Falling back would hand yt-dlp a link it cannot download, fail the job instead
+        raise
+    except Exception as e:
+        logger.error(f"Error resolving URL: {e}")
+    
+    return url # Fallback to original URL
+
+
+class Resolver:
+    """
+    Resolves links in the background as soon as they are submitted, on a small thread
+    pool (the Odesli client's token bucket still paces the requests). By the time a
+    worker runs resolve_step the result is cached, or the step joins the lookup in flight.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._inflight = {}  # canonical url -> Future
+        self._lock = threading.Lock()
+        self.prefetched = 0
+        self.joined = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='resolver')
+        return self._executor
+
+    def prefetch(self, url):
+        """Starts resolving url in the background, unless it needs no lookup or one is running."""
+        if _is_youtube(url):
+            return None
+        key = canonicalize_url(url)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._get_executor().submit(lookup_url, url)
+            self._inflight[key] = future
+            self.prefetched += 1
+        # Outside the lock: the callback runs right away if the lookup already finished
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def resolve(self, url):
+        """Like lookup_url, but waits for a lookup of the same link already in flight instead of repeating it."""
+        with self._lock:
+            future = self._inflight.get(canonicalize_url(url)) if not _is_youtube(url) else None
+            if future is not None:
+                self.joined += 1
+        if future is not None:
+            return future.result()
+        return lookup_url(url)
+
+    def resolve_all(self, urls):
+        """Resolves many links concurrently. Returns {url: resolved url or exception}."""
+        futures = {url: self.prefetch(url) for url in urls}
+        results = {}
+        for url, future in futures.items():
+            try:
+                results[url] = future.result() if future is not None else url
+            except Exception as e:
+                results[url] = e
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'in_flight': len(self._inflight),
+                'prefetched': self.prefetched,
+                'joined': self.joined,
+            }
+
+
+# Global instance
+resolver = Resolver(Config.RESOLVE_CONCURRENCY)
+
+
+def resolve_url(url):
+    """
+    Resolves a music URL to a YouTube/YouTube Music URL, joining a prefetch of it if one is running.
+    """
+    return resolver.resolve(url)
@@ -0,0 +1,57 @@
+import threading
+import uuid
+from collections import OrderedDict
+from ..config import Config
+
+
+class ResponseCache:
+    """
+    Serialized response bodies by resource (e.g. 'job-<id>'), each kept with the version it
+    was built for. Polling an unchanged job or queue then reuses the bytes instead of
+    building and dumping the payload again. Least recently used entries go first.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max(1, max_entries)
+        # Tells this process' versions apart from those of other processes or earlier runs
+        self.epoch = uuid.uuid4().hex[:12]
+        self._entries = OrderedDict()  # key -> (version, body)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key, version):
+        """The body cached for key at this version, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, body):
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+            }
+
+
+# Global instance
+response_cache = ResponseCache(Config.RESPONSE_CACHE_SIZE)
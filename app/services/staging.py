@@ -0,0 +1,56 @@
+import os
+import re
+import shutil
+import time
+import logging
+from ..config import Config
+from .files import staging_index
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def sweep_staging(store):
+    """
+    Startup janitor for STAGING_DIR/<job_id> directories left by interrupted jobs.
+    Directories of unfinished jobs (and the ones their retries reuse) are kept, the job
+    resumes there once recovered or its lease expires. Directories of finished, failed or
+    purged jobs are deleted. Anything not named after a job is left alone.
+    :return: (kept, removed) directory counts
+    """
+    root = Config.STAGING_DIR
+    try:
+        names = [name for name in os.listdir(root) if JOB_DIR_RE.match(name)]
+    except FileNotFoundError:
+        return 0, 0
+    if not names:
+        return 0, 0
+
+    # With the shared queue other processes may be starting jobs right now
+    min_age = 2 * Config.QUEUE_LEASE_SECONDS if Config.QUEUE_BACKEND == 'sqlite' else 0
+    resumable = set()
+    for record in store.load_unfinished():
+        # A job's own directory, the one it took over, and those of playlist tracks waiting for a retry
+        staging_dirs = [(record['ctx'] or {}).get('staging_dir')]
+        staging_dirs.extend(track.get('staging_dir') for track in record['status'].get('tracks') or ())
+        resumable.add(record['id'])
+        resumable.update(os.path.basename(os.path.normpath(path)) for path in staging_dirs if path)
+
+    kept = removed = 0
+    now = time.time()
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            age = now - os.path.getmtime(path)
+        except OSError:
+            continue
+        if name in resumable or age < min_age or not os.path.isdir(path):
+            kept += 1
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        staging_index.refresh(path)
+        removed += 1
+    if kept or removed:
+        logger.info(f"Staging janitor: kept {kept} directories of unfinished jobs, removed {removed} orphaned")
+    return kept, removed
@@ -0,0 +1,208 @@
+import collections
+import threading
+import time
+import zlib
+from .jobstore import FINISHED_STATES
+
+_MISSING = object()
+
+
+class JobStatus:
+    """
+    One job's status. The fields every job has live in slots, anything else (progress,
+    playlist tracks, duplicate_of, ...) in `extra`. Records are never changed once stored,
+    updates store a new one, so readers need no lock.
+    """
+    FIELDS = ('state', 'stage', 'message', 'error', 'timestamp', 'version')
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, fields=None):
+        for name in self.FIELDS:
+            setattr(self, name, _MISSING)
+        self.extra = None
+        if fields:
+            self._merge(fields)
+
+    def _merge(self, fields):
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def merged(self, fields):
+        """A new record with fields applied on top of this one."""
+        record = JobStatus.__new__(JobStatus)
+        for name in self.FIELDS:
+            setattr(record, name, getattr(self, name))
+        record.extra = dict(self.extra) if self.extra else None
+        record._merge(fields)
+        return record
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def to_dict(self):
+        status = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not _MISSING}
+        if self.extra:
+            status.update(self.extra)
+        return status
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+
+class _Shard:
+    __slots__ = ('lock', 'changed', 'records', 'finished', 'version')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Writes to this shard so far, StatusStore.version adds them up
+        self.version = 0
+        # Notified when a record of this shard changes, for long-polling readers
+        self.changed = threading.Condition(self.lock)
+        self.records = {}
+        # Finished job ids, oldest first: expiry and the size cap pop from the front
+        self.finished = collections.OrderedDict()
+
+
+class StatusStore:
+    """
+    In-memory job statuses, sharded by job id so updates and long-polls on different
+    jobs do not share a lock. Lookups read without locking. Finished jobs are dropped
+    after `max_age` seconds, or earliest first when more than `max_entries` statuses
+    are held. Unfinished jobs are never dropped, the job queue still needs them.
+    """
+
+    def __init__(self, shards=16, max_entries=10000, max_age=3600):
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self.max_age = max_age
+        self.shard_limit = max(1, -(-max_entries // len(self._shards)))  # ceil
+        self.evicted = 0
+
+    def _shard(self, job_id):
+        return self._shards[zlib.crc32(job_id.encode()) % len(self._shards)]
+
+    def __contains__(self, job_id):
+        return job_id in self._shard(job_id).records
+
+    def __len__(self):
+        return sum(len(shard.records) for shard in self._shards)
+
+    def get(self, job_id):
+        """A copy of the job's status, or None."""
+        record = self._shard(job_id).records.get(job_id)
+        return record.to_dict() if record is not None else None
+
+    @property
+    def version(self):
+        """Increases with every change to any status. Each shard's count only grows, so their sum does too."""
+        return sum(shard.version for shard in self._shards)
+
+    def version_of(self, job_id):
+        """(version, duplicate_of) of a job without copying its status, or None."""
+        record = self._shard(job_id).records.get(job_id)
+        return (record.get('version', 0), record.get('duplicate_of')) if record is not None else None
+
+    def state(self, job_id):
+        record = self._shard(job_id).records.get(job_id)
+        return record.state if record is not None and record.state is not _MISSING else None
+
+    def _store(self, shard, job_id, record):
+        """Stores a record and tracks its finish. Caller holds shard.lock."""
+        shard.records[job_id] = record
+        if record.finished:
+            if job_id not in shard.finished:
+                shard.finished[job_id] = time.monotonic()
+                # The job that just finished stays, its client has yet to see the result
+                while len(shard.records) > self.shard_limit and len(shard.finished) > 1:
+                    oldest, _ = shard.finished.popitem(last=False)
+                    del shard.records[oldest]
+                    self.evicted += 1
+        else:
+            shard.finished.pop(job_id, None)  # Re-queued, e.g. recovered after a restart
+        shard.version += 1
+        shard.changed.notify_all()
+
+    def set(self, job_id, status):
+        """Replaces a job's status."""
+        shard = self._shard(job_id)
+        with shard.lock:
+            self._store(shard, job_id, JobStatus(status))
+
+    def update(self, job_id, changes, seed=None):
+        """
+        Merges changes into the job's status (or into seed, if given or the job is unknown)
+        and bumps its version.
+        :return: a copy of the new status
+        """
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = JobStatus(seed) if seed is not None else shard.records.get(job_id) or JobStatus()
+            record = record.merged(changes)
+            record.version = record.get('version', 0) + 1
+            self._store(shard, job_id, record)
+        return record.to_dict()
+
+    def modify(self, job_id, fn, load=None):
+        """
+        Atomically replaces the job's status with fn(copy of it), called with the shard lock held.
+        load() supplies the status of a job not in memory.
+        :return: a copy of the new status
+        """
+        shard = self._shard(job_id)
+        with shard.lock:
+            record = shard.records.get(job_id)
+            current = record.to_dict() if record is not None else ((load() if load else None) or {})
+            record = JobStatus(fn(current))
+            self._store(shard, job_id, record)
+        return record.to_dict()
+
+    def wait(self, job_id, version, timeout):
+        """
+        Blocks until the job's version is newer than `version` or `timeout` passes.
+        :return: a copy of the status, or None if the job is not in memory
+        """
+        shard = self._shard(job_id)
+        deadline = time.monotonic() + timeout
+        with shard.changed:
+            while True:
+                record = shard.records.get(job_id)
+                if record is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if record.get('version', 0) > version or remaining <= 0:
+                    return record.to_dict()
+                shard.changed.wait(remaining)
+
+    def expire(self, max_age=None):
+        """Drops jobs finished more than max_age seconds ago. Only looks at expired entries."""
+        max_age = self.max_age if max_age is None else max_age
+        cutoff = time.monotonic() - max_age
+        expired = 0
+        for shard in self._shards:
+            with shard.lock:
+                while shard.finished:
+                    job_id, finished_at = next(iter(shard.finished.items()))
+                    if finished_at > cutoff:
+                        break
+                    del shard.finished[job_id]
+                    del shard.records[job_id]
+                    shard.version += 1
+                    expired += 1
+        return expired
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'finished': sum(len(shard.finished) for shard in self._shards),
+            'shards': len(self._shards),
+            'max_entries': self.shard_limit * len(self._shards),
+            'evicted': self.evicted,
+        }
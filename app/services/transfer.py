@@ -0,0 +1,221 @@
+import os
+import errno
+import shutil
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK = 16 * 1024 * 1024
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform/filesystem
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _candidates(dest):
+    """dest, then 'name (1).ext', 'name (2).ext', ..."""
+    yield dest
+    base, ext = os.path.splitext(dest)
+    i = 1
+    while True:
+        yield f"{base} ({i}){ext}"
+        i += 1
+
+
+def _link_no_clobber(src, dest):
+    """
+    Gives src the first free name among dest's candidates without ever replacing a file.
+    A hard link fails with EEXIST instead of overwriting, unlike os.rename.
+    :return: the final path
+    """
+    for candidate in _candidates(dest):
+        try:
+            os.link(src, candidate)
+        except FileExistsError:
+            continue
+        os.unlink(src)
+        return candidate
+
+
+def _rename_no_clobber(src, dest):
+    """Same-filesystem move. Uses rename for filesystems without hard links, checking the name first."""
+    try:
+        return _link_no_clobber(src, dest)
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK):
+            raise
+    for candidate in _candidates(dest):
+        if not os.path.lexists(candidate):
+            os.rename(src, candidate)
+            return candidate
+
+
+def _copy_data(src_fd, dest_fd, size):
+    """Kernel-side copy: copy_file_range (reflinks on CoW filesystems), then sendfile, then read/write."""
+    offset = 0
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    while offset < size:
+        count = min(COPY_CHUNK, size - offset)
+        try:
+            if copy_file_range:
+                copied = copy_file_range(src_fd, dest_fd, count, offset, offset)
+            elif sendfile:
+                os.lseek(dest_fd, offset, os.SEEK_SET)  # sendfile writes at the file position
+                copied = sendfile(dest_fd, src_fd, offset, count)
+            else:
+                os.lseek(src_fd, offset, os.SEEK_SET)
+                os.lseek(dest_fd, offset, os.SEEK_SET)
+                copied = os.write(dest_fd, os.read(src_fd, count))
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP) and copy_file_range:
+                copy_file_range = None  # Older kernels cannot copy across filesystems, fall back
+                continue
+            if e.errno in (errno.ENOSYS, errno.EINVAL) and sendfile:
+                sendfile = None
+                continue
+            raise
+        if copied == 0:
+            break  # Source shrank while copying
+        offset += copied
+    return offset
+
+
+def _copy_atomic(src, dest, fsync=True):
+    """
+    Cross-filesystem move: copies into a hidden temp file next to dest, fsyncs it and
+    links it into place, so the library never shows a partial file.
+    :return: the final path
+    """
+    directory = os.path.dirname(dest)
+    temp = os.path.join(directory, f".{os.path.basename(dest)}.{uuid.uuid4().hex[:8]}.part")
+    size = os.path.getsize(src)
+    with open(src, 'rb') as src_file, open(temp, 'xb') as temp_file:
+        try:
+            _copy_data(src_file.fileno(), temp_file.fileno(), size)
+            shutil.copystat(src, temp)
+            if fsync:
+                os.fsync(temp_file.fileno())
+        except BaseException:
+            os.unlink(temp)
+            raise
+    try:
+        final = _rename_no_clobber(temp, dest)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    if fsync:
+        _fsync_dir(directory)
+    os.unlink(src)
+    return final
+
+
+class TransferEngine:
+    """
+    Moves finished downloads from staging into the library.
+    Same filesystem: a rename. Across filesystems (e.g. SSD staging, HDD library):
+    kernel-side copies into temp files, renamed into place, several files at once.
+    Never overwrites: a taken name becomes 'name (1).ext'.
+    """
+
+    def __init__(self, workers=2, fsync=True):
+        self.workers = max(1, workers)
+        self.fsync = fsync
+        self._executor = None
+        self._lock = threading.Lock()
+        self.files_total = 0
+        self.bytes_total = 0
+        self.copied_total = 0
+        # Throughput only means something for copies, renames take no time
+        self.copied_bytes_total = 0
+        self.copy_seconds_total = 0.0
+        self.last_bytes_per_second = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transfer')
+            return self._executor
+
+    def move_file(self, src, dest):
+        """
+        Moves one file, creating dest's directory.
+        :return: (final path, size, copied) where copied is False for a rename
+        """
+        directory = os.path.dirname(dest)
+        os.makedirs(directory, exist_ok=True)
+        size = os.path.getsize(src)
+        if os.stat(src).st_dev == os.stat(directory).st_dev:
+            return _rename_no_clobber(src, dest), size, False
+        return _copy_atomic(src, dest, fsync=self.fsync), size, True
+
+    def move_tree(self, src_root, dest_root):
+        """
+        Moves every file under src_root to the same relative path under dest_root.
+        Empty directories are left behind for the caller to remove.
+        :return: dict with the final paths, file/byte counts, seconds and bytes_per_second
+        """
+        pairs = []
+        for root, dirs, files in os.walk(src_root):
+            for name in files:
+                src = os.path.join(root, name)
+                pairs.append((src, os.path.join(dest_root, os.path.relpath(src, src_root))))
+
+        started = time.monotonic()
+        executor = self._get_executor()
+        futures = [executor.submit(self.move_file, src, dest) for src, dest in pairs]
+        results = [future.result() for future in futures]
+        seconds = time.monotonic() - started
+
+        size = sum(r[1] for r in results)
+        copied = sum(1 for r in results if r[2])
+        rate = size / seconds if seconds > 0 else None
+        with self._lock:
+            self.files_total += len(results)
+            self.bytes_total += size
+            self.copied_total += copied
+            if copied:
+                self.copied_bytes_total += sum(r[1] for r in results if r[2])
+                self.copy_seconds_total += seconds
+                self.last_bytes_per_second = rate
+        renamed = [(src, r[0]) for (src, dest), r in zip(pairs, results) if r[0] != dest]
+        for src, final in renamed:
+            logger.info(f"Name taken in library, saved {src} as {final}")
+        return {
+            'paths': [r[0] for r in results],
+            'files': len(results),
+            'copied': copied,
+            'bytes': size,
+            'seconds': round(seconds, 3),
+            'bytes_per_second': round(rate) if rate else None,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'files': self.files_total,
+                'copied': self.copied_total,
+                'bytes': self.bytes_total,
+                'avg_copy_bytes_per_second': (round(self.copied_bytes_total / self.copy_seconds_total)
+                                              if self.copy_seconds_total else None),
+                'last_copy_bytes_per_second': round(self.last_bytes_per_second) if self.last_bytes_per_second else None,
+            }
+
+
+# Global instance
+transfer_engine = TransferEngine(Config.TRANSFER_WORKERS, fsync=Config.TRANSFER_FSYNC)
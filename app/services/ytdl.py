@@ -0,0 +1,123 @@
+import json
+import threading
+import logging
+from contextlib import contextmanager
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+# Options that change from job to job and are applied to a warm instance before each use
+PER_JOB_OPTIONS = ('outtmpl', 'download_archive')
+
+
+def _base_key(opts):
+    return json.dumps({k: v for k, v in opts.items() if k not in PER_JOB_OPTIONS}, sort_keys=True, default=repr)
+
+
+class _WarmInstance:
+    """A YoutubeDL whose hooks forward to whichever job is using it."""
+
+    def __init__(self, opts):
+        import yt_dlp
+        self.ydl = yt_dlp.YoutubeDL({k: v for k, v in opts.items() if k not in PER_JOB_OPTIONS})
+        self.uses = 0
+        self.progress_hook = None
+        self.postprocessor_hook = None
+        self.ydl.add_progress_hook(lambda d: self.progress_hook and self.progress_hook(d))
+        self.ydl.add_postprocessor_hook(lambda d: self.postprocessor_hook and self.postprocessor_hook(d))
+
+    def prepare(self, opts, progress_hook, postprocessor_hook):
+        ydl = self.ydl
+        outtmpl = opts.get('outtmpl')
+        ydl.params['outtmpl'] = dict(outtmpl) if isinstance(outtmpl, dict) else ({'default': outtmpl} if outtmpl else {})
+        ydl._parse_outtmpl()  # Fills in the default templates, as YoutubeDL.__init__ does
+        archive = opts.get('download_archive')
+        ydl.params['download_archive'] = archive
+        ydl.archive = archive if archive is not None else set()
+        ydl._download_retcode = 0
+        self.progress_hook = progress_hook
+        self.postprocessor_hook = postprocessor_hook
+
+    def release(self):
+        self.progress_hook = self.postprocessor_hook = None
+        self.uses += 1
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.warning(f"Closing YoutubeDL failed: {e}")
+
+
+class YoutubeDLPool:
+    """
+    Long-lived YoutubeDL instances, one per worker thread and option set, so jobs skip
+    loading extractors, cookies and HTTP sessions (keep-alive connections stay open).
+    The per-job options (output template, download archive) are set on each lease.
+    An instance is replaced after `max_uses` jobs or a job that reported an error.
+    max_uses=0 builds a new instance for every job.
+    yt-dlp itself is imported by the first lease, not when the app starts.
+    """
+
+    def __init__(self, max_uses=50):
+        self.max_uses = max_uses
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.recycled = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @contextmanager
+    def lease(self, opts, progress_hook=None, postprocessor_hook=None):
+        """Yields a YoutubeDL configured with opts for the duration of one job."""
+        if not self.max_uses:
+            import yt_dlp
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                if progress_hook:
+                    ydl.add_progress_hook(progress_hook)
+                if postprocessor_hook:
+                    ydl.add_postprocessor_hook(postprocessor_hook)
+                self._count('created')
+                yield ydl
+            return
+
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+        key = _base_key(opts)
+        warm = instances.pop(key, None)
+        if warm is None:
+            warm = _WarmInstance(opts)
+            self._count('created')
+        else:
+            self._count('reused')
+        warm.prepare(opts, progress_hook, postprocessor_hook)
+
+        healthy = False
+        try:
+            yield warm.ydl
+            healthy = warm.ydl._download_retcode == 0
+        finally:
+            warm.release()
+            if healthy and warm.uses < self.max_uses:
+                instances[key] = warm
+            else:
+                warm.close()
+                self._count('recycled')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_uses': self.max_uses,
+                'created': self.created,
+                'reused': self.reused,
+                'recycled': self.recycled,
+            }
+
+
+# Global instance; each worker thread (and post-processing process) keeps its own instances
+ytdl_pool = YoutubeDLPool(Config.YTDL_MAX_REUSE)
@@ -1,3 +1,7 @@
+from functools import lru_cache
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header
+
 TRANSLATIONS = {
     'en': {
         'title': 'Music Downloader',
@@ -7,8 +11,12 @@ TRANSLATIONS = {
         'resolving_url': 'Resolving URL...',
         'error_no_url': 'No URL provided',
         'error_invalid_url': 'Invalid URL format',
+        'error_no_query': 'No search query provided',
         'error_not_found': 'Not found',
         'download_queued': 'Download queued',
+        'error_too_many_urls': 'Too many URLs',
+        'error_invalid_job_ids': 'Give between 1 and 50 job IDs',
+        'error_too_many_streams': 'Too many open event streams, poll /job/<id> instead',
         'error_generic': 'An error occurred.',
         'meta_description': 'Download music from YouTube, Spotify, Apple Music and more.',
     },
@@ -20,10 +28,27 @@ TRANSLATIONS = {
         'resolving_url': 'Processando URL...',
         'error_no_url': 'Nenhuma URL fornecida',
         'error_invalid_url': 'Formato de URL inválido',
+        'error_no_query': 'Nenhum termo de busca fornecido',
         'error_not_found': 'Não encontrado',
         'download_queued': 'Download na fila',
+        'error_too_many_urls': 'URLs demais',
+        'error_invalid_job_ids': 'Informe entre 1 e 50 IDs de tarefa',
+        'error_too_many_streams': 'Streams de eventos demais abertos, consulte /job/<id>',
         'error_generic': 'Ocorreu um erro.',
         'meta_description': 'Baixe música do YouTube, Spotify, Apple Music e mais.',
     }
 }
 TRANSLATIONS['pt-br'] = TRANSLATIONS['pt']
+
+
+def get_locale(cookie_lang=None, accept_language=None):
+    """The UI language: the 'lang' cookie if it names one, else the best match for Accept-Language, else 'en'."""
+    if cookie_lang in TRANSLATIONS:
+        return cookie_lang
+    return _locale_for_header(accept_language or '')
+
+
+@lru_cache(maxsize=256)
+def _locale_for_header(accept_language):
+    # Clients send few distinct headers, each is parsed and matched once
+    return parse_accept_header(accept_language, LanguageAccept).best_match(TRANSLATIONS.keys()) or 'en'
@@ -0,0 +1,76 @@
+"""
+Job store throughput: enqueue and status-update rates with thousands of jobs.
+
+    python benchmarks/bench_job_store.py --jobs 5000 --updates 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.jobstore import MemoryJobStore, SQLiteJobStore  # noqa: E402
+
+
+def run(store, jobs, updates):
+    ids = [str(uuid.uuid4()) for _ in range(jobs)]
+    ctx = {'url': 'https://open.spotify.com/track/example'}
+
+    start = time.perf_counter()
+    for job_id in ids:
+        store.save_job(job_id, 'pipeline:download', [], ctx, False, ctx,
+                       {'state': 'queued', 'stage': 'queued', 'timestamp': time.time()})
+    store.flush()
+    enqueue_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(updates):
+        for job_id in ids:
+            store.update_status(job_id, {'state': 'processing', 'stage': 'downloading', 'message': f'Update {i}'})
+        store.save_progress(ids[i % jobs], i, ctx)
+    store.flush()
+    update_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for job_id in ids[:1000]:
+        store.get_status(job_id)
+    lookup_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    unfinished = len(store.load_unfinished())
+    recover_s = time.perf_counter() - start
+
+    return {
+        'enqueue/s': jobs / enqueue_s,
+        'updates/s': jobs * updates / update_s,
+        'lookups/s': min(jobs, 1000) / lookup_s,
+        'recover_ms': recover_s * 1000,
+        'unfinished': unfinished,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--updates', type=int, default=10, help='Status updates per job')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            'memory': MemoryJobStore(),
+            'sqlite': SQLiteJobStore(os.path.join(tmp, 'jobs.sqlite3'), flush_interval=0.5),
+        }
+        for name, store in stores.items():
+            store.start()
+            result = run(store, args.jobs, args.updates)
+            store.close()
+            print(f"{name:>7}: " + '  '.join(
+                f"{key}={value:,.0f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Library search index: /search latency over a large synthetic index, and full versus
+incremental rescans of real tagged files.
+
+The search part inserts --tracks rows straight into the index (no files) and times
+random one- and two-word queries. The rescan part writes --files small tagged MP3s,
+indexes them from scratch, rescans with nothing changed, then after retagging 1%.
+
+    python benchmarks/bench_library.py --tracks 100000 --files 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.library import LibraryIndex  # noqa: E402
+
+COMMON = ('love night blue river fire dream heart city light rain shadow gold summer ghost wild '
+          'electric silver ocean moon stone velvet neon echo paper glass storm honey desert').split()
+SYLLABLES = 'ka lo mi ra ne to su vi an el or un ba de fi go ha ju ke li mo nu pa ri se ta vo ze'.split()
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz), enough for mutagen to read a length
+MP3_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+
+def vocabulary(rng, size):
+    """A few very common words plus `size` rarer made-up ones, like real tags."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return COMMON + sorted(words)
+
+
+def _name(rng, words, vocab):
+    # Half the words come from the short list of common ones
+    return ' '.join(rng.choice(COMMON if rng.random() < 0.5 else vocab).capitalize() for _ in range(words))
+
+
+def synthetic_rows(count, rng, vocab):
+    artists = [_name(rng, 2, vocab) for _ in range(max(1, count // 100))]
+    for i in range(count):
+        artist = rng.choice(artists)
+        album = _name(rng, 2, vocab)
+        yield {'path': f'{artist}/{album}/{i:06d}.m4a', 'mtime': 0.0, 'size': 0, 'artist': artist,
+               'album': album, 'title': _name(rng, 3, vocab), 'duration': rng.uniform(120, 360), 'format': 'm4a'}
+
+
+def write_mp3(path, artist, album, title):
+    from mutagen.easyid3 import EasyID3
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(MP3_FRAME * 40)
+    tags = EasyID3()
+    tags.update({'artist': artist, 'album': album, 'title': title})
+    tags.save(path)
+
+
+def bench_search(tmp, tracks, queries, rng, vocab):
+    index = LibraryIndex(os.path.join(tmp, 'empty'), os.path.join(tmp, 'search.sqlite3'))
+    started = time.perf_counter()
+    batch = []
+    for row in synthetic_rows(tracks, rng, vocab):
+        batch.append(row)
+        if len(batch) >= 5000:
+            index._store(batch)
+            batch = []
+    if batch:
+        index._store(batch)
+    print(f"Indexed {tracks} synthetic tracks in {time.perf_counter() - started:.1f}s "
+          f"({os.path.getsize(index.path) / 1e6:.1f} MB)")
+
+    index._started = True  # Only the search, no background rescans of the empty root
+    # Typical searches name a rarer word or two, the worst case is a word in a quarter of all tags
+    for label, words in (('typical', vocab[len(COMMON):]), ('common word', COMMON)):
+        seconds, hits = [], []
+        for _ in range(queries):
+            query = ' '.join(rng.choice(words)[:rng.randint(3, 6)] for _ in range(rng.randint(1, 2)))
+            start = time.perf_counter()
+            results = index.search(query, limit=50)
+            seconds.append(time.perf_counter() - start)
+            hits.append(len(results))
+        seconds.sort()
+        print(f"Search over {tracks} tracks, {label:>11} queries ({statistics.mean(hits):.0f} results on average): "
+              f"p50 {seconds[len(seconds) // 2] * 1000:.2f}ms  p99 {seconds[int(0.99 * (len(seconds) - 1))] * 1000:.2f}ms  "
+              f"max {seconds[-1] * 1000:.2f}ms")
+
+
+def bench_rescan(tmp, files, workers, rng, vocab):
+    root = os.path.join(tmp, 'library')
+    paths = []
+    for i in range(files):
+        artist, album = _name(rng, 2, vocab), _name(rng, 1, vocab)
+        path = os.path.join(root, artist, album, f'{i:05d}.mp3')
+        write_mp3(path, artist, album, _name(rng, 3, vocab))
+        paths.append(path)
+
+    index = LibraryIndex(root, os.path.join(tmp, 'rescan.sqlite3'), workers=workers)
+    for label, prepare in (('full', None), ('unchanged', None), ('1% changed', 'retag')):
+        if prepare:
+            for path in rng.sample(paths, max(1, files // 100)):
+                write_mp3(path, 'Retagged', 'Album', _name(rng, 3, vocab))
+        start = time.perf_counter()
+        read, removed = index.rescan()
+        print(f"Rescan of {files} files, {label:>10}: {time.perf_counter() - start:6.2f}s, read {read} files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=100000, help='Synthetic index size for the search part')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--files', type=int, default=2000, help='Tagged files for the rescan part')
+    parser.add_argument('--workers', type=int, default=4, help='LIBRARY_INDEX_WORKERS for the rescans')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    vocab = vocabulary(rng, 5000)
+    with tempfile.TemporaryDirectory(prefix='bench-library-') as tmp:
+        bench_search(tmp, args.tracks, args.queries, rng, vocab)
+        bench_rescan(tmp, args.files, args.workers, rng, vocab)
+
+
+if __name__ == '__main__':
+    main()
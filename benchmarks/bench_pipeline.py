@@ -0,0 +1,393 @@
+"""
+End-to-end throughput of the download pipeline against local stand-ins: a fake Odesli
+API, an audio host with synthetic tracks, a stub yt-dlp extractor and optionally a fake
+`beet`. For every MAX_CONCURRENT_DOWNLOADS setting and library size the app is started
+in a fresh process and loaded through HTTP at fixed rates:
+
+    /download      --rate jobs per second, --jobs in total
+    /job/<id>      --poll-rate plain polls of random unfinished jobs
+    /status        --status-rate
+    /files         --files-rate
+
+Reports jobs/s, end-to-end and per-stage p50/p99 latency, queue wait, the app process'
+peak memory and HTTP latency per endpoint. Stage and wait percentiles are estimated
+from the app's /metrics histograms. Post-processing needs FFmpeg, like the app.
+
+    python benchmarks/bench_pipeline.py --jobs 40 --rate 4 --downloads 1,2,4 --library 0,20000
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STANDINS = os.path.join(HERE, 'standins')
+sys.path.insert(0, STANDINS)
+
+from fake_services import FakeServices, write_tone  # noqa: E402
+
+STAGES = ('resolving_url', 'downloading', 'postprocessing', 'beets_import', 'moving_files')
+FINISHED = ('completed', 'failed')
+SAMPLE_RE = re.compile(r'^(?P<name>[a-z_]+)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_histograms(text, name):
+    """{labels tuple (without le): [(upper bound, cumulative count), ...]} of one histogram."""
+    series = defaultdict(list)
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if not match or match.group('name') != f"{name}_bucket":
+            continue
+        labels = dict(LABEL_RE.findall(match.group('labels') or ''))
+        bound = float(labels.pop('le'))
+        series[tuple(sorted(labels.items()))].append((bound, float(match.group('value'))))
+    return {key: sorted(buckets) for key, buckets in series.items()}
+
+
+def merge_buckets(series):
+    merged = defaultdict(float)
+    for buckets in series:
+        for bound, count in buckets:
+            merged[bound] += count
+    return sorted(merged.items())
+
+
+def histogram_quantile(buckets, q):
+    """Like PromQL's histogram_quantile: linear interpolation inside the bucket holding the rank."""
+    if not buckets or not buckets[-1][1]:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower
+            return lower + (bound - lower) * ((rank - below) / (count - below) if count > below else 1.0)
+        lower, below = bound, count
+    return lower
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid):
+    """Peak resident memory of a process (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def populate_library(download_dir, archive_path, size):
+    """`size` small files in the library and as many ids in the download archive."""
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    with open(archive_path, 'w') as archive:
+        for i in range(size):
+            directory = os.path.join(download_dir, f"Artist {i // 1000}", f"Album {i // 100}")
+            if i % 100 == 0:
+                os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{i % 100:02d} - Track {i}.mp3"), 'wb') as track:
+                track.write(b'\0' * 1024)
+            archive.write(f"stub library{i:07d}\n")
+
+
+class Rate:
+    """Calls fn on the executor `rate` times per second until stopped (open loop)."""
+
+    def __init__(self, rate, fn, executor, stop):
+        self.thread = threading.Thread(target=self._loop, args=(rate, fn, executor, stop), daemon=True)
+
+    @staticmethod
+    def _loop(rate, fn, executor, stop):
+        if rate <= 0:
+            return
+        interval = 1.0 / rate
+        next_at = time.monotonic()
+        while not stop.is_set():
+            executor.submit(fn)
+            next_at += interval
+            stop.wait(max(0.0, next_at - time.monotonic()))
+
+
+class LoadRun:
+    def __init__(self, base_url, args):
+        self.base_url = base_url
+        self.args = args
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.http = defaultdict(list)  # endpoint -> request seconds
+        self.errors = defaultdict(int)
+        self.submitted = {}  # job_id -> submit time
+        self.finished = {}   # job_id -> (state, latency)
+        self.pending = []
+        self.all_done = threading.Event()
+        # Set when the run ends, finished or timed out: trackers stop polling jobs that never finish
+        self.stop = threading.Event()
+        self.token = f"{random.getrandbits(32):08x}"
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session().request(method, self.base_url + path, timeout=90, **kwargs)
+        except requests.RequestException:
+            with self.lock:
+                self.errors[endpoint] += 1
+            return None
+        if endpoint:
+            with self.lock:
+                self.http[endpoint].append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    self.errors[endpoint] += 1
+        return response
+
+    def submit(self, number, trackers):
+        url = f"https://open.spotify.com/track/bench{self.token}{number:06d}"
+        submitted = time.monotonic()
+        response = self.request('/download', 'POST', '/download', data={'url': url})
+        if response is None or response.status_code != 200:
+            self._finish(None, 'failed', 0.0)
+            return
+        job_id = response.json()['job_id']
+        with self.lock:
+            self.submitted[job_id] = submitted
+            self.pending.append(job_id)
+        trackers.submit(self.track, job_id, submitted)
+
+    def track(self, job_id, submitted):
+        """Long-polls the job like the web UI, to time its completion."""
+        version = 0
+        while not self.stop.is_set():
+            # Short waits, so a timed-out run is not held up by trackers of stuck jobs
+            response = self.request(None, 'GET', f"/job/{job_id}", params={'since': version, 'wait': 5})
+            if response is None or response.status_code != 200:
+                self._finish(job_id, 'failed', time.monotonic() - submitted)
+                return
+            status = response.json()
+            version = status.get('version', version)
+            if status.get('state') in FINISHED:
+                self._finish(job_id, status['state'], time.monotonic() - submitted)
+                return
+
+    def _finish(self, job_id, state, latency):
+        with self.lock:
+            self.finished[job_id or f"rejected-{len(self.finished)}"] = (state, latency)
+            if job_id in self.pending:
+                self.pending.remove(job_id)
+            if len(self.finished) >= self.args.jobs:
+                self.all_done.set()
+
+    def poll(self):
+        with self.lock:
+            job_id = random.choice(self.pending) if self.pending else None
+        if job_id:
+            self.request('/job/<id>', 'GET', f"/job/{job_id}")
+
+    def run(self):
+        args = self.args
+        stop = self.stop
+        load = ThreadPoolExecutor(max_workers=32)
+        trackers = ThreadPoolExecutor(max_workers=args.jobs)
+        try:
+            counter = iter(range(args.jobs))
+
+            def submit_next():
+                number = next(counter, None)
+                if number is None:
+                    return
+                self.submit(number, trackers)
+
+            rates = [
+                Rate(args.rate, submit_next, load, stop),
+                Rate(args.poll_rate, self.poll, load, stop),
+                Rate(args.status_rate, lambda: self.request('/status', 'GET', '/status'), load, stop),
+                Rate(args.files_rate, lambda: self.request('/files', 'GET', '/files'), load, stop),
+            ]
+            started = time.monotonic()
+            for rate in rates:
+                rate.thread.start()
+            completed = self.all_done.wait(args.timeout)
+            elapsed = time.monotonic() - started
+            stop.set()
+            for rate in rates:
+                rate.thread.join()
+        finally:
+            stop.set()
+            # Do not wait for requests in flight, --timeout bounds the run
+            load.shutdown(wait=False, cancel_futures=True)
+            trackers.shutdown(wait=False, cancel_futures=True)
+        return completed, elapsed
+
+
+def run_config(services, args, downloads, library):
+    tmp = tempfile.mkdtemp(prefix='bench-pipeline-')
+    download_dir = os.path.join(tmp, 'downloads')
+    data_dir = os.path.join(tmp, 'data')
+    populate_library(download_dir, os.path.join(data_dir, 'download_archive.txt'), library)
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        DOWNLOAD_DIR=download_dir,
+        STAGING_DIR=os.path.join(tmp, 'staging'),
+        DATA_DIR=data_dir,
+        MAX_CONCURRENT_DOWNLOADS=str(downloads),
+        ODESLI_API_URL=services.odesli_api_url,
+        ODESLI_RATE_LIMIT='1000000',
+        ODESLI_RATE_BURST='1000',
+        USE_BEETS=str(args.beets),
+        FAKE_BEET_LIBRARY=download_dir,
+        PATH=STANDINS + os.pathsep + os.environ.get('PATH', ''),
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'),
+        FLASK_DEBUG='False',
+    )
+    log_path = os.path.join(tmp, 'app.log')
+    with open(log_path, 'w') as log:
+        app = subprocess.Popen([sys.executable, os.path.join(STANDINS, 'serve_app.py'), str(port)],
+                               env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(base_url + '/health', timeout=1)
+                break
+            except requests.RequestException:
+                if app.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"App did not start, see {log_path}")
+                time.sleep(0.2)
+
+        load = LoadRun(base_url, args)
+        completed, elapsed = load.run()
+        metrics = requests.get(base_url + '/metrics', timeout=10).text
+        rss = peak_rss_mb(app.pid)
+    finally:
+        app.terminate()
+        try:
+            app.wait(10)
+        except subprocess.TimeoutExpired:
+            app.kill()
+    if args.keep:
+        print(f"  kept {tmp}")
+    else:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    states = [state for state, _ in load.finished.values()]
+    stage_series = parse_histograms(metrics, 'music_query_stage_seconds')
+    wait = merge_buckets(parse_histograms(metrics, 'music_query_queue_wait_seconds').values())
+    return {
+        'completed': completed,
+        'elapsed': elapsed,
+        'done': states.count('completed'),
+        'failed': states.count('failed'),
+        'latencies': [latency for state, latency in load.finished.values() if state == 'completed'],
+        'stages': {dict(key).get('stage'): buckets for key, buckets in stage_series.items()},
+        'wait': wait,
+        'rss': rss,
+        'http': dict(load.http),
+        'errors': dict(load.errors),
+    }
+
+
+def fmt(seconds, scale=1.0, unit='s'):
+    return f"{seconds * scale:8.2f}{unit}" if seconds is not None else f"{'-':>8} "
+
+
+def report(downloads, library, result):
+    jobs = result['done'] + result['failed']
+    rate = result['done'] / result['elapsed'] if result['elapsed'] else 0.0
+    print(f"MAX_CONCURRENT_DOWNLOADS={downloads} library={library}: {result['done']} completed, "
+          f"{result['failed']} failed of {jobs} in {result['elapsed']:.1f}s = {rate:.2f} jobs/s"
+          + ('' if result['completed'] else ' (timed out)'))
+    print(f"  {'':<16}{'p50':>9}{'p99':>9}")
+    latencies = result['latencies']
+    print(f"  {'job':<16}{fmt(percentile(latencies, 0.5))}{fmt(percentile(latencies, 0.99))}")
+    for stage in STAGES:
+        buckets = result['stages'].get(stage)
+        if buckets:
+            print(f"  {stage:<16}{fmt(histogram_quantile(buckets, 0.5))}{fmt(histogram_quantile(buckets, 0.99))}")
+    print(f"  {'queue wait':<16}{fmt(histogram_quantile(result['wait'], 0.5))}"
+          f"{fmt(histogram_quantile(result['wait'], 0.99))}")
+    for endpoint, seconds in sorted(result['http'].items()):
+        errors = result['errors'].get(endpoint, 0)
+        print(f"  {endpoint:<16}{fmt(percentile(seconds, 0.5), 1000, 'ms')}"
+              f"{fmt(percentile(seconds, 0.99), 1000, 'ms')}  {len(seconds)} requests"
+              + (f", {errors} errors" if errors else ''))
+    if result['rss'] is not None:
+        print(f"  peak RSS {result['rss']:.1f} MB")
+    return rate
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=40, help='Downloads per run')
+    parser.add_argument('--rate', type=float, default=4, help='/download requests per second')
+    parser.add_argument('--poll-rate', type=float, default=10, help='/job/<id> requests per second')
+    parser.add_argument('--status-rate', type=float, default=2, help='/status requests per second')
+    parser.add_argument('--files-rate', type=float, default=1, help='/files requests per second')
+    parser.add_argument('--downloads', type=int_list, default=[1, 2, 4],
+                        help='MAX_CONCURRENT_DOWNLOADS settings, comma separated')
+    parser.add_argument('--library', type=int_list, default=[0, 10000],
+                        help='Library sizes (tracks already downloaded), comma separated')
+    parser.add_argument('--audio-seconds', type=int, default=30, help='Length of the synthetic track')
+    parser.add_argument('--bandwidth', type=float, default=2e6, help='Bytes/s per audio download, 0 = unthrottled')
+    parser.add_argument('--odesli-latency', type=float, default=0.2, help='Seconds per fake Odesli lookup')
+    parser.add_argument('--beets', action='store_true', help='Import with the fake beet instead of moving files')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for one run')
+    parser.add_argument('--keep', action='store_true', help='Keep each run\'s directories and app.log')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-audio-') as audio_dir:
+        audio = write_tone(os.path.join(audio_dir, 'track.wav'), args.audio_seconds)
+        services = FakeServices(audio, odesli_latency=args.odesli_latency, bandwidth=args.bandwidth).start()
+        summary = []
+        try:
+            for library in args.library:
+                for downloads in args.downloads:
+                    result = run_config(services, args, downloads, library)
+                    summary.append((downloads, library, report(downloads, library, result)))
+                    print()
+        finally:
+            services.stop()
+
+    print(f"{'downloads':>9} {'library':>8} {'jobs/s':>7}")
+    for downloads, library, rate in summary:
+        print(f"{downloads:>9} {library:>8} {rate:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
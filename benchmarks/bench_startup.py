@@ -0,0 +1,83 @@
+"""
+Cold start of the app: each run starts a new interpreter, imports app.routes and calls
+create_app(), with Swagger on and off. Reports the median import and create_app() times,
+which heavy modules got loaded, the first yt-dlp lease (deferred until the first job) and,
+from `python -X importtime`, the modules that took longest to import.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, sys, time
+start = time.perf_counter()
+import app.routes
+imported = time.perf_counter()
+from app import create_app
+create_app()
+created = time.perf_counter()
+loaded = {name: name in sys.modules for name in ('yt_dlp', 'requests', 'flasgger')}
+from app.services.ytdl import ytdl_pool
+with ytdl_pool.lease({'quiet': True}):
+    pass
+leased = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_lease': leased - created, 'loaded': loaded}))
+"""
+
+
+def probe(env, importtime=False):
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    result = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    """Top-level imports and the app's own modules by cumulative import time, from -X importtime output."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, micros, name = line[len('import time:'):].split('|')
+        nesting = len(name) - len(name.lstrip()) - 1
+        name = name.strip()
+        if nesting == 0 or name.startswith('app.'):
+            cumulative[name] = max(cumulative.get(name, 0), int(micros))
+    return sorted(cumulative.items(), key=lambda item: -item[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as tmp:
+        base = {**os.environ, 'DATA_DIR': os.path.join(tmp, 'data'), 'STAGING_DIR': os.path.join(tmp, 'staging'),
+                'DOWNLOAD_DIR': os.path.join(tmp, 'downloads'), 'RESOLVE_CACHE_PATH': '', 'LOG_LEVEL': 'WARNING'}
+        probe(base)  # Warm the bytecode and OS file caches
+        for swagger in ('True', 'False'):
+            env = {**base, 'ENABLE_SWAGGER': swagger}
+            runs = [probe(env)[0] for _ in range(args.runs)]
+            print(f"ENABLE_SWAGGER={swagger}:")
+            for key in ('import', 'create_app', 'first_lease'):
+                print(f"  {key:>11}: {statistics.median(run[key] for run in runs) * 1000:7.1f}ms")
+            loaded = ', '.join(f"{name}={'yes' if value else 'no'}" for name, value in runs[0]['loaded'].items())
+            print(f"  loaded after create_app: {loaded}")
+
+        _, stderr = probe({**base, 'ENABLE_SWAGGER': 'True'}, importtime=True)
+        print("Slowest imports (cumulative, ENABLE_SWAGGER=True, includes the first lease):")
+        for name, micros in slowest_imports(stderr, args.top):
+            print(f"  {name:<32} {micros / 1000:7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Per-job YoutubeDL overhead: a new instance per job (YTDL_MAX_REUSE=0) against warm pooled
+instances. Each job extracts and downloads one track from the local fake services through
+the stub extractor, so the difference is instance setup and connection reuse.
+
+    python benchmarks/bench_ytdl_pool.py --jobs 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(HERE, 'standins'))
+
+from fake_services import FakeServices, write_tone  # noqa: E402
+from stub_extractor import install  # noqa: E402
+from app.services.ytdl import YoutubeDLPool  # noqa: E402
+
+
+def run(pool, services, jobs, download, staging):
+    opts = {'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True, 'noprogress': True}
+    seconds = []
+    for i in range(jobs):
+        url = f"{services.base_url}/track/{i:011x}"
+        job_opts = {**opts, 'outtmpl': os.path.join(staging, f"job{i}", '%(title)s.%(ext)s')}
+        start = time.perf_counter()
+        with pool.lease(job_opts) as ydl:
+            ydl.extract_info(url, download=download)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--audio-seconds', type=int, default=2, help='Length of the synthetic track')
+    parser.add_argument('--max-uses', type=int, default=50, help='Jobs per warm instance')
+    args = parser.parse_args()
+
+    install()
+    with tempfile.TemporaryDirectory(prefix='bench-ytdl-') as tmp:
+        services = FakeServices(write_tone(os.path.join(tmp, 'track.wav'), args.audio_seconds),
+                                odesli_latency=0).start()
+        try:
+            results = {}
+            for download in (False, True):
+                for name, max_uses in (('new per job', 0), ('warm pool', args.max_uses)):
+                    pool = YoutubeDLPool(max_uses)
+                    run(pool, services, 2, download, os.path.join(tmp, 'warmup'))  # Imports, disk cache
+                    results[(download, name)] = run(pool, services, args.jobs, download,
+                                                    os.path.join(tmp, f"{name}-{download}"))
+        finally:
+            services.stop()
+
+    for download in (False, True):
+        label = 'extract + download' if download else 'extract only'
+        fresh = statistics.mean(results[(download, 'new per job')])
+        for name in ('new per job', 'warm pool'):
+            seconds = sorted(results[(download, name)])
+            mean = statistics.mean(seconds)
+            print(f"{label:>18} {name:>11}: mean {mean * 1000:7.2f}ms  p50 {seconds[len(seconds) // 2] * 1000:7.2f}ms  "
+                  f"p99 {seconds[min(len(seconds) - 1, int(0.99 * len(seconds)))] * 1000:7.2f}ms")
+        print(f"{'':>18} saved per job: {(fresh - statistics.mean(results[(download, 'warm pool')])) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
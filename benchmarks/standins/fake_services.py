@@ -0,0 +1,132 @@
+"""
+Local stand-ins for the network: a fake Odesli API and an audio host, on one HTTP server.
+
+    GET /v1-alpha.1/links?url=<source>  Odesli-shaped answer linking <source> to /track/<id>
+    GET /audio/<id>.wav                 The synthetic track, optionally throttled
+
+/track/<id> pages are never fetched, the stub extractor (stub_extractor.py) turns them
+into a direct /audio link.
+"""
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+CHUNK = 64 * 1024
+
+
+def write_tone(path, seconds=30, rate=22050):
+    """A mono 16-bit sine wave WAV, so post-processing has real audio to transcode."""
+    frame = [struct.pack('<h', int(12000 * math.sin(2 * math.pi * 440 * i / rate))) for i in range(rate)]
+    second = b''.join(frame)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        for _ in range(int(seconds)):
+            wav.writeframes(second)
+    return path
+
+
+def track_id(source_url):
+    return hashlib.sha1(source_url.encode()).hexdigest()[:11]
+
+
+class FakeServices:
+    """
+    :param audio_path: file served for every track
+    :param odesli_latency: seconds each Odesli lookup takes
+    :param bandwidth: bytes per second per audio download, 0 for unthrottled
+    """
+
+    def __init__(self, audio_path, odesli_latency=0.2, bandwidth=0, host='127.0.0.1', port=0):
+        self.audio_path = audio_path
+        self.odesli_latency = odesli_latency
+        self.bandwidth = bandwidth
+        self.lookups = 0
+        self.downloads = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = None
+
+    @property
+    def odesli_api_url(self):
+        """Value for ODESLI_API_URL."""
+        return f"{self.base_url}/v1-alpha.1/links?url="
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(body=False)
+
+            def do_GET(self, body=True):
+                parts = urlsplit(self.path)
+                if parts.path.endswith('/links'):
+                    source = (parse_qs(parts.query).get('url') or [''])[0]
+                    time.sleep(services.odesli_latency)
+                    with services._lock:
+                        services.lookups += 1
+                    link = f"{services.base_url}/track/{track_id(source)}"
+                    payload = json.dumps({'linksByPlatform': {'youtube': {'url': link}}}).encode()
+                    self._send(200, 'application/json', len(payload))
+                    if body:
+                        self.wfile.write(payload)
+                elif parts.path.startswith('/audio/'):
+                    size = os.path.getsize(services.audio_path)
+                    self._send(200, 'audio/wav', size)
+                    if body:
+                        with services._lock:
+                            services.downloads += 1
+                        self._stream(size)
+                else:
+                    self._send(404, 'text/plain', 0)
+
+            def _send(self, code, content_type, length):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(length))
+                self.end_headers()
+
+            def _stream(self, size):
+                started = time.monotonic()
+                sent = 0
+                with open(services.audio_path, 'rb') as audio:
+                    while sent < size:
+                        chunk = audio.read(CHUNK)
+                        if not chunk:
+                            break
+                        try:
+                            self.wfile.write(chunk)
+                        except (BrokenPipeError, ConnectionResetError):
+                            return
+                        sent += len(chunk)
+                        if services.bandwidth:
+                            delay = started + sent / services.bandwidth - time.monotonic()
+                            if delay > 0:
+                                time.sleep(delay)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True, name='fake-services')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,28 @@
+"""
+Runs the app with the stub extractor on a threaded WSGI server, configured by the
+environment like the real service:
+
+    python benchmarks/standins/serve_app.py PORT
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+sys.path.insert(0, HERE)
+
+
+def main():
+    from werkzeug.serving import make_server
+    from stub_extractor import install
+    install()
+    from app import create_app
+
+    port = int(sys.argv[1])
+    server = make_server('127.0.0.1', port, create_app(), threaded=True)
+    print(f"Serving on 127.0.0.1:{port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+yt-dlp extractor for the fake services' /track/<id> links, answering with track metadata
+and a direct link to the synthetic audio, like a YouTube extractor would without the
+page and player requests.
+"""
+import re
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class StubIE(InfoExtractor):
+    IE_NAME = 'stub'
+    _VALID_URL = r'(?P<base>https?://127\.0\.0\.1:\d+)/track/(?P<id>[0-9a-f]+)'
+
+    def _real_extract(self, url):
+        match = re.match(self._VALID_URL, url)
+        track_id = match.group('id')
+        return {
+            'id': track_id,
+            'title': f"Track {track_id}",
+            'artist': 'Benchmark Artist',
+            'album': 'Benchmark Album',
+            'uploader': 'Benchmark',
+            'url': f"{match.group('base')}/audio/{track_id}.wav",
+            'ext': 'wav',
+            'vcodec': 'none',
+            'acodec': 'pcm_s16le',
+        }
+
+
+def install():
+    """Makes every YoutubeDL in this process try StubIE before its built-in extractors."""
+    original = yt_dlp.YoutubeDL.add_default_info_extractors
+    if getattr(original, 'stub_installed', False):
+        return
+
+    def add_default_info_extractors(self):
+        self.add_info_extractor(StubIE())
+        original(self)
+
+    add_default_info_extractors.stub_installed = True
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_default_info_extractors
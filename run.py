@@ -1,9 +1,9 @@
 from app import create_app
 
-app = create_app()
-
 if __name__ == '__main__':
+    # Not at import: post-processing pool processes are spawned and re-import this module
     from app.config import Config
+    app = create_app()
     app.run(
         host=Config.FLASK_HOST,
         port=Config.FLASK_PORT,
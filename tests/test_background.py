@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault('JOB_STORE', 'memory')
+os.environ.setdefault('QUEUE_BACKEND', 'local')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='music-query-test-'))
+os.environ.setdefault('ENABLE_SWAGGER', 'False')
+
+
+def _create_app_in_child():
+    """What a spawned post-processing process does when it re-imports an entry script calling create_app()."""
+    from app import create_app
+    from app.services.queue import job_queue
+    create_app()
+    return job_queue.running, sorted(thread.name for thread in threading.enumerate())
+
+
+class SpawnedChildTest(unittest.TestCase):
+    def test_pool_child_starts_no_background_threads(self):
+        # The same context as PostprocessPool
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            running, threads = pool.submit(_create_app_in_child).result(timeout=60)
+        self.assertFalse(running)
+        self.assertEqual(threads, ['MainThread'])
+
+
+if __name__ == '__main__':
+    unittest.main()
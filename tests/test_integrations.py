@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('JOB_STORE', 'memory')
+os.environ.setdefault('QUEUE_BACKEND', 'local')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='music-query-test-'))
+
+from app.services.integrations import BeetsImportBatcher  # noqa: E402
+
+STANDINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'standins')
+
+
+class SkipAttributionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='music-query-test-')
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.env = {key: os.environ.get(key) for key in ('PATH', 'FAKE_BEET_SKIP', 'FAKE_BEET_STARTUP',
+                                                          'FAKE_BEET_PER_FILE', 'FAKE_BEET_LIBRARY')}
+        os.environ.update(PATH=STANDINS + os.pathsep + os.environ['PATH'], FAKE_BEET_SKIP='2',
+                          FAKE_BEET_STARTUP='0', FAKE_BEET_PER_FILE='0', FAKE_BEET_LIBRARY='library')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        for key, value in self.env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_relative_staging_dirs_match_absolute_log_paths(self):
+        # Like the default STAGING_DIR, while beets logs absolute paths
+        paths = [os.path.join('staging', name) for name in ('a', 'b', 'c')]
+        for path in paths:
+            os.makedirs(path)
+            open(os.path.join(path, 'track.mp3'), 'w').close()
+
+        results = BeetsImportBatcher()._import(paths)
+
+        self.assertEqual(results, {paths[0]: True, paths[1]: False, paths[2]: True})
+        self.assertTrue(os.path.exists(os.path.join(paths[1], 'track.mp3')))
+
+
+if __name__ == '__main__':
+    unittest.main()
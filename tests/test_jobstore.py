@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from app.services.jobstore import SQLiteJobStore
+
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='music-query-test-')
+        self.store = SQLiteJobStore(os.path.join(self.dir, 'jobs.db'))
+        self.store.enqueue_job('job-1', 'pipeline:test', [], {}, False, {'n': 1}, {'state': 'queued'}, 'download')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_leased_job_is_not_claimed_twice(self):
+        self.assertEqual(self.store.claim('download', 'worker-a', 30)['id'], 'job-1')
+        self.assertIsNone(self.store.claim('download', 'worker-b', 30))
+
+    def test_expired_lease_is_reclaimed(self):
+        self.store.claim('download', 'worker-a', 0.2)
+        self.store.handoff('job-1', 'import', 2, {'n': 2})
+        self.store.claim('import', 'worker-a', 0.2)
+        time.sleep(0.3)  # worker-a died without finishing the job
+        record = self.store.claim('import', 'worker-b', 30)
+        self.assertEqual(record['id'], 'job-1')
+        self.assertEqual((record['step'], record['ctx']), (2, {'n': 2}))
+        # worker-a's heartbeat no longer extends a lease it lost
+        self.store.renew_leases('worker-a', ['job-1'], 30)
+        self.assertIsNone(self.store.claim('import', 'worker-c', 30))
+
+    def test_renewed_lease_is_kept(self):
+        self.store.claim('download', 'worker-a', 0.2)
+        for _ in range(3):
+            time.sleep(0.1)
+            self.store.renew_leases('worker-a', ['job-1'], 0.2)
+        self.assertIsNone(self.store.claim('download', 'worker-b', 30))
+
+    def test_finished_job_is_not_reclaimed(self):
+        self.store.claim('download', 'worker-a', 0.2)
+        self.store.finish('job-1')
+        time.sleep(0.3)
+        self.assertIsNone(self.store.claim('download', 'worker-b', 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
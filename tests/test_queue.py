@@ -0,0 +1,45 @@
+import os
+import tempfile
+import time
+import unittest
+
+os.environ.setdefault('JOB_STORE', 'memory')
+os.environ.setdefault('QUEUE_BACKEND', 'local')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='music-query-test-'))
+
+from app.config import Config  # noqa: E402
+from app.services.queue import job_queue, Pipeline  # noqa: E402
+
+
+def _noop(ctx):
+    ctx.setdefault('ran', []).append(len(ctx.get('ran', [])))
+
+
+# Two steps on the resolve stage in a row, like download_pipeline's resolve and playlist expansion
+same_stage_pipeline = Pipeline(
+    'test_same_stage',
+    ('resolve', _noop),
+    ('resolve', _noop),
+    ('download', _noop),
+)
+
+
+class ConsecutiveStepsTest(unittest.TestCase):
+    def test_more_jobs_than_resolve_workers_and_slots(self):
+        job_queue.start()
+        jobs = 3 * (Config.RESOLVE_WORKERS + Config.STAGE_QUEUE_SIZE) + 1
+        job_ids = [job_queue.add_job(same_stage_pipeline) for _ in range(jobs)]
+
+        deadline = time.monotonic() + 20
+        pending = set(job_ids)
+        while pending and time.monotonic() < deadline:
+            pending = {job_id for job_id in pending
+                       if job_queue.get_job_status(job_id)['state'] not in ('completed', 'failed')}
+            time.sleep(0.05)
+        self.assertEqual(pending, set(), f"{len(pending)} of {jobs} jobs never finished")
+        for job_id in job_ids:
+            self.assertEqual(job_queue.get_job_status(job_id)['state'], 'completed')
+
+
+if __name__ == '__main__':
+    unittest.main()
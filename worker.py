@@ -0,0 +1,35 @@
+"""
+Standalone download worker. Claims jobs from the shared queue (QUEUE_BACKEND=sqlite)
+without serving HTTP, so downloading can be scaled separately from the web workers.
+"""
+import logging
+import signal
+import sys
+import threading
+
+from app.config import Config
+from app.services.queue import job_queue
+from app.services import downloader  # noqa: F401 - registers the download pipeline
+from app.services.background import start_background
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=getattr(logging, Config.LOG_LEVEL, logging.INFO),
+        stream=sys.stdout
+    )
+    if Config.QUEUE_BACKEND != 'sqlite':
+        logging.warning("QUEUE_BACKEND is not 'sqlite': this worker only sees jobs it enqueues itself.")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    start_background()
+    stop.wait()
+    job_queue.shutdown()
+
+
+if __name__ == '__main__':
+    main()